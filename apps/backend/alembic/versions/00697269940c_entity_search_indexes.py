@@ -0,0 +1,36 @@
+"""pg_trgm search indexes and typeahead prefix index on entities
+
+Revision ID: 00697269940c
+Revises: 9ff666cc37ae
+Create Date: 2026-10-18 17:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '00697269940c'
+down_revision: Union[str, Sequence[str], None] = '9ff666cc37ae'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRGM_COLUMNS = ['name', 'contact_email', 'contact_phone', 'notes']
+
+
+def upgrade() -> None:
+    """Trigram GIN indexes for ILIKE '%term%' search plus a btree for name-prefix typeahead."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        for col in TRGM_COLUMNS:
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entities_{col}_trgm ON entities USING gin ({col} gin_trgm_ops)")
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entities_name_prefix ON entities ((lower(name) COLLATE "C"))')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_entities_name_prefix")
+        for col in TRGM_COLUMNS:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS ix_entities_{col}_trgm")
+    # the extension may have other users; leave it installed
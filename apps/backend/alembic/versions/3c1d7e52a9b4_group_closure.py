@@ -0,0 +1,53 @@
+"""group hierarchy closure table and entity_groups(group_id) index
+
+Revision ID: 3c1d7e52a9b4
+Revises: 00697269940c
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d7e52a9b4'
+down_revision: Union[str, Sequence[str], None] = '00697269940c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Create group_closure and fill it from the existing parent_group_id links."""
+    op.create_table(
+        'group_closure',
+        sa.Column('ancestor_id', sa.UUID(), nullable=False),
+        sa.Column('descendant_id', sa.UUID(), nullable=False),
+        sa.Column('depth', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['ancestor_id'], ['groups.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['descendant_id'], ['groups.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+    )
+    op.create_index('ix_group_closure_descendant', 'group_closure', ['descendant_id', 'ancestor_id'])
+    # existing data may already contain cycles; the CYCLE clause keeps the walk finite
+    op.execute("""
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM groups
+            UNION ALL
+            SELECT t.ancestor_id, g.id, t.depth + 1
+            FROM tree t JOIN groups g ON g.parent_group_id = t.descendant_id
+        ) CYCLE descendant_id SET is_cycle USING path
+        INSERT INTO group_closure (ancestor_id, descendant_id, depth)
+        SELECT DISTINCT ON (ancestor_id, descendant_id) ancestor_id, descendant_id, depth
+        FROM tree WHERE NOT is_cycle
+        ORDER BY ancestor_id, descendant_id, depth
+    """)
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entity_groups_group_id ON entity_groups (group_id, entity_id)")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_entity_groups_group_id")
+    op.drop_index('ix_group_closure_descendant', table_name='group_closure')
+    op.drop_table('group_closure')
@@ -0,0 +1,43 @@
+"""canonical (LEAST/GREATEST) unique index on graph_edges
+
+Revision ID: 5e8a41c07d2f
+Revises: 3c1d7e52a9b4
+Create Date: 2026-10-18 19:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a41c07d2f'
+down_revision: Union[str, Sequence[str], None] = '3c1d7e52a9b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Enable the undirected uniqueness index the init migration left commented out."""
+    # (a, b) and (b, a) rows are the same edge: keep the oldest of each pair
+    op.execute("""
+        DELETE FROM graph_edges e
+        USING graph_edges keep
+        WHERE LEAST(e.a_entity_id, e.b_entity_id) = LEAST(keep.a_entity_id, keep.b_entity_id)
+          AND GREATEST(e.a_entity_id, e.b_entity_id) = GREATEST(keep.a_entity_id, keep.b_entity_id)
+          AND (keep.created_at, keep.id) < (e.created_at, e.id)
+    """)
+    # the app stores pairs as (smaller id, larger id); bring stragglers in line
+    op.execute("""
+        UPDATE graph_edges SET a_entity_id = b_entity_id, b_entity_id = a_entity_id
+        WHERE a_entity_id > b_entity_id
+    """)
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_graph_edges_canonical
+            ON graph_edges (LEAST(a_entity_id, b_entity_id), GREATEST(a_entity_id, b_entity_id))
+        """)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS uq_graph_edges_canonical")
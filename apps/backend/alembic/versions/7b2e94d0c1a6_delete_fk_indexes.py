@@ -0,0 +1,29 @@
+"""indexes behind the foreign keys hit by group and entity deletes
+
+Revision ID: 7b2e94d0c1a6
+Revises: 5e8a41c07d2f
+Create Date: 2026-10-18 20:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e94d0c1a6'
+down_revision: Union[str, Sequence[str], None] = '5e8a41c07d2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Without these, every deleted group/entity seq-scans entities/graph_edges for its FK action."""
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_entities_main_group_id ON entities (main_group_id)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_graph_edges_b_entity_id ON graph_edges (b_entity_id)")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_graph_edges_b_entity_id")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_entities_main_group_id")
@@ -79,8 +79,7 @@ def upgrade() -> None:
         sa.UniqueConstraint('a_entity_id', 'b_entity_id', name='uq_edge_pair')
     )
 
-    # OPTIONAL: canonical undirected uniqueness (LEAST/GREATEST) index
-    # Uncomment if you want DB to forbid (b,a) when (a,b) exists independent of ordering
+    # Canonical undirected uniqueness (LEAST/GREATEST) index: enabled by 5e8a41c07d2f
     # op.execute("""
     #     CREATE UNIQUE INDEX uq_graph_edges_canonical
     #     ON graph_edges (LEAST(a_entity_id, b_entity_id), GREATEST(a_entity_id, b_entity_id));
@@ -0,0 +1,28 @@
+"""entities (name, id) index for keyset pagination
+
+Revision ID: 9ff666cc37ae
+Revises: 809d6ac9ef10
+Create Date: 2026-10-18 17:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '9ff666cc37ae'
+down_revision: Union[str, Sequence[str], None] = '809d6ac9ef10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index the GET /entities sort order so each page is an index range scan."""
+    # CONCURRENTLY can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_entities_name_id', 'entities', ['name', 'id'], postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_entities_name_id', table_name='entities', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,25 @@
+"""sequence stamping commits for the graph change log
+
+Revision ID: c41d7a9e2b58
+Revises: 7b2e94d0c1a6
+Create Date: 2026-10-18 22:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7a9e2b58'
+down_revision: Union[str, Sequence[str], None] = '7b2e94d0c1a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Writers take a value just before committing so the change log can drop rows a later commit already logged."""
+    op.execute("CREATE SEQUENCE IF NOT EXISTS graph_change_seq")
+
+
+def downgrade() -> None:
+    op.execute("DROP SEQUENCE IF EXISTS graph_change_seq")
@@ -0,0 +1,345 @@
+"""``POST /batch``: an editing session's changes in one request and one transaction.
+
+The body is an ordered list of operations::
+
+    {"op": "create" | "update" | "delete",
+     "type": "entity" | "group" | "membership" | "edge",
+     "id": ..., "data": {...}}                  # entity / group / edge
+    {"op": ..., "type": "membership", "entity_id": ..., "group_id": ...}
+    {"op": ..., "type": "edge", "a_id": ..., "b_id": ..., "label": ...}  # create, or delete by pair
+
+Creates may carry their own ``id`` so later operations in the same batch can
+refer to them. Consecutive operations of the same kind run as one set-based
+statement, so order is kept where it matters at the cost of one statement
+per run, not per operation. Any failure rolls the whole batch back. After
+the last run the touched rows are read back once and published as a single
+graph change, which is one version bump however many operations there were.
+"""
+
+import uuid
+from collections import defaultdict
+from itertools import groupby
+from fastapi import APIRouter, Body, Depends, HTTPException
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from uuid import UUID
+from app.db.session import get_db
+from app.db.read_models import GRAPH_EDGES, GRAPH_ENTITIES, GRAPH_GROUPS
+from app.models.models import Edge, Entity, EntityGroup, Group
+from app.api.edges import canonical_pair, insert_edges
+from app.api.entities import delete_entities, reassign_main_groups
+from app.api.groups import delete_groups
+from app.core import group_tree
+from app.core.graph_snapshot import commit_ordered, group_payload, link_payload, node_payload, record_change
+
+router = APIRouter()
+
+MAX_OPS = 1000
+
+ENTITY_COLUMNS = {'name', 'contact_email', 'contact_phone', 'notes', 'main_group_id', 'is_current_user', 'pos_x', 'pos_y'}
+GROUP_COLUMNS = {'name', 'description', 'color_hex', 'parent_group_id'}
+EDGE_COLUMNS = {'label'}
+UUID_COLUMNS = {'main_group_id', 'parent_group_id'}
+
+_ADD_MEMBERSHIPS = """
+INSERT INTO entity_groups (entity_id, group_id)
+SELECT e, g FROM unnest(CAST(:entity_ids AS uuid[]), CAST(:group_ids AS uuid[])) AS p(e, g)
+ON CONFLICT DO NOTHING
+"""
+
+# like create_entity: someone without a main group gets the first group they join
+_FILL_MAIN = """
+UPDATE entities e SET main_group_id = p.g
+FROM (
+    SELECT DISTINCT ON (e) e, g
+    FROM unnest(CAST(:entity_ids AS uuid[]), CAST(:group_ids AS uuid[])) WITH ORDINALITY AS p(e, g, n)
+    ORDER BY e, n
+) p
+WHERE e.id = p.e AND e.main_group_id IS NULL
+"""
+
+_REMOVE_MEMBERSHIPS = """
+DELETE FROM entity_groups m
+USING unnest(CAST(:entity_ids AS uuid[]), CAST(:group_ids AS uuid[])) AS p(e, g)
+WHERE m.entity_id = p.e AND m.group_id = p.g
+"""
+
+_EDGE_IDS = """
+SELECT p.a, p.b, e.id
+FROM unnest(CAST(:a AS uuid[]), CAST(:b AS uuid[])) AS p(a, b)
+JOIN graph_edges e ON LEAST(e.a_entity_id, e.b_entity_id) = p.a AND GREATEST(e.a_entity_id, e.b_entity_id) = p.b
+"""
+
+
+class _Batch:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        # ids whose final state goes into the graph change
+        self.entities: set[UUID] = set()
+        self.groups: set[UUID] = set()
+        self.edges: set[UUID] = set()
+
+
+def _bad(i, detail, status=400):
+    return HTTPException(status_code=status, detail=f'ops[{i}]: {detail}')
+
+
+def _uuid(i, value, what='id'):
+    try:
+        return UUID(str(value))
+    except (TypeError, ValueError):
+        raise _bad(i, f'invalid {what}')
+
+
+def _pair(i, op):
+    try:
+        return canonical_pair(op)
+    except HTTPException as e:
+        raise _bad(i, e.detail)
+
+
+def _data(i, op, allowed) -> dict:
+    data = dict(op.get('data') or {})
+    unknown = sorted(set(data) - allowed)
+    if unknown:
+        raise _bad(i, f"unknown field(s): {', '.join(unknown)}")
+    for k in UUID_COLUMNS & data.keys():
+        data[k] = _uuid(i, data[k], k) if data[k] else None
+    # blank strings would collide on the unique columns
+    for k in ('contact_email', 'contact_phone'):
+        if data.get(k) == '':
+            data[k] = None
+    return data
+
+
+async def _existing(db, model, ops, ids):
+    found = set((await db.scalars(select(model.id).where(model.id.in_(ids)))).all())
+    for (i, _), oid in zip(ops, ids):
+        if oid not in found:
+            raise _bad(i, 'not found', 404)
+
+
+# -- entities ------------------------------------------------------------
+
+async def _create_entities(b: _Batch, ops):
+    rows = []
+    for i, op in ops:
+        data = _data(i, op, ENTITY_COLUMNS)
+        if not data.get('name'):
+            raise _bad(i, 'name is required')
+        row = dict.fromkeys(ENTITY_COLUMNS)
+        row['is_current_user'] = False
+        row.update(data)
+        row['id'] = _uuid(i, op['id']) if op.get('id') else uuid.uuid4()
+        rows.append(row)
+    await b.db.execute(insert(Entity), rows)
+    b.entities.update(r['id'] for r in rows)
+    return [{'id': str(r['id'])} for r in rows]
+
+
+async def _update_entities(b: _Batch, ops):
+    rows = [{'id': _uuid(i, op.get('id')), **_data(i, op, ENTITY_COLUMNS)} for i, op in ops]
+    await _existing(b.db, Entity, ops, [r['id'] for r in rows])
+    changed = [r for r in rows if len(r) > 1]
+    if changed:
+        # ORM bulk UPDATE by primary key: one executemany per distinct set of columns
+        await b.db.execute(update(Entity), changed)
+    b.entities.update(r['id'] for r in rows)
+    return [{'updated': True} for _ in rows]
+
+
+async def _delete_entities(b: _Batch, ops):
+    ids = [_uuid(i, op.get('id')) for i, op in ops]
+    gone = set(await delete_entities(b.db, ids))
+    b.entities.update(ids)
+    return [{'deleted': str(eid) in gone} for eid in ids]
+
+
+# -- groups --------------------------------------------------------------
+
+async def _create_groups(b: _Batch, ops):
+    rows = []
+    for i, op in ops:
+        data = _data(i, op, GROUP_COLUMNS)
+        if not data.get('name'):
+            raise _bad(i, 'name is required')
+        row = dict.fromkeys(GROUP_COLUMNS)
+        row.update(data)
+        row['id'] = _uuid(i, op['id']) if op.get('id') else uuid.uuid4()
+        rows.append(row)
+    await b.db.execute(insert(Group), rows)
+    # in op order, so a group can hang under one created earlier in the run
+    for row in rows:
+        await group_tree.add_group(b.db, row['id'], row['parent_group_id'])
+    b.groups.update(r['id'] for r in rows)
+    return [{'id': str(r['id'])} for r in rows]
+
+
+async def _update_groups(b: _Batch, ops):
+    rows = [{'id': _uuid(i, op.get('id')), **_data(i, op, GROUP_COLUMNS)} for i, op in ops]
+    ids = [r['id'] for r in rows]
+    await _existing(b.db, Group, ops, ids)
+    parents = dict((await b.db.execute(select(Group.id, Group.parent_group_id).where(Group.id.in_(ids)))).all())
+    for row in rows:
+        if 'parent_group_id' in row and row['parent_group_id'] != parents[row['id']]:
+            await group_tree.move_group(b.db, row['id'], row['parent_group_id'])
+            parents[row['id']] = row['parent_group_id']
+    changed = [r for r in rows if len(r) > 1]
+    if changed:
+        await b.db.execute(update(Group), changed)
+    b.groups.update(ids)
+    return [{'updated': True} for _ in rows]
+
+
+async def _delete_groups(b: _Batch, ops):
+    ids = [_uuid(i, op.get('id')) for i, op in ops]
+    removed, change = await delete_groups(b.db, ids)
+    b.entities.update(UUID(n['id']) for n in change['nodes'])
+    b.groups.update(ids)
+    return [{'deleted': str(gid) in removed} for gid in ids]
+
+
+# -- memberships ---------------------------------------------------------
+
+def _memberships(ops):
+    pairs = [(_uuid(i, op.get('entity_id'), 'entity_id'), _uuid(i, op.get('group_id'), 'group_id')) for i, op in ops]
+    return pairs, {'entity_ids': [str(e) for e, _ in pairs], 'group_ids': [str(g) for _, g in pairs]}
+
+
+async def _add_memberships(b: _Batch, ops):
+    pairs, params = _memberships(ops)
+    await b.db.execute(text(_ADD_MEMBERSHIPS), params)
+    await b.db.execute(text(_FILL_MAIN), params)
+    b.entities.update(e for e, _ in pairs)
+    return [{'added': True} for _ in pairs]
+
+
+async def _remove_memberships(b: _Batch, ops):
+    pairs, params = _memberships(ops)
+    await b.db.execute(text(_REMOVE_MEMBERSHIPS), params)
+    await reassign_main_groups(b.db, entity_ids={e for e, _ in pairs})
+    b.entities.update(e for e, _ in pairs)
+    return [{'removed': True} for _ in pairs]
+
+
+# -- edges ---------------------------------------------------------------
+
+async def _create_edges(b: _Batch, ops):
+    keys = [_pair(i, op) for i, op in ops]
+    pairs = {}
+    for key, (_, op) in zip(keys, ops):
+        pairs.setdefault(key, op.get('label'))
+    created = {(r.a_entity_id, r.b_entity_id): r.id for r in await insert_edges(b.db, pairs)}
+    ids = dict(created)
+    if len(created) < len(pairs):
+        # already there: report the existing edge, as POST /edges does
+        params = {'a': [str(a) for a, _ in pairs], 'b': [str(b) for _, b in pairs]}
+        ids.update({(a, b_): eid for a, b_, eid in (await b.db.execute(text(_EDGE_IDS), params)).all() if (a, b_) not in ids})
+    b.edges.update(created.values())
+    # a pair repeated within the run is only "created" the first time
+    return [{'id': str(ids[key]), 'created': created.pop(key, None) is not None} for key in keys]
+
+
+async def _update_edges(b: _Batch, ops):
+    rows = [{'id': _uuid(i, op.get('id')), **_data(i, op, EDGE_COLUMNS)} for i, op in ops]
+    await _existing(b.db, Edge, ops, [r['id'] for r in rows])
+    changed = [r for r in rows if len(r) > 1]
+    if changed:
+        await b.db.execute(update(Edge), changed)
+    b.edges.update(r['id'] for r in rows)
+    return [{'updated': True} for _ in rows]
+
+
+async def _delete_edges(b: _Batch, ops):
+    # by id, or by pair (either way round)
+    ids = [_uuid(i, op['id']) if op.get('id') else None for i, op in ops]
+    pairs = {n: _pair(i, op) for n, (i, op) in enumerate(ops) if ids[n] is None}
+    if pairs:
+        params = {'a': [str(a) for a, _ in pairs.values()], 'b': [str(b_) for _, b_ in pairs.values()]}
+        found = {(a, b_): eid for a, b_, eid in (await b.db.execute(text(_EDGE_IDS), params)).all()}
+        for n, key in pairs.items():
+            ids[n] = found.get(key)
+    wanted = [eid for eid in ids if eid is not None]
+    gone = set()
+    if wanted:
+        gone.update((await b.db.scalars(delete(Edge).where(Edge.id.in_(wanted)).returning(Edge.id))).all())
+    b.edges.update(gone)
+    return [{'deleted': eid in gone} for eid in ids]
+
+
+HANDLERS = {
+    ('entity', 'create'): _create_entities,
+    ('entity', 'update'): _update_entities,
+    ('entity', 'delete'): _delete_entities,
+    ('group', 'create'): _create_groups,
+    ('group', 'update'): _update_groups,
+    ('group', 'delete'): _delete_groups,
+    ('membership', 'create'): _add_memberships,
+    ('membership', 'delete'): _remove_memberships,
+    ('edge', 'create'): _create_edges,
+    ('edge', 'update'): _update_edges,
+    ('edge', 'delete'): _delete_edges,
+}
+
+
+def _parents_first(groups):
+    """Group payloads ordered so a parent comes before its children."""
+    pending = {g['id']: g for g in groups}
+    ordered = []
+    while pending:
+        ready = [g for g in pending.values() if g['parentId'] not in pending]
+        # a cycle can't be committed, but don't spin if one ever shows up
+        for g in ready or list(pending.values()):
+            ordered.append(pending.pop(g['id']))
+    return ordered
+
+
+async def _change(b: _Batch) -> dict:
+    """The graph change for everything the batch touched, read back in its final state."""
+    db = b.db
+    change = defaultdict(list)
+    if b.groups:
+        rows = (await db.execute(GRAPH_GROUPS.where(Group.id.in_(b.groups)))).all()
+        change['groups'] = _parents_first([group_payload(r) for r in rows])
+        change['removedGroups'] = [str(g) for g in b.groups - {r.id for r in rows}]
+    if b.entities:
+        rows = (await db.execute(GRAPH_ENTITIES.where(Entity.id.in_(b.entities)))).all()
+        memberships = defaultdict(list)
+        for eid, gid in (await db.execute(
+            select(EntityGroup.entity_id, EntityGroup.group_id).where(EntityGroup.entity_id.in_(b.entities))
+        )).all():
+            memberships[eid].append(gid)
+        change['nodes'] = [node_payload(r, memberships[r.id]) for r in rows]
+        change['removedNodes'] = [str(e) for e in b.entities - {r.id for r in rows}]
+    if b.edges:
+        rows = (await db.execute(GRAPH_EDGES.where(Edge.id.in_(b.edges)))).all()
+        change['links'] = [link_payload(r) for r in rows]
+        change['removedLinks'] = [str(e) for e in b.edges - {r.id for r in rows}]
+    return {k: v for k, v in change.items() if v}
+
+
+@router.post('/batch')
+async def run_batch(payload: list[dict] = Body(...), db: AsyncSession = Depends(get_db)):
+    """Apply the operations in order, all or nothing; returns one result per operation."""
+    if len(payload) > MAX_OPS:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_OPS} operations per batch')
+    for i, op in enumerate(payload):
+        if (op.get('type'), op.get('op')) not in HANDLERS:
+            raise _bad(i, f"unsupported operation {op.get('op')!r} on {op.get('type')!r}")
+    batch = _Batch(db)
+    results = []
+    for kind, run in groupby(enumerate(payload), key=lambda item: (item[1]['type'], item[1]['op'])):
+        run = list(run)
+        try:
+            results += await HANDLERS[kind](batch, run)
+        except IntegrityError as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=400, detail=f'ops[{run[0][0]}:{run[-1][0] + 1}]: constraint violation',
+            ) from e
+    change = await _change(batch)
+    seq = await commit_ordered(db)
+    if change:
+        await record_change(change, seq)
+    return {'results': results}
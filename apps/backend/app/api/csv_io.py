@@ -1,114 +1,253 @@
+import codecs
 import csv
 import io
+import time
 import zipfile
-from fastapi import APIRouter, UploadFile, File, Depends
-from sqlalchemy.orm import Session
-from app.db.session import SessionLocal
+from typing import Literal
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.db.session import AsyncSessionLocal, get_db
 from app.models.models import Group, Entity, EntityGroup, Edge
-from app.core.redis import get_redis
+from app.core.graph_snapshot import record_change
+from app.core import group_tree
 
 router = APIRouter(prefix="/csv")
-CACHE_KEY = 'graph:v1'
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+CHUNK_SIZE = 64 * 1024
+EXPORT_BATCH = 2000
+
+class _ZipSink:
+    """Write-only file for ``zipfile``; the export drains it after every batch of rows."""
+    def __init__(self):
+        self._buf = bytearray()
+
+    def write(self, data):
+        self._buf += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+def _export_members():
+    parent = aliased(Group)
+    main_group = aliased(Group)
+    member_group = aliased(Group)
+    group_names = (
+        select(func.string_agg(member_group.name, ';'))
+        .join(EntityGroup, EntityGroup.group_id == member_group.id)
+        .where(EntityGroup.entity_id == Entity.id)
+        .scalar_subquery()
+    )
+    return [
+        ('groups.csv', ['name','description','color_hex','parent_group_name'],
+         select(Group.name, Group.description, Group.color_hex, parent.name).outerjoin(parent, parent.id == Group.parent_group_id)),
+        ('people.csv', ['name','contact_email','contact_phone','notes','main_group_name','groups'],
+         select(Entity.name, Entity.contact_email, Entity.contact_phone, func.replace(Entity.notes, '\n', ' '), main_group.name, group_names)
+         .outerjoin(main_group, main_group.id == Entity.main_group_id)),
+        ('connections.csv', ['a_identifier','b_identifier','label'],
+         select(Edge.a_entity_id, Edge.b_entity_id, Edge.label)),
+    ]
+
+def _csv_bytes(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode('utf-8')
+
+async def _export_chunks():
+    """Yield the export ZIP piece by piece, one batch of rows at a time."""
+    sink = _ZipSink()
+    # the response outlives request dependencies, so the stream owns its session;
+    # REPEATABLE READ gives all three files the same snapshot of the graph
+    async with AsyncSessionLocal() as db:
+        await db.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, header, stmt in _export_members():
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                # sizes aren't known up front, so allow members past 4 GiB
+                with zf.open(info, 'w', force_zip64=True) as member:
+                    member.write(_csv_bytes([header]))
+                    result = await db.stream(stmt, execution_options={'yield_per': EXPORT_BATCH})
+                    async for rows in result.partitions():
+                        member.write(_csv_bytes(rows))
+                        yield sink.drain()
+                yield sink.drain()
+    yield sink.drain()  # central directory
 
 @router.get('/export')
-async def export_data(db: Session = Depends(get_db)):
-    groups = db.query(Group).all()
-    entities = db.query(Entity).all()
-    memberships = db.query(EntityGroup).all()
-    edges = db.query(Edge).all()
-
-    # Build lookup for memberships
-    ent_groups = {}
-    for m in memberships:
-        ent_groups.setdefault(m.entity_id, []).append(m.group_id)
-
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # groups.csv
-        gbuf = io.StringIO()
-        gw = csv.writer(gbuf)
-        gw.writerow(['name','description','color_hex','parent_group_name'])
-        group_name_by_id = {g.id: g.name for g in groups}
-        for g in groups:
-            gw.writerow([g.name, g.description or '', g.color_hex or '', group_name_by_id.get(g.parent_group_id,'') if g.parent_group_id else ''])
-        zf.writestr('groups.csv', gbuf.getvalue())
-        # people.csv
-        pbuf = io.StringIO()
-        pw = csv.writer(pbuf)
-        pw.writerow(['name','contact_email','contact_phone','notes','main_group_name','groups'])
-        for e in entities:
-            group_names = [group_name_by_id.get(gid,'') for gid in ent_groups.get(e.id, [])]
-            pw.writerow([e.name, e.contact_email or '', e.contact_phone or '', (e.notes or '').replace('\n',' '), group_name_by_id.get(e.main_group_id,'') if e.main_group_id else '', ';'.join(group_names)])
-        zf.writestr('people.csv', pbuf.getvalue())
-        # connections.csv
-        cbuf = io.StringIO()
-        cw = csv.writer(cbuf)
-        cw.writerow(['a_identifier','b_identifier','label'])
-        for ed in edges:
-            cw.writerow([str(ed.a_entity_id), str(ed.b_entity_id), ed.label or ''])
-        zf.writestr('connections.csv', cbuf.getvalue())
-    zbuf.seek(0)
-    return {
-        'filename': 'export.zip',
-        'content': zbuf.getvalue().hex()  # client can hex-decode
-    }
+async def export_data(format: Literal['zip', 'json'] = 'zip'):
+    if format == 'json':
+        # legacy form: the whole ZIP hex-encoded in a JSON body
+        content = b''.join([chunk async for chunk in _export_chunks()])
+        return {
+            'filename': 'export.zip',
+            'content': content.hex()  # client can hex-decode
+        }
+    return StreamingResponse(_export_chunks(), media_type='application/zip',
+                             headers={'Content-Disposition': 'attachment; filename="export.zip"'})
 
-@router.post('/import')
-async def import_data(groups_file: UploadFile = File(...), people_file: UploadFile = File(...), connections_file: UploadFile = File(...), db: Session = Depends(get_db)):
-    # parse groups
-    text = (await groups_file.read()).decode('utf-8')
-    rdr = csv.DictReader(io.StringIO(text))
-    name_to_group = {}
-    for row in rdr:
-        g = Group(name=row['name'], description=row.get('description') or None, color_hex=row.get('color_hex') or None)
-        db.add(g)
-        db.flush()
-        name_to_group[row['name']] = g
-    db.commit()
-    # second pass for parents (after all groups present)
-    # (Not implemented: parent resolution for simplicity)
-
-    text_people = (await people_file.read()).decode('utf-8')
-    pr = csv.DictReader(io.StringIO(text_people))
-    email_or_name_to_entity = {}
-    for row in pr:
-        mg_name = row.get('main_group_name') or ''
-        mg_id = name_to_group.get(mg_name).id if mg_name and mg_name in name_to_group else None
-        ent = Entity(name=row['name'], contact_email=row.get('contact_email') or None, contact_phone=row.get('contact_phone') or None, notes=row.get('notes') or None, main_group_id=mg_id)
-        db.add(ent)
-        db.flush()
-        if ent.contact_email:
-            email_or_name_to_entity[ent.contact_email] = ent
-        email_or_name_to_entity.setdefault(ent.name, ent)
-        groups_field = row.get('groups') or ''
-        if groups_field:
-            for gname in groups_field.split(';'):
-                gname = gname.strip()
-                if gname and gname in name_to_group:
-                    db.add(EntityGroup(entity_id=ent.id, group_id=name_to_group[gname].id))
-    db.commit()
-
-    text_conn = (await connections_file.read()).decode('utf-8')
-    cr = csv.DictReader(io.StringIO(text_conn))
-    for row in cr:
-        a_id = row['a_identifier']
-        b_id = row['b_identifier']
-        a_ent = email_or_name_to_entity.get(a_id)
-        b_ent = email_or_name_to_entity.get(b_id)
-        if not a_ent or not b_ent or a_ent.id == b_ent.id:
+def _record_end(buf: str) -> int:
+    """Offset just past the last newline in ``buf`` that isn't inside a quoted field."""
+    quotes = buf.count('"')
+    end = len(buf)
+    while (i := buf.rfind('\n', 0, end)) >= 0:
+        quotes -= buf.count('"', i, end)
+        if quotes % 2 == 0:
+            return i + 1
+        end = i
+    return 0
+
+async def _csv_rows(upload: UploadFile):
+    """Parse ``upload`` chunk by chunk instead of reading it into memory first."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        buf = pending + decoder.decode(chunk, final=not chunk)
+        # only hand complete records to the reader; a quoted field may span chunks
+        cut = _record_end(buf) if chunk else len(buf)
+        for row in csv.reader(io.StringIO(buf[:cut])):
+            yield row
+        pending = buf[cut:]
+        if not chunk:
+            return
+
+async def _csv_records(upload: UploadFile, columns: list[str], required: list[str]):
+    """Yield one tuple per data row with ``columns`` in order, skipping rows missing a required value."""
+    rows = _csv_rows(upload)
+    header = [h.strip() for h in await anext(rows, [])]
+    if not header:  # empty file
+        return
+    missing = [c for c in required if c not in header]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"{upload.filename}: missing column(s) {', '.join(missing)}")
+    idx = [header.index(c) if c in header else None for c in columns]
+    req = [header.index(c) for c in required]
+    async for row in rows:
+        if any(i >= len(row) or not row[i] for i in req):
             continue
-        a_c, b_c = sorted([a_ent.id, b_ent.id], key=lambda x: str(x))
-        existing = db.query(Edge).filter(Edge.a_entity_id==a_c, Edge.b_entity_id==b_c).first()
-        if not existing:
-            db.add(Edge(a_entity_id=a_c, b_entity_id=b_c, label=row.get('label') or None))
-    db.commit()
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
-    return {'imported': True}
+        yield tuple(row[i] if i is not None and i < len(row) else None for i in idx)
+
+# Staging tables live for the import transaction only. ``ord`` keeps file order
+# so "first row wins" stays deterministic when a file repeats a key.
+_STAGING = [
+    "CREATE TEMP TABLE import_groups (ord bigint GENERATED ALWAYS AS IDENTITY, name text, description text, color_hex text, parent_group_name text) ON COMMIT DROP",
+    "CREATE TEMP TABLE import_people (ord bigint GENERATED ALWAYS AS IDENTITY, id uuid NOT NULL DEFAULT gen_random_uuid(), name text, contact_email text, contact_phone text, notes text, main_group_name text, groups text) ON COMMIT DROP",
+    "CREATE TEMP TABLE import_connections (ord bigint GENERATED ALWAYS AS IDENTITY, a_identifier text, b_identifier text, label text) ON COMMIT DROP",
+]
+
+_IMPORT_GROUPS = """
+INSERT INTO groups (id, name, description, color_hex)
+SELECT DISTINCT ON (s.name) gen_random_uuid(), s.name, NULLIF(s.description, ''), NULLIF(s.color_hex, '')
+FROM import_groups s
+WHERE NOT EXISTS (SELECT 1 FROM groups g WHERE g.name = s.name)
+ORDER BY s.name, s.ord
+"""
+
+# group name -> id; with duplicate names the oldest group wins
+_GROUP_IDS = """
+CREATE TEMP TABLE import_group_ids ON COMMIT DROP AS
+SELECT DISTINCT ON (name) name, id FROM groups ORDER BY name, created_at, id
+"""
+
+_RESOLVE_PARENTS = """
+UPDATE groups g SET parent_group_id = p.id
+FROM (
+    SELECT DISTINCT ON (name) name, parent_group_name FROM import_groups
+    WHERE parent_group_name <> '' ORDER BY name, ord
+) s
+JOIN import_group_ids c ON c.name = s.name
+JOIN import_group_ids p ON p.name = s.parent_group_name
+WHERE g.id = c.id AND p.id <> c.id
+"""
+
+_IMPORT_PEOPLE = """
+INSERT INTO entities (id, name, contact_email, contact_phone, notes, main_group_id)
+SELECT s.id, s.name, NULLIF(s.contact_email, ''), NULLIF(s.contact_phone, ''), NULLIF(s.notes, ''), mg.id
+FROM import_people s LEFT JOIN import_group_ids mg ON mg.name = s.main_group_name
+ORDER BY s.ord
+ON CONFLICT DO NOTHING
+"""
+
+# rows skipped for a duplicate email/phone stand for the person that already has it
+_MATCH_EXISTING = """
+UPDATE import_people s SET id = e.id FROM entities e
+WHERE e.{column} = NULLIF(s.{column}, '')
+  AND NOT EXISTS (SELECT 1 FROM entities x WHERE x.id = s.id)
+"""
+
+_IMPORT_MEMBERSHIPS = """
+INSERT INTO entity_groups (entity_id, group_id)
+SELECT DISTINCT s.id, g.id
+FROM import_people s
+CROSS JOIN LATERAL unnest(string_to_array(s.groups, ';')) AS m(name)
+JOIN import_group_ids g ON g.name = btrim(m.name)
+ON CONFLICT DO NOTHING
+"""
+
+# A connection endpoint may be an entity id, an email, or a name (people from
+# this file first, in file order, then existing people).
+_PERSON_KEYS = """
+CREATE TEMP TABLE import_keys ON COMMIT DROP AS
+WITH wanted AS (
+    SELECT key, CASE WHEN key ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$' THEN key::uuid END AS uid
+    FROM (SELECT a_identifier AS key FROM import_connections UNION SELECT b_identifier FROM import_connections) k
+)
+SELECT DISTINCT ON (key) key, id FROM (
+    SELECT w.key, e.id, 0 AS rank, 0::bigint AS ord FROM wanted w JOIN entities e ON e.id = w.uid
+    UNION ALL SELECT w.key, e.id, 1, 0 FROM wanted w JOIN entities e ON e.contact_email = w.key
+    UNION ALL SELECT w.key, s.id, 2, s.ord FROM wanted w JOIN import_people s ON s.name = w.key
+    UNION ALL SELECT w.key, e.id, 3, 0 FROM wanted w JOIN entities e ON e.name = w.key
+) k
+ORDER BY key, rank, ord, id
+"""
+
+_IMPORT_EDGES = """
+INSERT INTO graph_edges (id, a_entity_id, b_entity_id, label)
+SELECT DISTINCT ON (LEAST(a.id, b.id), GREATEST(a.id, b.id))
+    gen_random_uuid(), LEAST(a.id, b.id), GREATEST(a.id, b.id), NULLIF(c.label, '')
+FROM import_connections c
+JOIN import_keys a ON a.key = c.a_identifier
+JOIN import_keys b ON b.key = c.b_identifier
+WHERE a.id <> b.id
+ORDER BY LEAST(a.id, b.id), GREATEST(a.id, b.id), c.ord
+ON CONFLICT DO NOTHING
+"""
+
+@router.post('/import')
+async def import_data(groups_file: UploadFile = File(...), people_file: UploadFile = File(...), connections_file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    # Uploads are streamed into temp staging tables with COPY, then resolved with
+    # a handful of set-based statements, all in one transaction.
+    for ddl in _STAGING:
+        await db.execute(text(ddl))  # also opens the transaction COPY runs in
+    conn = (await (await db.connection()).get_raw_connection()).driver_connection
+    await conn.copy_records_to_table('import_groups', columns=['name', 'description', 'color_hex', 'parent_group_name'],
+        records=_csv_records(groups_file, ['name', 'description', 'color_hex', 'parent_group_name'], ['name']))
+    await conn.copy_records_to_table('import_people', columns=['name', 'contact_email', 'contact_phone', 'notes', 'main_group_name', 'groups'],
+        records=_csv_records(people_file, ['name', 'contact_email', 'contact_phone', 'notes', 'main_group_name', 'groups'], ['name']))
+    await conn.copy_records_to_table('import_connections', columns=['a_identifier', 'b_identifier', 'label'],
+        records=_csv_records(connections_file, ['a_identifier', 'b_identifier', 'label'], ['a_identifier', 'b_identifier']))
+    # temp tables are never auto-analyzed; without stats the joins below plan badly
+    await db.execute(text('ANALYZE import_groups, import_people, import_connections'))
+
+    groups = (await db.execute(text(_IMPORT_GROUPS))).rowcount
+    await db.execute(text(_GROUP_IDS))
+    await db.execute(text(_RESOLVE_PARENTS))
+    await group_tree.rebuild(db)
+    people = (await db.execute(text(_IMPORT_PEOPLE))).rowcount
+    await db.execute(text(_MATCH_EXISTING.format(column='contact_email')))
+    await db.execute(text(_MATCH_EXISTING.format(column='contact_phone')))
+    await db.execute(text(_IMPORT_MEMBERSHIPS))
+    await db.execute(text(_PERSON_KEYS))
+    connections = (await db.execute(text(_IMPORT_EDGES))).rowcount
+    await db.commit()
+    await record_change(None)
+    return {'imported': True, 'groups': groups, 'people': people, 'connections': connections}
@@ -1,58 +1,130 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, HTTPException
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from uuid import UUID
-from app.db.session import SessionLocal
+from app.db.session import get_db
 from app.models.models import Edge
-from app.core.redis import get_redis
+from app.core.graph_snapshot import link_payload, commit_ordered, record_change
 
 router = APIRouter(prefix="/edges")
-CACHE_KEY = 'graph:v1'
 
-def get_db():
-    db = SessionLocal()
+MAX_BULK = 10_000
+
+# one statement per bulk call, however many pairs: the pairs travel as three
+# arrays and the canonical (LEAST, GREATEST) unique index arbitrates duplicates
+_BULK_INSERT = """
+INSERT INTO graph_edges (id, a_entity_id, b_entity_id, label)
+SELECT gen_random_uuid(), p.a, p.b, p.label
+FROM unnest(CAST(:a AS uuid[]), CAST(:b AS uuid[]), CAST(:labels AS text[])) AS p(a, b, label)
+ON CONFLICT (LEAST(a_entity_id, b_entity_id), GREATEST(a_entity_id, b_entity_id)) DO NOTHING
+RETURNING id, a_entity_id, b_entity_id, label
+"""
+
+_BULK_DELETE = """
+DELETE FROM graph_edges e
+USING unnest(CAST(:a AS uuid[]), CAST(:b AS uuid[])) AS p(a, b)
+WHERE LEAST(e.a_entity_id, e.b_entity_id) = p.a AND GREATEST(e.a_entity_id, e.b_entity_id) = p.b
+RETURNING e.id
+"""
+
+def canonical_pair(p: dict) -> tuple[UUID, UUID]:
+    """``(a, b)`` of a ``{a_id, b_id}`` dict, smaller id first."""
     try:
-        yield db
-    finally:
-        db.close()
+        a, b = UUID(str(p['a_id'])), UUID(str(p['b_id']))
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Each pair needs a_id and b_id')
+    if a == b:
+        raise HTTPException(status_code=400, detail='Self edge not allowed')
+    return min(a, b, key=str), max(a, b, key=str)
+
+def _canonical_pairs(payload: list[dict]) -> dict[tuple[UUID, UUID], str | None]:
+    """``{(a, b): label}`` with a < b, in request order; the first label for a pair wins."""
+    if len(payload) > MAX_BULK:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_BULK} pairs per request')
+    pairs = {}
+    for p in payload:
+        pairs.setdefault(canonical_pair(p), p.get('label'))
+    return pairs
+
+async def insert_edges(db: AsyncSession, pairs: dict[tuple[UUID, UUID], str | None]):
+    """Insert canonical ``{(a, b): label}`` pairs; returns rows for the ones that were new."""
+    params = {
+        'a': [str(a) for a, _ in pairs],
+        'b': [str(b) for _, b in pairs],
+        'labels': list(pairs.values()),
+    }
+    return (await db.execute(text(_BULK_INSERT), params)).all()
+
+async def delete_edge_pairs(db: AsyncSession, pairs) -> list[str]:
+    """Delete the edges between canonical ``(a, b)`` pairs; returns their ids."""
+    params = {'a': [str(a) for a, _ in pairs], 'b': [str(b) for _, b in pairs]}
+    return [str(eid) for eid in (await db.scalars(text(_BULK_DELETE), params)).all()]
 
 @router.post('')
-async def create_edge(payload: dict, db: Session = Depends(get_db)):
+async def create_edge(payload: dict, db: AsyncSession = Depends(get_db)):
     a = UUID(payload['a_id'])
     b = UUID(payload['b_id'])
     if a == b:
         raise HTTPException(status_code=400, detail='Self edge not allowed')
     a_c, b_c = sorted([a, b], key=lambda x: str(x))
-    existing = db.query(Edge).filter(Edge.a_entity_id==a_c, Edge.b_entity_id==b_c).first()
+    existing = await db.scalar(select(Edge).where(Edge.a_entity_id==a_c, Edge.b_entity_id==b_c))
     if existing:
         return {'id': str(existing.id)}
     edge = Edge(a_entity_id=a_c, b_entity_id=b_c, label=payload.get('label'))
     db.add(edge)
-    db.commit()
-    db.refresh(edge)
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    seq = await commit_ordered(db)
+    await db.refresh(edge)
+    await record_change({'links': [link_payload(edge)]}, seq)
     return {'id': str(edge.id)}
 
+@router.post('/bulk')
+async def create_edges(payload: list[dict] = Body(...), db: AsyncSession = Depends(get_db)):
+    """Create edges for ``[{a_id, b_id, label?}]``; pairs that already exist (either way round) are skipped."""
+    pairs = _canonical_pairs(payload)
+    if not pairs:
+        return {'created': [], 'skipped': 0}
+    try:
+        rows = await insert_edges(db, pairs)
+        seq = await commit_ordered(db)
+    except IntegrityError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail='Unknown entity id') from e
+    links = [link_payload(r) for r in rows]
+    if links:
+        await record_change({'links': links}, seq)
+    return {'created': links, 'skipped': len(pairs) - len(links)}
+
+@router.delete('/bulk')
+async def delete_edges(payload: list[dict] = Body(...), db: AsyncSession = Depends(get_db)):
+    """Delete the edges between ``[{a_id, b_id}]`` pairs, whichever way round they were stored."""
+    pairs = _canonical_pairs(payload)
+    if not pairs:
+        return {'deleted': 0}
+    removed = await delete_edge_pairs(db, pairs)
+    seq = await commit_ordered(db)
+    if removed:
+        await record_change({'removedLinks': removed}, seq)
+    return {'deleted': len(removed)}
+
 @router.patch('/{edge_id}')
-async def update_edge(edge_id: UUID, payload: dict, db: Session = Depends(get_db)):
-    edge = db.query(Edge).get(edge_id)
+async def update_edge(edge_id: UUID, payload: dict, db: AsyncSession = Depends(get_db)):
+    edge = await db.get(Edge, edge_id)
     if not edge:
         raise HTTPException(status_code=404, detail='Not found')
     if 'label' in payload:
         edge.label = payload['label']
-    db.commit()
-    db.refresh(edge)
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    seq = await commit_ordered(db)
+    await db.refresh(edge)
+    await record_change({'links': [link_payload(edge)]}, seq)
     return {'updated': True}
 
 @router.delete('/{edge_id}')
-async def delete_edge(edge_id: UUID, db: Session = Depends(get_db)):
-    edge = db.query(Edge).get(edge_id)
+async def delete_edge(edge_id: UUID, db: AsyncSession = Depends(get_db)):
+    edge = await db.get(Edge, edge_id)
     if not edge:
         raise HTTPException(status_code=404, detail='Not found')
-    db.delete(edge)
-    db.commit()
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    await db.delete(edge)
+    seq = await commit_ordered(db)
+    await record_change({'removedLinks': [str(edge_id)]}, seq)
     return {'deleted': True}
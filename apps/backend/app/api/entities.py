@@ -1,47 +1,163 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
+from sqlalchemy import select, delete, literal, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from uuid import UUID
-from app.db.session import SessionLocal
-from app.models.models import Entity, EntityGroup, Edge
+from app.db.session import get_db
+from app.models.models import Entity, EntityGroup, GroupClosure
 from app.schemas.entities import EntityCreate, EntityRead, EntityUpdate
-from app.core.redis import get_redis
+from app.db.read_models import ENTITY_FIELDS, entity_rows
+from app.core.cursors import decode_cursor, encode_cursor
+from app.api.edges import insert_edges
+from app.core.graph_snapshot import link_payload, node_payload, commit_ordered, record_change
+from app.core.timing import timed
+from app.core.search import has_trgm, matches as search_matches, similarity, suggest
 
 router = APIRouter(prefix="/entities")
-CACHE_KEY = 'graph:v1'
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# An entity whose main group it no longer belongs to falls back to its earliest
+# remaining membership (or none). Candidates: the given entities and anyone
+# whose main group is one of the given groups; memberships of those groups
+# don't count, so this can run before the groups are deleted.
+_REASSIGN_MAIN = """
+UPDATE entities e SET main_group_id = pick.group_id
+FROM (
+    SELECT DISTINCT ON (c.id) c.id, m.group_id
+    FROM entities c
+    LEFT JOIN entity_groups m ON m.entity_id = c.id AND m.group_id <> ALL(CAST(:group_ids AS uuid[]))
+    WHERE (c.id = ANY(CAST(:entity_ids AS uuid[])) OR c.main_group_id = ANY(CAST(:group_ids AS uuid[])))
+      AND c.main_group_id IS NOT NULL
+      AND NOT EXISTS (
+          SELECT 1 FROM entity_groups k
+          WHERE k.entity_id = c.id AND k.group_id = c.main_group_id AND k.group_id <> ALL(CAST(:group_ids AS uuid[]))
+      )
+    ORDER BY c.id, m.joined_at, m.group_id
+) pick
+WHERE e.id = pick.id
+RETURNING e.id, e.main_group_id
+"""
+
+# membership/connection sync for create and update: a fixed handful of
+# statements whatever the fan-out; existing rows (and their joined_at) stay put
+_ADD_MEMBERSHIPS = """
+INSERT INTO entity_groups (entity_id, group_id)
+SELECT CAST(:entity_id AS uuid), g FROM unnest(CAST(:group_ids AS uuid[])) AS g
+ON CONFLICT DO NOTHING
+"""
+
+_DROP_CONNECTIONS = """
+DELETE FROM graph_edges
+WHERE (a_entity_id = :entity_id OR b_entity_id = :entity_id)
+  AND CASE WHEN a_entity_id = :entity_id THEN b_entity_id ELSE a_entity_id END <> ALL(CAST(:keep AS uuid[]))
+RETURNING id
+"""
+
+MAX_BULK = 10_000
+PAGE_SIZE = 100
+
+async def reassign_main_groups(db: AsyncSession, entity_ids=(), group_ids=()):
+    """Repoint main groups that lost their membership, in one statement; returns ``(id, main_group_id)`` rows."""
+    params = {'entity_ids': [str(i) for i in entity_ids], 'group_ids': [str(g) for g in group_ids]}
+    return (await db.execute(text(_REASSIGN_MAIN), params)).all()
+
+async def _sync_groups(db: AsyncSession, entity_id: UUID, group_ids, drop_others: bool) -> None:
+    params = {'entity_id': str(entity_id), 'group_ids': [str(g) for g in group_ids]}
+    if drop_others:
+        await db.execute(delete(EntityGroup).where(EntityGroup.entity_id == entity_id, EntityGroup.group_id.not_in(group_ids)))
+    if group_ids:
+        await db.execute(text(_ADD_MEMBERSHIPS), params)
+
+async def _sync_connections(db: AsyncSession, entity_id: UUID, others, drop_others: bool):
+    """Make ``entity_id``'s neighbours ``others``; returns ``(new edge rows, removed edge ids)``."""
+    pairs = {(min(entity_id, o, key=str), max(entity_id, o, key=str)): None for o in others if o != entity_id}
+    removed = []
+    if drop_others:
+        params = {'entity_id': entity_id, 'keep': [str(o) for o in others]}
+        removed = [str(eid) for eid in (await db.scalars(text(_DROP_CONNECTIONS), params)).all()]
+    return (await insert_edges(db, pairs) if pairs else []), removed
+
+async def delete_entities(db: AsyncSession, ids) -> list[str]:
+    """Delete entities in one statement; memberships and edges go by ``ON DELETE CASCADE``."""
+    return [str(eid) for eid in (await db.scalars(delete(Entity).where(Entity.id.in_(ids)).returning(Entity.id))).all()]
 
 @router.get('')
-async def list_entities(search: str | None = None, group_id: UUID | None = None, db: Session = Depends(get_db)):
-    q = db.query(Entity)
+async def list_entities(
+    search: str | None = None,
+    group_id: UUID | None = None,
+    recursive: bool = False,
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """People ordered by (name, id); every match unless ``limit`` or ``cursor`` asks for pages.
+
+    Paged, the next page's cursor comes back in the ``X-Next-Cursor`` header
+    (absent on the last page) and pages hold ``limit`` rows (default
+    ``PAGE_SIZE``). ``fields`` is a comma-separated subset of the output
+    keys; only those columns are selected. ``search`` matches name, email,
+    phone and notes, best hits first; ``limit`` caps it, but it takes no
+    cursor. With ``recursive``, ``group_id`` also matches members of its
+    sub-groups.
+    """
+    names = [f.strip() for f in fields.split(',') if f.strip()] if fields else list(ENTITY_FIELDS)
+    unknown = [f for f in names if f not in ENTITY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+    # plain column rows: no ORM objects, so none of Entity's eager relationship loads
+    q = entity_rows(names)
+    if group_id and recursive:
+        # semi-join: someone in several sub-groups still comes back once
+        q = q.where(Entity.id.in_(
+            select(EntityGroup.entity_id)
+            .join(GroupClosure, GroupClosure.descendant_id == EntityGroup.group_id)
+            .where(GroupClosure.ancestor_id == group_id)
+        ))
+    elif group_id:
+        q = q.join(EntityGroup, Entity.id == EntityGroup.entity_id).where(EntityGroup.group_id == group_id)
+    headers = {}
     if search:
-        ilike = f"%{search.lower()}%"
-        q = q.filter(Entity.name.ilike(ilike))
-    if group_id:
-        q = q.join(EntityGroup, Entity.id == EntityGroup.entity_id).filter(EntityGroup.group_id == group_id)
-    ents = q.all()
-    return [
-        {
-            'id': str(e.id),
-            'name': e.name,
-            'contact_email': e.contact_email,
-            'contact_phone': e.contact_phone,
-            'notes': e.notes,
-            'mainGroupId': str(e.main_group_id) if e.main_group_id else None,
-            'isCurrentUser': e.is_current_user,
-            'x': e.pos_x,
-            'y': e.pos_y,
-        } for e in ents
-    ]
+        if cursor:
+            # ranked by similarity, which has no stable keyset to resume from
+            raise HTTPException(status_code=400, detail='search results are not paged; pass limit instead of cursor')
+        q = q.where(search_matches(search))
+        if await has_trgm(db):
+            q = q.order_by(similarity(search).desc())
+        rows = (await db.execute(q.order_by(Entity.name, Entity.id).limit(limit))).all()
+        return _rows_response(names, rows, headers)
+    q = q.order_by(Entity.name, Entity.id)
+    if limit is None and cursor is None:
+        return _rows_response(names, (await db.execute(q)).all(), headers)
+    limit = limit or PAGE_SIZE
+    if cursor:
+        after_name, after_id = decode_cursor(cursor, 2)
+        try:
+            after_id = UUID(after_id)
+        except (TypeError, ValueError, AttributeError):
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        q = q.where(tuple_(Entity.name, Entity.id) > tuple_(literal(after_name), literal(after_id)))
+    rows = (await db.execute(q.limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers['X-Next-Cursor'] = encode_cursor(rows[-1][0], str(rows[-1][1]))
+    return _rows_response(names, rows, headers)
+
+def _rows_response(names, rows, headers):
+    # rows are (name, id, *fields); default=str because asyncpg hands back its
+    # own UUID type, which orjson doesn't know
+    with timed('ser'):
+        body = orjson.dumps([dict(zip(names, row[2:])) for row in rows], default=str)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+@router.get('/suggest')
+async def suggest_entities(q: str = Query(..., min_length=1, max_length=100), limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db)):
+    """Typeahead: ``[{id, name}]`` of people whose name starts with ``q``."""
+    return Response(content=await suggest(db, q, limit), media_type='application/json')
 
 @router.post('', response_model=EntityRead)
-async def create_entity(payload: EntityCreate, db: Session = Depends(get_db)):
+async def create_entity(payload: EntityCreate, db: AsyncSession = Depends(get_db)):
     groups_in = payload.groups_in
     connected = payload.connected_people
     data = payload.dict(exclude={'groups_in','connected_people'})
@@ -56,30 +172,20 @@ async def create_entity(payload: EntityCreate, db: Session = Depends(get_db)):
     ent = Entity(**data)
     db.add(ent)
     try:
-        db.commit()
+        await db.flush()
+        await _sync_groups(db, ent.id, groups_in, drop_others=False)
+        new_edges, _ = await _sync_connections(db, ent.id, connected, drop_others=False)
+        seq = await commit_ordered(db)
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Unique constraint violation") from e
-    db.refresh(ent)
-    # memberships
-    for gid in groups_in:
-        db.add(EntityGroup(entity_id=ent.id, group_id=gid))
-    # edges (canonical ordering) reciprocal handled by uniqueness
-    for other_id in connected:
-        if other_id == ent.id:
-            continue
-        a, b = sorted([ent.id, other_id], key=lambda x: str(x))
-        exists = db.query(Edge).filter(Edge.a_entity_id==a, Edge.b_entity_id==b).first()
-        if not exists:
-            db.add(Edge(a_entity_id=a, b_entity_id=b, label=None))
-    db.commit()
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    await db.refresh(ent)
+    await record_change({'nodes': [node_payload(ent, groups_in)], 'links': [link_payload(e) for e in new_edges]}, seq)
     return ent
 
 @router.patch('/{entity_id}', response_model=EntityRead)
-async def update_entity(entity_id: UUID, payload: EntityUpdate, db: Session = Depends(get_db)):
-    ent = db.query(Entity).get(entity_id)
+async def update_entity(entity_id: UUID, payload: EntityUpdate, db: AsyncSession = Depends(get_db)):
+    ent = await db.get(Entity, entity_id)
     if not ent:
         raise HTTPException(status_code=404, detail='Not found')
     data = payload.dict(exclude_unset=True)
@@ -92,61 +198,42 @@ async def update_entity(entity_id: UUID, payload: EntityUpdate, db: Session = De
     connected = data.pop('connected_people', None)
     for k,v in data.items():
         setattr(ent, k, v)
-    # memberships reconciliation
-    if groups_in is not None:
-        current = {g.group_id for g in db.query(EntityGroup).filter(EntityGroup.entity_id==ent.id).all()}
-        desired = set(groups_in)
-        to_add = desired - current
-        to_remove = current - desired
-        for gid in to_add:
-            db.add(EntityGroup(entity_id=ent.id, group_id=gid))
-        if to_remove:
-            db.query(EntityGroup).filter(EntityGroup.entity_id==ent.id, EntityGroup.group_id.in_(list(to_remove))).delete(synchronize_session=False)
-        # main group adjustment
-        if ent.main_group_id and ent.main_group_id not in desired:
-            # pick earliest joined of remaining
-            next_row = db.query(EntityGroup).filter(EntityGroup.entity_id==ent.id, EntityGroup.group_id.in_(list(desired)))\
-                .order_by(EntityGroup.joined_at.asc()).first()
-            ent.main_group_id = next_row.group_id if next_row else None
-    # edges reconciliation
-    if connected is not None:
-        # get current neighbors
-        cur_edges = db.query(Edge).filter((Edge.a_entity_id==ent.id)|(Edge.b_entity_id==ent.id)).all()
-        current_neighbors = {e.a_entity_id if e.a_entity_id != ent.id else e.b_entity_id for e in cur_edges}
-        desired_neighbors = set(connected)
-        to_add = desired_neighbors - current_neighbors
-        to_remove = current_neighbors - desired_neighbors
-        # add
-        for oid in to_add:
-            if oid == ent.id:
-                continue
-            a,b = sorted([ent.id, oid], key=lambda x: str(x))
-            if not db.query(Edge).filter(Edge.a_entity_id==a, Edge.b_entity_id==b).first():
-                db.add(Edge(a_entity_id=a, b_entity_id=b))
-        # remove
-        if to_remove:
-            for oid in to_remove:
-                a,b = sorted([ent.id, oid], key=lambda x: str(x))
-                db.query(Edge).filter(Edge.a_entity_id==a, Edge.b_entity_id==b).delete()
+    new_edges, removed_edge_ids = [], []
     try:
-        db.commit()
+        await db.flush()
+        if groups_in is not None:
+            await _sync_groups(db, ent.id, groups_in, drop_others=True)
+            for _, main_group_id in await reassign_main_groups(db, entity_ids=[ent.id]):
+                set_committed_value(ent, 'main_group_id', main_group_id)
+        if connected is not None:
+            new_edges, removed_edge_ids = await _sync_connections(db, ent.id, connected, drop_others=True)
+        change = {
+            'nodes': [node_payload(ent, groups_in)],
+            'links': [link_payload(e) for e in new_edges],
+            'removedLinks': removed_edge_ids,
+        }
+        seq = await commit_ordered(db)
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail="Unique constraint violation") from e
-    db.refresh(ent)
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    await db.refresh(ent)
+    await record_change(change, seq)
     return ent
 
+@router.delete('/bulk')
+async def delete_entities_bulk(payload: list[UUID] = Body(...), db: AsyncSession = Depends(get_db)):
+    if len(payload) > MAX_BULK:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_BULK} ids per request')
+    removed = await delete_entities(db, payload) if payload else []
+    seq = await commit_ordered(db)
+    if removed:
+        await record_change({'removedNodes': removed}, seq)
+    return {'deleted': len(removed)}
+
 @router.delete('/{entity_id}')
-async def delete_entity(entity_id: UUID, db: Session = Depends(get_db)):
-    ent = db.query(Entity).get(entity_id)
-    if not ent:
+async def delete_entity(entity_id: UUID, db: AsyncSession = Depends(get_db)):
+    if not await delete_entities(db, [entity_id]):
         raise HTTPException(status_code=404, detail='Not found')
-    # delete edges
-    db.query(Edge).filter((Edge.a_entity_id==entity_id)|(Edge.b_entity_id==entity_id)).delete(synchronize_session=False)
-    db.delete(ent)
-    db.commit()
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    seq = await commit_ordered(db)
+    await record_change({'removedNodes': [str(entity_id)]}, seq)
     return {'deleted': True}
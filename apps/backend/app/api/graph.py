@@ -1,89 +1,244 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+import asyncio
+import os
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal
 from uuid import UUID
-from app.db.session import SessionLocal
-from app.models.models import Entity, Edge, Group, EntityGroup
-from app.core.redis import get_redis
+from app.db.session import get_db
+from app.core.graph_snapshot import get_snapshot
+from app.core.graph_cache import cached_graph, etag
+from app.core.graph_changes import changes_since
+from app.core.positions import buffer_positions, buffered_positions, pending_positions
+from app.core.cursors import decode_cursor, encode_cursor
+from app.core import analytics, layout, paths
+from app.core.timing import timed
 
 router = APIRouter()
 
-CACHE_KEY = 'graph:v1'
-CACHE_TTL = 10
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-async def build_graph(db: Session):
-    entities = db.query(Entity).all()
-    edges = db.query(Edge).all()
-    groups = db.query(Group).all()
-    memberships = db.query(EntityGroup).all()
-    group_members = {}
-    for m in memberships:
-        group_members.setdefault(str(m.group_id), []).append(str(m.entity_id))
-
-    nodes = []
-    for e in entities:
-        # collect group ids
-        gids = [str(m.group_id) for m in memberships if m.entity_id == e.id]
-        nodes.append({
-            'id': str(e.id),
-            'name': e.name,
-            'contact_email': e.contact_email,
-            'contact_phone': e.contact_phone,
-            'notes': e.notes,
-            'groupIds': gids,
-            'mainGroupId': str(e.main_group_id) if e.main_group_id else None,
-            'isCurrentUser': e.is_current_user,
-            'x': e.pos_x,
-            'y': e.pos_y,
-        })
-    links = []
-    for ed in edges:
-        links.append({
-            'id': str(ed.id),
-            'source': str(ed.a_entity_id),
-            'target': str(ed.b_entity_id),
-            'label': ed.label
-        })
-    group_objs = []
-    for g in groups:
-        group_objs.append({
-            'id': str(g.id),
-            'name': g.name,
-            'color': g.color_hex or '#888888',
-            'parentId': str(g.parent_group_id) if g.parent_group_id else None,
-            'memberIds': group_members.get(str(g.id), [])
-        })
-    return {'nodes': nodes, 'links': links, 'groups': group_objs}
+PATH_TIME_BUDGET = float(os.getenv('PATH_TIME_BUDGET_MS', '250')) / 1000
+
+# ((epoch, version, positions generation), body) last served with positions laid over it
+_overlaid: tuple[tuple, bytes] | None = None
+
+async def build_graph(db: AsyncSession):
+    snap = await get_snapshot(db)
+    return snap.to_payload()
+
+def _not_modified(request: Request, tag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    return header.strip() == '*' or tag in (t.strip().removeprefix('W/') for t in header.split(','))
+
+def _overlay(body: bytes, positions: dict[str, tuple]) -> bytes:
+    graph = orjson.loads(body)
+    for node in graph['nodes']:
+        xy = positions.get(node['id'])
+        if xy is not None:
+            node['x'], node['y'] = xy
+    return orjson.dumps(graph)
+
+async def _positioned(nodes: list[dict]) -> list[dict]:
+    """``nodes`` with the positions still waiting in the write-behind buffer."""
+    if nodes:
+        buffered = await buffered_positions([n['id'] for n in nodes])
+        for node in nodes:
+            xy = buffered.get(node['id'])
+            if xy is not None:
+                node['x'], node['y'] = xy
+    return nodes
+
+async def _graph_body(db: AsyncSession):
+    """``(etag, version, body)`` of the graph, with unflushed positions laid over the cached body."""
+    global _overlaid
+    async def build():
+        snap = await get_snapshot(db)
+        with timed('ser'):
+            return snap.version, orjson.dumps(snap.to_payload())
+    epoch, version, body = await cached_graph(build)
+    generation, positions = await pending_positions()
+    if not positions:
+        return etag(epoch, version), version, body
+    key = (epoch, version, generation)
+    if _overlaid is None or _overlaid[0] != key:
+        with timed('ser'):
+            _overlaid = (key, await asyncio.to_thread(_overlay, body, positions))
+    return etag(epoch, version, generation), version, _overlaid[1]
 
 @router.get('/graph')
-async def get_graph(db: Session = Depends(get_db)):
-    redis = await get_redis()
-    cached = await redis.get(CACHE_KEY)
-    if cached:
-        import json
-        return json.loads(cached)
-    graph = await build_graph(db)
-    import json
-    await redis.set(CACHE_KEY, json.dumps(graph), ex=CACHE_TTL)
-    return graph
+async def get_graph(request: Request, db: AsyncSession = Depends(get_db)):
+    tag, version, body = await _graph_body(db)
+    # clients must revalidate, which is a body-less 304 while the version (and position buffer) holds
+    headers = {'ETag': tag, 'Cache-Control': 'no-cache'}
+    if _not_modified(request, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
+@router.get('/graph/changes')
+async def get_changes(since: int, db: AsyncSession = Depends(get_db)):
+    found = await changes_since(since)
+    if found is None:
+        # too far behind (or ahead, after a reset): hand back the whole graph
+        _, version, body = await _graph_body(db)
+        return Response(content=b'{"version":%d,"full":true,"graph":%b}' % (version, body), media_type='application/json')
+    version, changes = found
+    # positions saved since the last flush aren't in the log yet: lay them over the changes
+    _, positions = await pending_positions()
+    return Response(content=orjson.dumps({
+        'version': version, 'full': False, 'changes': changes,
+        'positions': [{'id': eid, 'x': x, 'y': y} for eid, (x, y) in positions.items()],
+    }), media_type='application/json')
+
+@router.get('/graph/neighborhood')
+async def get_neighborhood(
+    entity_id: UUID,
+    depth: int = Query(1, ge=1, le=6),
+    fanout: int = Query(50, ge=1, le=1000),
+    max_nodes: int = Query(500, ge=1, le=10_000),
+    limit: int = Query(200, ge=1, le=1000),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Ego network of ``entity_id`` in ``/graph`` node/link shape, paged in BFS order.
+
+    Each link is returned with the later of its two endpoints, so walking all
+    pages yields every link between neighbourhood nodes exactly once.
+    """
+    snap = await get_snapshot(db)
+    start = snap.node_index.get(str(entity_id))
+    if start is None:
+        raise HTTPException(status_code=404, detail='Not found')
+    offset = 0
+    if cursor:
+        version, offset = decode_cursor(cursor, 2)
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        if version != snap.structure_version:
+            raise HTTPException(status_code=409, detail='Graph changed; restart from the first page')
+    slots, truncated = snap.neighborhood(start, depth, fanout, max_nodes)
+    position = {i: n for n, i in enumerate(slots)}
+    page = slots[offset:offset + limit]
+    src, dst = snap.edge_src, snap.edge_dst
+    links = []
+    for i in page:
+        for e in snap.edges_of(i):
+            other = dst[e] if src[e] == i else src[e]
+            if position.get(other, len(slots)) < position[i]:
+                links.append(snap.link_at(e))
+    end = offset + len(page)
+    return {
+        'version': snap.version,
+        'nodes': await _positioned([snap.node_at(i) for i in page]),
+        'links': links,
+        'truncated': truncated,
+        'nextCursor': encode_cursor(snap.structure_version, end) if end < len(slots) else None,
+    }
+
+@router.get('/graph/path')
+async def get_path(
+    to: UUID,
+    from_id: UUID | None = Query(None, alias='from'),
+    k: int = Query(1, ge=1, le=10),
+    max_depth: int = Query(6, ge=1, le=12),
+    db: AsyncSession = Depends(get_db),
+):
+    """Up to ``k`` shortest paths from ``from`` (default: the current user) to ``to``.
+
+    ``timedOut`` is set when the search hit its time budget; the paths found
+    until then are still returned.
+    """
+    snap = await get_snapshot(db)
+    if from_id is None:
+        start = snap.current_user()
+        if start is None:
+            raise HTTPException(status_code=400, detail='No current user; pass from')
+    else:
+        start = snap.node_index.get(str(from_id))
+    end = snap.node_index.get(str(to))
+    if start is None or end is None:
+        raise HTTPException(status_code=404, detail='Not found')
+    found, timed_out = paths.k_shortest_paths(snap, start, end, k, max_depth, PATH_TIME_BUDGET)
+    return {
+        'version': snap.version,
+        'paths': [
+            {'nodes': await _positioned([snap.node_at(i) for i in nodes]), 'links': [snap.link_at(e) for e in edges]}
+            for nodes, edges in found
+        ],
+        'timedOut': timed_out,
+    }
 
 @router.put('/graph/positions')
-async def update_positions(payload: list[dict], db: Session = Depends(get_db)):
+async def update_positions(payload: list[dict], db: AsyncSession = Depends(get_db)):
     # payload: [{id,x,y}]
-    ids = {UUID(p['id']): p for p in payload}
-    to_update = db.query(Entity).filter(Entity.id.in_(ids.keys())).all()
-    for ent in to_update:
-        p = ids[ent.id]
-        ent.pos_x = p.get('x')
-        ent.pos_y = p.get('y')
-    db.commit()
-    # invalidate cache
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
-    return {'updated': len(to_update)}
+    # positions are write-behind (see app.core.positions): buffer them; the
+    # flusher writes them to the database in batches and publishes them to the graph
+    snap = await get_snapshot(db)
+    positions = {}
+    for p in payload:
+        eid = str(UUID(p['id']))
+        if eid in snap.node_index:
+            positions[eid] = (p.get('x'), p.get('y'))
+    await buffer_positions(positions)
+    return {'updated': len(positions)}
+
+@router.post('/graph/layout', status_code=202)
+async def start_layout(response: Response, iterations: int = Query(200, ge=1, le=2000), db: AsyncSession = Depends(get_db)):
+    """Lay out the whole graph server-side; poll ``GET /graph/layout/{job}`` for progress.
+
+    Only one layout runs at a time: while one is running this returns its job
+    with 200 instead of starting another.
+    """
+    snap = await get_snapshot(db)
+    job_id, started = await layout.start_job(snap, iterations)
+    if not started:
+        response.status_code = 200
+    return await layout.get_job(job_id) or {'id': job_id, 'status': 'running'}
+
+@router.get('/graph/layout/{job_id}')
+async def get_layout(job_id: str):
+    job = await layout.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Not found')
+    return job
+
+@router.get('/graph/analytics')
+async def get_analytics_summary(db: AsyncSession = Depends(get_db)):
+    snap = await get_snapshot(db)
+    result = await analytics.get_analytics(snap)
+    sizes = result.sizes
+    return {
+        'version': result.version,
+        'nodes': len(result.ids),
+        'edges': int(result.values['degree'].sum()) // 2,
+        'components': len(sizes),
+        'largestComponent': int(sizes[0]) if len(sizes) else 0,
+        'isolated': int((result.values['degree'] == 0).sum()),
+    }
+
+@router.get('/graph/analytics/components')
+async def get_components(
+    limit: int = Query(20, ge=1, le=1000),
+    members: int = Query(50, ge=0, le=10_000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Connected components, largest first, with up to ``members`` member ids each."""
+    snap = await get_snapshot(db)
+    result = await analytics.get_analytics(snap)
+    return {'version': result.version, 'total': len(result.sizes), 'components': result.components(limit, members)}
+
+@router.get('/graph/analytics/{metric}')
+async def get_ranking(
+    metric: Literal['degree', 'pagerank', 'betweenness'],
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
+    """Top ``limit`` nodes by ``metric``; betweenness is estimated from sampled sources."""
+    snap = await get_snapshot(db)
+    result = await analytics.get_analytics(snap)
+    names = snap.node_name
+    top = []
+    for eid, value in result.top(metric, limit):
+        i = snap.node_index.get(eid)
+        top.append({'id': eid, 'name': names[i] if i is not None else None, 'value': value})
+    return {'version': result.version, 'metric': metric, 'top': top}
@@ -1,23 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
-from app.db.session import SessionLocal
-from app.models.models import Group, EntityGroup, Entity
-from app.core.redis import get_redis
+from app.db.session import get_db
+from app.db.read_models import group_rows
+from app.models.models import Group
+from app.core.graph_snapshot import group_payload, commit_ordered, record_change
+from app.core import group_tree
+from app.api.entities import MAX_BULK, list_entities, reassign_main_groups
 
 router = APIRouter(prefix="/groups")
-CACHE_KEY = 'graph:v1'
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 @router.get('')
-async def list_groups(db: Session = Depends(get_db)):
-    groups = db.query(Group).all()
+async def list_groups(db: AsyncSession = Depends(get_db)):
+    # column rows, not Group objects: skips the joined ``parent`` load
     return [
         {
             'id': str(g.id),
@@ -25,11 +21,11 @@ async def list_groups(db: Session = Depends(get_db)):
             'description': g.description,
             'color_hex': g.color_hex,
             'parent_group_id': str(g.parent_group_id) if g.parent_group_id else None
-        } for g in groups
+        } for g in await group_rows(db)
     ]
 
 @router.post('')
-async def create_group(payload: dict, db: Session = Depends(get_db)):
+async def create_group(payload: dict, db: AsyncSession = Depends(get_db)):
     g = Group(
         name=payload['name'],
         description=payload.get('description'),
@@ -37,41 +33,74 @@ async def create_group(payload: dict, db: Session = Depends(get_db)):
         parent_group_id=payload.get('parent_group_id')
     )
     db.add(g)
-    db.commit()
-    db.refresh(g)
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    await db.flush()
+    await group_tree.add_group(db, g.id, g.parent_group_id)
+    seq = await commit_ordered(db)
+    await db.refresh(g)
+    await record_change({'groups': [group_payload(g)]}, seq)
     return {'id': str(g.id)}
 
 @router.patch('/{group_id}')
-async def update_group(group_id: UUID, payload: dict, db: Session = Depends(get_db)):
-    g = db.query(Group).get(group_id)
+async def update_group(group_id: UUID, payload: dict, db: AsyncSession = Depends(get_db)):
+    g = await db.get(Group, group_id)
     if not g:
         raise HTTPException(status_code=404, detail='Not found')
+    if 'parent_group_id' in payload:
+        parent_id = UUID(str(payload['parent_group_id'])) if payload['parent_group_id'] else None
+        if parent_id != g.parent_group_id:
+            await group_tree.move_group(db, g.id, parent_id)
     for k in ['name','description','color_hex','parent_group_id']:
         if k in payload:
             setattr(g,k,payload[k])
-    db.commit()
-    db.refresh(g)
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    seq = await commit_ordered(db)
+    await db.refresh(g)
+    await record_change({'groups': [group_payload(g)]}, seq)
     return {'updated': True}
 
+async def delete_groups(db: AsyncSession, ids) -> tuple[list[str], dict]:
+    """Delete groups set-wise; returns the deleted ids and the graph change (not committed).
+
+    Members whose main group goes away fall back to their earliest remaining
+    membership in one UPDATE; memberships, closure rows and child links
+    follow through the foreign keys.
+    """
+    await group_tree.remove_groups(db, ids)
+    reassigned = await reassign_main_groups(db, group_ids=ids)
+    removed = [str(g) for g in (await db.scalars(delete(Group).where(Group.id.in_(ids)).returning(Group.id))).all()]
+    nodes = [{'id': str(eid), 'mainGroupId': str(gid) if gid else None} for eid, gid in reassigned]
+    return removed, {'nodes': nodes, 'removedGroups': removed}
+
+@router.delete('/bulk')
+async def delete_groups_bulk(payload: list[UUID] = Body(...), db: AsyncSession = Depends(get_db)):
+    if len(payload) > MAX_BULK:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_BULK} ids per request')
+    removed, change = await delete_groups(db, payload) if payload else ([], None)
+    seq = await commit_ordered(db)
+    if removed:
+        await record_change(change, seq)
+    return {'deleted': len(removed)}
+
 @router.delete('/{group_id}')
-async def delete_group(group_id: UUID, db: Session = Depends(get_db)):
-    g = db.query(Group).get(group_id)
-    if not g:
+async def delete_group(group_id: UUID, db: AsyncSession = Depends(get_db)):
+    removed, change = await delete_groups(db, [group_id])
+    if not removed:
         raise HTTPException(status_code=404, detail='Not found')
-    # Find members whose main_group_id is this; adjust
-    members = db.query(Entity).filter(Entity.main_group_id==group_id).all()
-    for m in members:
-        # find earliest joined among remaining groups after removal
-        memberships = db.query(EntityGroup).filter(EntityGroup.entity_id==m.id, EntityGroup.group_id!=group_id).order_by(EntityGroup.joined_at.asc()).all()
-        m.main_group_id = memberships[0].group_id if memberships else None
-    # Remove memberships in this group
-    db.query(EntityGroup).filter(EntityGroup.group_id==group_id).delete(synchronize_session=False)
-    db.delete(g)
-    db.commit()
-    redis = await get_redis()
-    await redis.delete(CACHE_KEY)
+    seq = await commit_ordered(db)
+    await record_change(change, seq)
     return {'deleted': True}
+
+@router.get('/{group_id}/members')
+async def list_members(
+    group_id: UUID,
+    recursive: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    fields: str | None = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Members of the group, paged like ``GET /entities``; ``recursive`` includes every sub-group."""
+    if (await db.execute(select(Group.id).where(Group.id == group_id))).first() is None:
+        raise HTTPException(status_code=404, detail='Not found')
+    return await list_entities(
+        search=None, group_id=group_id, recursive=recursive, limit=limit, cursor=cursor, fields=fields, db=db,
+    )
@@ -1,15 +1,40 @@
-from fastapi import APIRouter, Request
-import logging
-import time
+from fastapi import APIRouter, HTTPException, Request
+import orjson
+from app.core import telemetry
 
 router = APIRouter(prefix="/telemetry")
-logger = logging.getLogger("telemetry")
+
+MAX_BATCH = 500
+
+def _queue_full():
+    return HTTPException(status_code=429, detail='Telemetry queue full', headers={'Retry-After': '1'})
 
 @router.post("")
-async def ingest(event: dict, request: Request):
-    # best-effort: log and return 202
-    event_type = event.get('type')
-    ts = event.get('ts') or time.time()
-    user = event.get('user')
-    logger.info(f"telemetry type={event_type} user={user} ts={ts}")
+async def ingest(event: dict):
+    # single event, kept for older clients; prefer /telemetry/batch. Like it
+    # always did, it takes free-form events: ones the batch endpoint would
+    # reject are counted and dropped rather than refused
+    if not telemetry.valid(event):
+        telemetry.EVENTS.labels('invalid').inc()
+        return {"accepted": True}
+    if not telemetry.offer([event]):
+        raise _queue_full()
     return {"accepted": True}
+
+@router.post("/batch", status_code=202)
+async def ingest_batch(request: Request):
+    # parsed by hand: a list of loose dicts doesn't need a pydantic pass
+    try:
+        events = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail='Body must be a JSON array of events')
+    if not isinstance(events, list):
+        raise HTTPException(status_code=400, detail='Body must be a JSON array of events')
+    if len(events) > MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_BATCH} events per batch')
+    good = [e for e in events if telemetry.valid(e)]
+    if len(good) < len(events):
+        telemetry.EVENTS.labels('invalid').inc(len(events) - len(good))
+    if not telemetry.offer(good):
+        raise _queue_full()
+    return {"accepted": len(good), "invalid": len(events) - len(good)}
@@ -0,0 +1,128 @@
+"""Graph analytics (degree, components, PageRank, betweenness), cached per graph version.
+
+Metrics are computed from the in-memory snapshot's edges by
+``app.core.graph_algos``. Small graphs run in a thread; anything with more
+than ``ANALYTICS_INLINE_EDGES`` edges goes to a process pool so the CPU-bound
+work never holds the API worker's GIL. Results are stored in Redis under
+``graph:analytics:{version}`` for every worker to share, and each worker keeps
+the last result it used, so repeated dashboard loads for an unchanged graph
+cost one version check. The version is the snapshot's structure version:
+moving nodes around doesn't change any metric.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import orjson
+from app.core import graph_algos
+from app.core.graph_snapshot import GraphSnapshot
+from app.core.redis import get_raw_redis
+
+CACHE_KEY = 'graph:analytics:{}'
+CACHE_TTL = 3600
+INLINE_EDGES = int(os.getenv('ANALYTICS_INLINE_EDGES', '20000'))
+BETWEENNESS_SAMPLES = int(os.getenv('ANALYTICS_BETWEENNESS_SAMPLES', '64'))
+POOL_WORKERS = int(os.getenv('ANALYTICS_WORKERS', '1'))
+METRICS = ('degree', 'pagerank', 'betweenness')
+
+
+class Analytics:
+    def __init__(self, version: int, ids: list[str], values: dict):
+        self.version = version
+        self.ids = ids
+        self.values = values
+        self.component = values['component']
+        self.sizes = np.bincount(self.component) if len(ids) else np.zeros(0, dtype=np.int64)
+
+    def top(self, metric: str, limit: int) -> list[tuple[str, float]]:
+        values = self.values[metric]
+        order = np.argsort(-values, kind='stable')[:limit]
+        return [(self.ids[i], values[i].item()) for i in order]
+
+    def components(self, limit: int, members: int) -> list[dict]:
+        """Largest components first, each with up to ``members`` member ids."""
+        order = np.argsort(self.component, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(self.sizes)])
+        return [
+            {'size': int(size), 'members': [self.ids[i] for i in order[start:start + min(size, members)]]}
+            for start, size in zip(starts[:limit], self.sizes[:limit])
+        ]
+
+    def dumps(self) -> bytes:
+        return orjson.dumps(
+            {'version': self.version, 'ids': self.ids, **self.values},
+            option=orjson.OPT_SERIALIZE_NUMPY,
+        )
+
+    @classmethod
+    def loads(cls, body: bytes) -> 'Analytics':
+        data = orjson.loads(body)
+        values = {key: np.asarray(data[key]) for key in ('component', *METRICS)}
+        return cls(data['version'], data['ids'], values)
+
+
+_pool: ProcessPoolExecutor | None = None
+_local: Analytics | None = None
+_lock = asyncio.Lock()
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and DB pools is asking for trouble
+        _pool = ProcessPoolExecutor(POOL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _edge_arrays(node_ids: list, edge_ids: list, edge_src: array, edge_dst: array):
+    """Live node ids and ``(n, src, dst)`` over them, with removed slots squeezed out."""
+    alive = np.fromiter((nid is not None for nid in node_ids), dtype=bool, count=len(node_ids))
+    index = np.cumsum(alive) - 1
+    live = np.fromiter((eid is not None for eid in edge_ids), dtype=bool, count=len(edge_ids))
+    src = index[np.frombuffer(edge_src, dtype=np.int32)[live]]
+    dst = index[np.frombuffer(edge_dst, dtype=np.int32)[live]]
+    return [nid for nid in node_ids if nid is not None], src, dst
+
+
+async def _compute(snap: GraphSnapshot) -> Analytics:
+    # the snapshot keeps changing on the event loop: take C-level copies of its
+    # columns here and do the per-element work off the loop
+    columns = snap.node_ids[:], snap.edge_ids[:], snap.edge_src[:], snap.edge_dst[:]
+    version = snap.structure_version
+    ids, src, dst = await asyncio.to_thread(_edge_arrays, *columns)
+    args = (len(ids), src, dst, BETWEENNESS_SAMPLES)
+    if len(src) > INLINE_EDGES:
+        values = await asyncio.get_running_loop().run_in_executor(_executor(), graph_algos.compute, *args)
+    else:
+        values = await asyncio.to_thread(graph_algos.compute, *args)
+    return Analytics(version, ids, values)
+
+
+async def get_analytics(snap: GraphSnapshot) -> Analytics:
+    """Analytics for ``snap``'s structure version, computed at most once per version per worker."""
+    global _local
+    if _local is not None and _local.version == snap.structure_version:
+        return _local
+    async with _lock:
+        if _local is not None and _local.version == snap.structure_version:
+            return _local
+        redis = await get_raw_redis()
+        key = CACHE_KEY.format(snap.structure_version)
+        body = await redis.get(key)
+        if body is not None:
+            _local = await asyncio.to_thread(Analytics.loads, body)
+        else:
+            result = await _compute(snap)
+            await redis.set(key, await asyncio.to_thread(result.dumps), ex=CACHE_TTL)
+            _local = result
+    return _local
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
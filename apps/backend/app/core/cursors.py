@@ -0,0 +1,20 @@
+"""Opaque pagination cursors: a JSON array of sort-key values, base64url-encoded."""
+
+import base64
+import orjson
+from fastapi import HTTPException
+
+
+def encode_cursor(*values) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Decode a cursor holding ``size`` values; malformed cursors are a 400."""
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    return values
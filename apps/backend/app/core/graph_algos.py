@@ -0,0 +1,121 @@
+"""Vectorized graph metrics over a sparse (CSR) adjacency, NumPy only.
+
+Everything here is a plain function of arrays so it can run in a worker
+process (see ``app.core.analytics``); nothing touches the database or Redis.
+The graph is undirected: ``src``/``dst`` list each edge once.
+"""
+
+import numpy as np
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOL = 1e-8
+PAGERANK_MAX_ITER = 100
+
+
+def adjacency(n: int, src, dst):
+    """CSR ``(indptr, indices)`` with both directions of every edge."""
+    rows = np.concatenate([src, dst])
+    cols = np.concatenate([dst, src])
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def components(n: int, src, dst):
+    """Component label per node; labels are dense, largest component first."""
+    labels = np.arange(n)
+    while True:
+        # hook every node onto its smallest neighbouring label, then compress
+        hooked = labels.copy()
+        np.minimum.at(hooked, src, labels[dst])
+        np.minimum.at(hooked, dst, labels[src])
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            break
+        labels = hooked
+    roots, labels, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    rank = np.empty(len(roots), dtype=np.int64)
+    rank[np.argsort(-sizes, kind='stable')] = np.arange(len(roots))
+    return rank[labels]
+
+
+def pagerank(n: int, indptr, indices, damping: float = PAGERANK_DAMPING):
+    degree = np.diff(indptr)
+    rows = np.repeat(np.arange(n), degree)
+    dangling = degree == 0
+    rank = np.full(n, 1 / n)
+    for _ in range(PAGERANK_MAX_ITER):
+        share = np.divide(rank, degree, out=np.zeros(n), where=~dangling)
+        new = np.bincount(indices, weights=share[rows], minlength=n)
+        new = damping * (new + rank[dangling].sum() / n) + (1 - damping) / n
+        done = np.abs(new - rank).sum() < PAGERANK_TOL
+        rank = new
+        if done:
+            break
+    return rank
+
+
+def _expand(indptr, indices, frontier):
+    """(source, neighbour) pairs for every edge leaving ``frontier``."""
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    edges = np.repeat(starts, counts) + np.arange(total) - first
+    return np.repeat(frontier, counts), indices[edges]
+
+
+def betweenness(n: int, indptr, indices, samples: int, seed: int = 0):
+    """Brandes betweenness from ``samples`` random sources, scaled to all ``n``.
+
+    Each BFS is level-synchronous, so a level costs a handful of array ops
+    regardless of its size. Exact when ``samples >= n``.
+    """
+    rng = np.random.default_rng(seed)
+    sources = np.arange(n) if samples >= n else rng.choice(n, samples, replace=False)
+    total = np.zeros(n)
+    for s in sources:
+        dist = np.full(n, -1)
+        sigma = np.zeros(n)
+        dist[s], sigma[s] = 0, 1.0
+        frontier = np.array([s])
+        levels = []
+        depth = 0
+        while len(frontier):
+            u, v = _expand(indptr, indices, frontier)
+            new = np.unique(v[dist[v] < 0])
+            dist[new] = depth + 1
+            on_path = dist[v] == depth + 1
+            u, v = u[on_path], v[on_path]
+            sigma += np.bincount(v, weights=sigma[u], minlength=n)
+            levels.append((u, v))
+            frontier = new
+            depth += 1
+        delta = np.zeros(n)
+        for u, v in reversed(levels):
+            delta += np.bincount(u, weights=sigma[u] / sigma[v] * (1 + delta[v]), minlength=n)
+        delta[s] = 0
+        total += delta
+    # each undirected path was counted from both ends
+    return total * (n / len(sources)) / 2 if len(sources) else total
+
+
+def compute(n: int, src, dst, samples: int) -> dict:
+    """All metrics for an ``n``-node graph; values are arrays indexed like the nodes."""
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    if n == 0:
+        empty = np.zeros(0)
+        return {'degree': empty, 'component': empty, 'pagerank': empty, 'betweenness': empty}
+    indptr, indices = adjacency(n, src, dst)
+    return {
+        'degree': np.diff(indptr),
+        'component': components(n, src, dst),
+        'pagerank': pagerank(n, indptr, indices),
+        'betweenness': betweenness(n, indptr, indices, samples),
+    }
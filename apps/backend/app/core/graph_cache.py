@@ -0,0 +1,125 @@
+"""Versioned ``/graph`` cache shared by all uvicorn workers.
+
+Writers bump ``graph:version`` (see ``graph_snapshot.record_change``) instead
+of deleting the cache. The cached value is the final response body, stored
+next to the version it was built for, so a reader can tell whether it is
+current without a TTL and can hand the bytes straight to the client. Each
+worker also keeps the last body it served, so an unchanged graph costs one
+``MGET`` of the version counter and its epoch. The epoch is a nonce created
+next to the counter; it goes into the ETag and the worker's memo, so a counter
+that restarts after a Redis flush can't revive an old version's ETag or body.
+
+On a miss exactly one worker rebuilds, holding ``graph:v1:lock``; the others
+keep serving the previous body (stale-while-revalidate) or, when there is
+nothing cached yet, wait for the builder to publish.
+"""
+
+import asyncio
+import uuid
+from app.core.redis import get_raw_redis
+from app.core.graph_changes import EPOCH_KEY, VERSION_KEY
+from app.core.metrics import GRAPH_CACHE, GRAPH_REBUILD
+from app.core.timing import timed
+
+CACHE_KEY = 'graph:v1'
+LOCK_KEY = 'graph:v1:lock'
+LOCK_TTL_MS = 30_000
+WAIT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+
+# Only replace the cached body with a newer build, unless the version counter
+# went backwards (e.g. Redis was flushed), in which case anything goes.
+_PUBLISH = """
+local cached = tonumber(redis.call('HGET', KEYS[1], 'version') or '-1')
+local live = tonumber(redis.call('GET', KEYS[2]) or '0')
+local version = tonumber(ARGV[1])
+if version > cached or cached > live then
+    redis.call('HSET', KEYS[1], 'version', ARGV[1], 'body', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# (epoch, version, body) last served by this worker
+_local: tuple[str, int, bytes] | None = None
+
+
+def etag(epoch: str, version: int, positions: int | None = None) -> str:
+    """``positions`` is the position-buffer generation when unflushed positions were laid over the body."""
+    if positions is None:
+        return f'"graph-{epoch}-{version}"'
+    return f'"graph-{epoch}-{version}-p{positions}"'
+
+
+async def _epoch_and_version(redis) -> tuple[str, int]:
+    epoch, version = await redis.mget(EPOCH_KEY, VERSION_KEY)
+    if epoch is None:
+        # first reader after a (re)start; NX so concurrent readers agree
+        await redis.set(EPOCH_KEY, uuid.uuid4().hex[:12], nx=True)
+        epoch, version = await redis.mget(EPOCH_KEY, VERSION_KEY)
+    return epoch.decode(), int(version or 0)
+
+
+async def _read_cached(redis):
+    cached_version, body = await redis.hmget(CACHE_KEY, 'version', 'body')
+    return (int(cached_version) if cached_version is not None else None), body
+
+
+async def publish(version: int, body: bytes) -> bool:
+    redis = await get_raw_redis()
+    return bool(await redis.eval(_PUBLISH, 2, CACHE_KEY, VERSION_KEY, version, body))
+
+
+async def cached_graph(build) -> tuple[str, int, bytes]:
+    """Return ``(epoch, version, body)`` of the serialized graph.
+
+    ``build`` is an async callable returning ``(version, body)``; it runs at
+    most once per version across all workers while the lock is held. The
+    returned version is the one the body was built for, which may lag the
+    current one while another worker rebuilds.
+    """
+    global _local
+    redis = await get_raw_redis()
+    with timed('cache'):
+        epoch, version = await _epoch_and_version(redis)
+        if _local is not None and _local[:2] == (epoch, version):
+            GRAPH_CACHE.labels('hit_local').inc()
+            return _local
+        cached_version, body = await _read_cached(redis)
+        if body is not None and cached_version == version:
+            GRAPH_CACHE.labels('hit').inc()
+            _local = (epoch, version, body)
+            return _local
+        token = uuid.uuid4().hex
+        locked = await redis.set(LOCK_KEY, token, nx=True, px=LOCK_TTL_MS)
+    if locked:
+        GRAPH_CACHE.labels('miss').inc()
+        try:
+            with GRAPH_REBUILD.time():
+                built = await build()
+            await publish(*built)
+            _local = (epoch, *built)
+            return _local
+        finally:
+            await redis.eval(_RELEASE, 1, LOCK_KEY, token)
+    if body is not None:
+        # someone else is rebuilding; the previous version is good enough meanwhile
+        GRAPH_CACHE.labels('stale').inc()
+        return epoch, cached_version, body
+    GRAPH_CACHE.labels('wait').inc()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WAIT_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        cached_version, body = await _read_cached(redis)
+        if body is not None and cached_version >= version:
+            return epoch, cached_version, body
+    # builder died or is stuck; serve our own build rather than time out
+    return (epoch, *await build())
@@ -0,0 +1,150 @@
+"""Append-only graph change log.
+
+Every committed write bumps ``graph:version`` and appends its change (in the
+patch shape documented in ``graph_snapshot``) to the ``graph:changes`` Redis
+stream under entry id ``<version>-0``, both in one script so versions and log
+entries can never disagree. The stream is capped at ``CHANGE_LOG_MAXLEN``
+entries; clients whose version has been trimmed away (or that hit a change
+that can't be expressed as a patch) get told to fetch the full graph.
+
+Position-only changes (the position flusher, layout jobs) move the version
+like any other, but not ``graph:structure_version``, the version of the last
+change to anything else. State that only depends on nodes, links and groups
+(neighbourhood cursors, analytics) is keyed by the structure version, so
+dragging nodes around doesn't invalidate it.
+"""
+
+import orjson
+from app.core.redis import get_redis
+
+VERSION_KEY = 'graph:version'
+# random per-counter nonce: a Redis flush or restart restarts the counter, and
+# this tells the new run's versions apart from the old one's
+EPOCH_KEY = 'graph:epoch'
+STRUCTURE_KEY = 'graph:structure_version'
+STREAM_KEY = 'graph:changes'
+CHANGE_LOG_MAXLEN = 10_000
+# past this many entries a full refetch is cheaper than replaying deltas
+MAX_REPLAY = 1_000
+RESET = b'null'
+
+# last commit stamp logged per row, kept long enough to outlast any writer
+# still between its commit and its append
+ROW_SEQ_KEY = 'graph:row_seq:{}:{}'
+ROW_SEQ_TTL = 600
+# change key -> row namespace; an update and a removal of one row share it
+_ROW_KINDS = {
+    'nodes': 'node', 'removedNodes': 'node',
+    'links': 'link', 'removedLinks': 'link',
+    'groups': 'group', 'removedGroups': 'group',
+}
+
+# With a commit stamp (ARGV[4]) the change comes as (kind, json) item pairs
+# from ARGV[6], one per row key in KEYS[4..]; items whose row was already
+# logged by a later stamp are left out, and the change is reassembled from
+# the rest (returned too when something was dropped).
+# A stream that outlived its counter (e.g. the key was evicted) would reject
+# the smaller id, so start the log over in that case.
+_APPEND = """
+local data, trimmed = ARGV[1], ''
+if ARGV[4] ~= '' then
+    local seq = tonumber(ARGV[4])
+    local parts, kinds, dropped = {}, {}, false
+    for k = 4, #KEYS do
+        local kind, item = ARGV[2 * k - 2], ARGV[2 * k - 1]
+        if seq >= tonumber(redis.call('GET', KEYS[k]) or '0') then
+            redis.call('SET', KEYS[k], ARGV[4], 'EX', ARGV[5])
+            if not parts[kind] then
+                parts[kind] = {}
+                table.insert(kinds, kind)
+            end
+            table.insert(parts[kind], item)
+        else
+            dropped = true
+        end
+    end
+    local fields = {}
+    for _, kind in ipairs(kinds) do
+        table.insert(fields, '"' .. kind .. '":[' .. table.concat(parts[kind], ',') .. ']')
+    end
+    data = '{' .. table.concat(fields, ',') .. '}'
+    if dropped then
+        trimmed = data
+    end
+end
+local version = redis.call('INCR', KEYS[1])
+local id = version .. '-0'
+local ok = redis.pcall('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], id, 'change', data)
+if type(ok) == 'table' and ok.err then
+    redis.call('DEL', KEYS[2])
+    redis.call('XADD', KEYS[2], id, 'change', data)
+end
+if ARGV[3] == '1' then
+    redis.call('SET', KEYS[3], version)
+end
+return {version, trimmed}
+"""
+
+
+def positions_only(change: dict | None) -> bool:
+    """Whether ``change`` (logged or not) only moves nodes."""
+    if change is None:
+        return False
+    return change.keys() - {'version'} == {'nodes'} and all(n.keys() <= {'id', 'x', 'y'} for n in change['nodes'])
+
+
+async def current_version() -> int:
+    redis = await get_redis()
+    return int(await redis.get(VERSION_KEY) or 0)
+
+
+async def structure_version() -> int | None:
+    redis = await get_redis()
+    value = await redis.get(STRUCTURE_KEY)
+    return int(value) if value is not None else None
+
+
+async def append_change(change: dict | None, seq: int | None = None) -> tuple[int, dict | None]:
+    """Bump the version and log ``change``; ``None`` logs a reset.
+
+    With a commit stamp ``seq``, rows that a later-stamped change already
+    logged are dropped from ``change``. Returns ``(version, logged change)``.
+    """
+    redis = await get_redis()
+    data = orjson.dumps(change) if change is not None else RESET
+    structural = '0' if positions_only(change) else '1'
+    keys, items = [], []
+    if seq is not None and change is not None:
+        for kind, values in change.items():
+            for value in values:
+                row = value['id'] if isinstance(value, dict) else value
+                keys.append(ROW_SEQ_KEY.format(_ROW_KINDS[kind], row))
+                items += (kind, orjson.dumps(value))
+    version, trimmed = await redis.eval(
+        _APPEND, 3 + len(keys), VERSION_KEY, STREAM_KEY, STRUCTURE_KEY, *keys,
+        data, CHANGE_LOG_MAXLEN, structural, '' if seq is None or change is None else seq, ROW_SEQ_TTL, *items,
+    )
+    return int(version), orjson.loads(trimmed) if trimmed else change
+
+
+async def changes_since(since: int) -> tuple[int, list[dict]] | None:
+    """Return ``(version, changes)`` after ``since``, or None if the client needs a full refetch."""
+    redis = await get_redis()
+    current = await current_version()
+    if since == current:
+        return current, []
+    if since > current or current - since > MAX_REPLAY:
+        return None
+    entries = await redis.xrange(STREAM_KEY, min=f'{since + 1}-0', count=MAX_REPLAY)
+    changes = []
+    expected = since + 1
+    for entry_id, fields in entries:
+        version = int(entry_id.split('-', 1)[0])
+        if version != expected or fields['change'] == RESET.decode():
+            return None
+        changes.append({'version': version, **orjson.loads(fields['change'])})
+        expected += 1
+    if expected <= current:
+        # the log was trimmed past ``since``
+        return None
+    return expected - 1, changes
@@ -0,0 +1,601 @@
+"""In-memory graph snapshot served by ``/graph``.
+
+Entities, groups and edges live in dense integer-indexed columns (UUID string
+-> slot index). Memberships are per-entity offsets into a flat array of group
+slots and edges are indexed by a CSR adjacency (per-entity offsets into a flat
+array of edge slots). A snapshot is loaded once per graph version and then
+patched in place by the mutation handlers through ``record_change``; rows that
+change after load live in small per-slot overrides until the next compaction.
+A worker whose snapshot fell behind (another worker wrote) catches up by
+replaying the change log rather than reloading.
+
+Two writers racing on one row may commit in one order and log in the other.
+So handlers commit through ``commit_ordered``, which draws a number from
+``graph_change_seq`` inside the transaction, after its writes (a writer
+blocked on the other's row locks draws after it), and ``record_change``
+hands it to the log, which drops any row a later-stamped change already
+logged (see ``graph_changes``). An edit whose log append never happened
+(Redis error, worker killed in between) is caught by ``verify_snapshot``,
+which every ``SNAPSHOT_VERIFY_INTERVAL`` seconds compares a snapshot replayed
+from the log with one loaded from Postgres and logs a reset if they disagree.
+
+Changes use the same shapes as the ``/graph`` payload::
+
+    {'nodes': [...], 'links': [...], 'groups': [...],
+     'removedNodes': [...], 'removedLinks': [...], 'removedGroups': [...]}
+
+Node and group upserts may be partial (only ``id`` is required); missing keys
+keep their current value. A partial node upsert for an unknown node (e.g. a
+position for a node deleted meanwhile) is ignored. Removals cascade the same
+way the database does: removing a node drops its links, removing a group drops
+its memberships and clears ``parentId`` on its children.
+"""
+
+import asyncio
+import logging
+import os
+from array import array
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import GRAPH_CHANGE_SEQ, Entity, Edge, Group
+from app.db.read_models import graph_rows
+from app.db.session import AsyncSessionLocal
+from app.core.graph_changes import append_change, changes_since, current_version, positions_only, structure_version
+from app.core.positions import buffered_positions
+from app.core.redis import get_redis
+
+DEFAULT_COLOR = '#888888'
+VERIFY_INTERVAL = float(os.getenv('SNAPSHOT_VERIFY_INTERVAL', '300'))
+VERIFY_LOCK_KEY = 'graph:snapshot:verify'
+
+logger = logging.getLogger("app.graph")
+
+# node payload key -> column attribute
+NODE_FIELDS = {
+    'name': 'node_name',
+    'contact_email': 'node_email',
+    'contact_phone': 'node_phone',
+    'notes': 'node_notes',
+    'isCurrentUser': 'node_current',
+    'x': 'node_x',
+    'y': 'node_y',
+}
+
+
+def _csr(n, pairs):
+    """Build (offsets, values) for ``n`` rows from (row, value) pairs."""
+    counts = [0] * (n + 1)
+    for row, _ in pairs:
+        counts[row + 1] += 1
+    for i in range(n):
+        counts[i + 1] += counts[i]
+    offsets = array('i', counts)
+    values = array('i', bytes(4 * counts[n]))
+    fill = list(counts[:n])
+    for row, value in pairs:
+        values[fill[row]] = value
+        fill[row] += 1
+    return offsets, values
+
+
+class GraphSnapshot:
+    def __init__(self, version: int):
+        self.version = version
+        # version of the last change that wasn't positions only (see graph_changes)
+        self.structure_version = version
+        # entities; a None id marks a removed slot
+        self.node_index: dict[str, int] = {}
+        self.node_ids: list[str | None] = []
+        self.node_name: list[str] = []
+        self.node_email: list[str | None] = []
+        self.node_phone: list[str | None] = []
+        self.node_notes: list[str | None] = []
+        self.node_main = array('i')
+        self.node_current: list[bool] = []
+        self.node_x: list[float | None] = []
+        self.node_y: list[float | None] = []
+        # groups
+        self.group_index: dict[str, int] = {}
+        self.group_ids: list[str | None] = []
+        self.group_name: list[str] = []
+        self.group_color: list[str | None] = []
+        self.group_parent = array('i')
+        # edges
+        self.edge_index: dict[str, int] = {}
+        self.edge_ids: list[str | None] = []
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_label: list[str | None] = []
+        # per-entity membership (group slots) and adjacency (edge slots)
+        self.mem_offsets = array('i', [0])
+        self.mem_groups = array('i')
+        self.mem_patch: dict[int, list[int]] = {}
+        self.adj_offsets = array('i', [0])
+        self.adj_edges = array('i')
+        self.adj_patch: dict[int, list[int]] = {}
+        self.dead = 0
+
+    @classmethod
+    def from_rows(cls, version, entities, groups, memberships, edges):
+        """Build a snapshot from plain row tuples.
+
+        entities: (id, name, email, phone, notes, main_group_id, is_current_user, x, y)
+        groups: (id, name, color_hex, parent_group_id)
+        memberships: (entity_id, group_id)
+        edges: (id, a_entity_id, b_entity_id, label)
+        """
+        snap = cls(version)
+        for gid, name, color, _ in groups:
+            snap._new_group(str(gid), name, color)
+        for gid, _, _, parent in groups:
+            if parent is not None:
+                snap.group_parent[snap.group_index[str(gid)]] = snap.group_index.get(str(parent), -1)
+        for eid, name, email, phone, notes, main, current, x, y in entities:
+            i = snap._new_node(str(eid))
+            snap.node_name[i] = name
+            snap.node_email[i] = email
+            snap.node_phone[i] = phone
+            snap.node_notes[i] = notes
+            snap.node_main[i] = snap.group_index.get(str(main), -1) if main is not None else -1
+            snap.node_current[i] = bool(current)
+            snap.node_x[i] = x
+            snap.node_y[i] = y
+        n = len(snap.node_ids)
+        mem_pairs = []
+        for eid, gid in memberships:
+            i = snap.node_index.get(str(eid))
+            g = snap.group_index.get(str(gid))
+            if i is not None and g is not None:
+                mem_pairs.append((i, g))
+        snap.mem_offsets, snap.mem_groups = _csr(n, mem_pairs)
+        adj_pairs = []
+        for eid, a, b, label in edges:
+            ai = snap.node_index.get(str(a))
+            bi = snap.node_index.get(str(b))
+            if ai is None or bi is None:
+                continue
+            e = snap._new_edge(str(eid), ai, bi, label)
+            adj_pairs.append((ai, e))
+            adj_pairs.append((bi, e))
+        snap.adj_offsets, snap.adj_edges = _csr(n, adj_pairs)
+        return snap
+
+    # -- slot allocation -------------------------------------------------
+
+    def _new_node(self, nid):
+        i = len(self.node_ids)
+        self.node_index[nid] = i
+        self.node_ids.append(nid)
+        self.node_name.append('')
+        self.node_email.append(None)
+        self.node_phone.append(None)
+        self.node_notes.append(None)
+        self.node_main.append(-1)
+        self.node_current.append(False)
+        self.node_x.append(None)
+        self.node_y.append(None)
+        return i
+
+    def _new_group(self, gid, name='', color=None):
+        g = len(self.group_ids)
+        self.group_index[gid] = g
+        self.group_ids.append(gid)
+        self.group_name.append(name)
+        self.group_color.append(color)
+        self.group_parent.append(-1)
+        return g
+
+    def _new_edge(self, eid, a, b, label):
+        e = len(self.edge_ids)
+        self.edge_index[eid] = e
+        self.edge_ids.append(eid)
+        self.edge_src.append(a)
+        self.edge_dst.append(b)
+        self.edge_label.append(label)
+        return e
+
+    # -- row access ------------------------------------------------------
+
+    @staticmethod
+    def _row(offsets, values, patch, i):
+        if i in patch:
+            return patch[i]
+        if i + 1 < len(offsets):
+            return values[offsets[i]:offsets[i + 1]]
+        return ()
+
+    def groups_of(self, i):
+        """Live group slots of entity slot ``i``."""
+        gids = self.group_ids
+        return [g for g in self._row(self.mem_offsets, self.mem_groups, self.mem_patch, i) if gids[g] is not None]
+
+    def edges_of(self, i):
+        """Edge slots incident to entity slot ``i``."""
+        return self._row(self.adj_offsets, self.adj_edges, self.adj_patch, i)
+
+    def neighbors(self, i):
+        src, dst = self.edge_src, self.edge_dst
+        return [dst[e] if src[e] == i else src[e] for e in self.edges_of(i)]
+
+    def current_user(self):
+        """Slot of the entity flagged as the current user, or None."""
+        i = -1
+        while True:
+            try:
+                i = self.node_current.index(True, i + 1)
+            except ValueError:
+                return None
+            if self.node_ids[i] is not None:
+                return i
+
+    def neighborhood(self, start, depth, fanout, budget):
+        """Breadth-first slots around ``start``, at most ``depth`` hops out.
+
+        Each node contributes at most ``fanout`` unseen neighbours to the next
+        hop and the walk stops at ``budget`` nodes. The order is deterministic
+        for a given snapshot. Returns ``(slots, truncated)``.
+        """
+        seen = {start}
+        order = [start]
+        frontier = [start]
+        truncated = False
+        for _ in range(depth):
+            nxt = []
+            for i in frontier:
+                taken = 0
+                for j in self.neighbors(i):
+                    if j in seen:
+                        continue
+                    if taken == fanout or len(order) == budget:
+                        truncated = True
+                        break
+                    seen.add(j)
+                    order.append(j)
+                    nxt.append(j)
+                    taken += 1
+                if len(order) == budget and truncated:
+                    return order, truncated
+            if not nxt:
+                break
+            frontier = nxt
+        return order, truncated
+
+    def _mutable_adj(self, i):
+        row = self.adj_patch.get(i)
+        if row is None:
+            row = self.adj_patch[i] = list(self._row(self.adj_offsets, self.adj_edges, {}, i))
+        return row
+
+    # -- patching --------------------------------------------------------
+
+    def apply(self, change: dict):
+        for g in change.get('groups', ()):
+            self._upsert_group(g)
+        for n in change.get('nodes', ()):
+            self._upsert_node(n)
+        for lid in change.get('removedLinks', ()):
+            self._remove_link(lid)
+        for link in change.get('links', ()):
+            self._upsert_link(link)
+        for nid in change.get('removedNodes', ()):
+            self._remove_node(nid)
+        for gid in change.get('removedGroups', ()):
+            self._remove_group(gid)
+        if self.dead > 1024 and self.dead * 4 > len(self.node_ids) + len(self.edge_ids) + len(self.group_ids):
+            self.compact()
+
+    def _group_slot(self, gid):
+        return self.group_index.get(gid, -1) if gid is not None else -1
+
+    def _upsert_group(self, g):
+        gi = self.group_index.get(g['id'])
+        if gi is None:
+            gi = self._new_group(g['id'])
+        if 'name' in g:
+            self.group_name[gi] = g['name']
+        if 'color' in g:
+            self.group_color[gi] = g['color']
+        if 'parentId' in g:
+            self.group_parent[gi] = self._group_slot(g['parentId'])
+
+    def _upsert_node(self, n):
+        i = self.node_index.get(n['id'])
+        if i is None:
+            if 'name' not in n:
+                return
+            i = self._new_node(n['id'])
+        for key, attr in NODE_FIELDS.items():
+            if key in n:
+                getattr(self, attr)[i] = n[key]
+        if 'mainGroupId' in n:
+            self.node_main[i] = self._group_slot(n['mainGroupId'])
+        if 'groupIds' in n:
+            self.mem_patch[i] = [g for g in map(self.group_index.get, n['groupIds']) if g is not None]
+
+    def _upsert_link(self, link):
+        e = self.edge_index.get(link['id'])
+        if e is not None:
+            if 'label' in link:
+                self.edge_label[e] = link['label']
+            return
+        a = self.node_index.get(link['source'])
+        b = self.node_index.get(link['target'])
+        if a is None or b is None:
+            return
+        e = self._new_edge(link['id'], a, b, link.get('label'))
+        self._mutable_adj(a).append(e)
+        self._mutable_adj(b).append(e)
+
+    def _remove_link(self, lid):
+        e = self.edge_index.pop(lid, None)
+        if e is None:
+            return
+        for i in (self.edge_src[e], self.edge_dst[e]):
+            row = self._mutable_adj(i)
+            if e in row:
+                row.remove(e)
+        self.edge_ids[e] = None
+        self.dead += 1
+
+    def _remove_node(self, nid):
+        i = self.node_index.pop(nid, None)
+        if i is None:
+            return
+        for e in list(self.edges_of(i)):
+            self._remove_link(self.edge_ids[e])
+        self.node_ids[i] = None
+        self.mem_patch.pop(i, None)
+        self.dead += 1
+
+    def _remove_group(self, gid):
+        gi = self.group_index.pop(gid, None)
+        if gi is None:
+            return
+        self.group_ids[gi] = None
+        for g, parent in enumerate(self.group_parent):
+            if parent == gi:
+                self.group_parent[g] = -1
+        for i, main in enumerate(self.node_main):
+            if main == gi:
+                self.node_main[i] = -1
+        self.dead += 1
+
+    def rows(self):
+        """Live state as the row tuples accepted by ``from_rows``."""
+        gids, nids = self.group_ids, self.node_ids
+
+        def gid_at(g):
+            return gids[g] if g >= 0 else None
+
+        groups = [(gid, self.group_name[g], self.group_color[g], gid_at(self.group_parent[g]))
+                  for g, gid in enumerate(gids) if gid is not None]
+        entities = []
+        memberships = []
+        for i, nid in enumerate(nids):
+            if nid is None:
+                continue
+            entities.append((nid, self.node_name[i], self.node_email[i], self.node_phone[i], self.node_notes[i],
+                             gid_at(self.node_main[i]), self.node_current[i], self.node_x[i], self.node_y[i]))
+            memberships.extend((nid, gids[g]) for g in self.groups_of(i))
+        edges = [(eid, nids[self.edge_src[e]], nids[self.edge_dst[e]], self.edge_label[e])
+                 for e, eid in enumerate(self.edge_ids) if eid is not None]
+        return entities, groups, memberships, edges
+
+    def compact(self):
+        """Re-pack slots and fold the per-slot overrides back into CSR arrays."""
+        packed = GraphSnapshot.from_rows(self.version, *self.rows())
+        packed.structure_version = self.structure_version
+        self.__dict__.update(packed.__dict__)
+
+    def advance(self, version: int, change: dict | None):
+        """Move to ``version`` after ``change`` was applied."""
+        self.version = version
+        if not positions_only(change):
+            self.structure_version = version
+
+    # -- serialization ---------------------------------------------------
+
+    def node_at(self, i, group_slots=None) -> dict:
+        """``/graph`` node payload of entity slot ``i``."""
+        gids = self.group_ids
+        if group_slots is None:
+            group_slots = self.groups_of(i)
+        main = self.node_main[i]
+        return {
+            'id': self.node_ids[i],
+            'name': self.node_name[i],
+            'contact_email': self.node_email[i],
+            'contact_phone': self.node_phone[i],
+            'notes': self.node_notes[i],
+            'groupIds': [gids[g] for g in group_slots],
+            'mainGroupId': gids[main] if main >= 0 else None,
+            'isCurrentUser': self.node_current[i],
+            'x': self.node_x[i],
+            'y': self.node_y[i],
+        }
+
+    def link_at(self, e) -> dict:
+        nids = self.node_ids
+        return {'id': self.edge_ids[e], 'source': nids[self.edge_src[e]], 'target': nids[self.edge_dst[e]],
+                'label': self.edge_label[e]}
+
+    def to_payload(self) -> dict:
+        gids, nids = self.group_ids, self.node_ids
+        members = [[] for _ in gids]
+        nodes = []
+        for i, nid in enumerate(nids):
+            if nid is None:
+                continue
+            group_slots = self.groups_of(i)
+            for g in group_slots:
+                members[g].append(nid)
+            nodes.append(self.node_at(i, group_slots))
+        links = [self.link_at(e) for e, eid in enumerate(self.edge_ids) if eid is not None]
+        groups = []
+        for g, gid in enumerate(gids):
+            if gid is None:
+                continue
+            parent = self.group_parent[g]
+            groups.append({
+                'id': gid,
+                'name': self.group_name[g],
+                'color': self.group_color[g] or DEFAULT_COLOR,
+                'parentId': gids[parent] if parent >= 0 else None,
+                'memberIds': members[g],
+            })
+        return {'nodes': nodes, 'links': links, 'groups': groups}
+
+
+def node_payload(ent: Entity, group_ids=None) -> dict:
+    """Node upsert for an ORM entity; ``groupIds`` is only set when given."""
+    node = {
+        'id': str(ent.id),
+        'name': ent.name,
+        'contact_email': ent.contact_email,
+        'contact_phone': ent.contact_phone,
+        'notes': ent.notes,
+        'mainGroupId': str(ent.main_group_id) if ent.main_group_id else None,
+        'isCurrentUser': ent.is_current_user,
+        'x': ent.pos_x,
+        'y': ent.pos_y,
+    }
+    if group_ids is not None:
+        node['groupIds'] = [str(g) for g in group_ids]
+    return node
+
+
+def link_payload(edge: Edge) -> dict:
+    return {'id': str(edge.id), 'source': str(edge.a_entity_id), 'target': str(edge.b_entity_id), 'label': edge.label}
+
+
+def group_payload(g: Group) -> dict:
+    return {
+        'id': str(g.id),
+        'name': g.name,
+        'color': g.color_hex,
+        'parentId': str(g.parent_group_id) if g.parent_group_id else None,
+    }
+
+
+async def load_snapshot(db: AsyncSession, version: int) -> GraphSnapshot:
+    # read the position buffer before the rows: anything buffered later is
+    # logged by the flusher past ``version`` and gets replayed from the change log
+    structure = await structure_version()
+    positions = await buffered_positions()
+    entities, groups, memberships, edges = await graph_rows(db)
+    snap = GraphSnapshot.from_rows(version, entities, groups, memberships, edges)
+    if structure is not None:
+        snap.structure_version = min(structure, version)
+    snap.apply({'nodes': [{'id': eid, 'x': x, 'y': y} for eid, (x, y) in positions.items()]})
+    return snap
+
+
+_snapshot: GraphSnapshot | None = None
+_load_lock = asyncio.Lock()
+
+
+async def get_snapshot(db: AsyncSession) -> GraphSnapshot:
+    """Return this worker's snapshot, brought up to the current graph version.
+
+    A snapshot that fell behind replays the change log; it is only reloaded
+    from the database when the log can't bridge the gap.
+    """
+    global _snapshot
+    # read the version before loading so a concurrent write can only make us catch up again
+    version = await current_version()
+    snap = _snapshot
+    if snap is not None and snap.version == version:
+        return snap
+    async with _load_lock:
+        snap = _snapshot
+        if snap is not None and snap.version < version:
+            found = await changes_since(snap.version)
+            if found is not None:
+                for change in found[1]:
+                    if change['version'] > snap.version:
+                        snap.apply(change)
+                        snap.advance(change['version'], change)
+        if snap is None or snap.version < version:
+            snap = _snapshot = await load_snapshot(db, version)
+    return snap
+
+
+async def commit_ordered(db: AsyncSession) -> int:
+    """Commit ``db``'s transaction; returns the stamp ``record_change`` orders its change by.
+
+    The stamp is taken last, after the transaction's writes: a writer that
+    had to wait for another's row locks draws a higher one.
+    """
+    seq = await db.scalar(select(GRAPH_CHANGE_SEQ.next_value()))
+    await db.commit()
+    return seq
+
+
+async def _append(change: dict | None, seq: int | None) -> tuple[int, dict | None]:
+    try:
+        return await append_change(change, seq)
+    except Exception:
+        if change is None:
+            raise
+        # the commit already happened: make every reader reload rather than miss it
+        logger.exception("appending a graph change failed; logging a reset instead")
+        return await append_change(None)
+
+
+async def record_change(change: dict | None, seq: int | None = None) -> int:
+    """Log a committed write, bumping the graph version, and patch the local snapshot.
+
+    Bumping the version is all the invalidation the ``/graph`` cache needs.
+    ``seq`` comes from ``commit_ordered``; rows a change with a higher stamp
+    has already logged are dropped from this one. ``None`` marks a change
+    that can't be expressed as a patch (e.g. a bulk import); the next read
+    reloads the snapshot. If another writer got in between, the patch is
+    left to ``get_snapshot`` so the log is replayed in order.
+    """
+    version, change = await _append(change, seq)
+    snap = _snapshot
+    if snap is not None and change is not None and snap.version == version - 1:
+        snap.apply(change)
+        snap.advance(version, change)
+    return version
+
+
+def _content(snap: GraphSnapshot) -> tuple:
+    """Everything in the payload but positions (the buffer and the log may disagree on those)."""
+    payload = snap.to_payload()
+    nodes = {n['id']: {**n, 'groupIds': sorted(n['groupIds']), 'x': None, 'y': None} for n in payload['nodes']}
+    groups = {g['id']: {**g, 'memberIds': sorted(g['memberIds'])} for g in payload['groups']}
+    return nodes, {link['id']: link for link in payload['links']}, groups
+
+
+async def verify_snapshot() -> bool:
+    """Compare the log-replayed snapshot with Postgres; log a reset if they differ.
+
+    Returns True when a reset was logged. A write that lands while comparing
+    skips the round; an edit committed but not yet logged can still cause a
+    needless reset, which only costs a reload.
+    """
+    async with AsyncSessionLocal() as db:
+        snap = await get_snapshot(db)
+        fresh = await load_snapshot(db, snap.version)
+    if await current_version() != snap.version:
+        return False
+    if await asyncio.to_thread(_content, fresh) == await asyncio.to_thread(_content, snap):
+        return False
+    logger.warning("graph snapshot at version %d disagrees with the database; logging a reset", snap.version)
+    await record_change(None)
+    return True
+
+
+async def run_verifier() -> None:
+    while True:
+        await asyncio.sleep(VERIFY_INTERVAL)
+        try:
+            redis = await get_redis()
+            # one worker per interval is enough: all of them replay the same log
+            if await redis.set(VERIFY_LOCK_KEY, '1', nx=True, px=int(VERIFY_INTERVAL * 1000)):
+                await verify_snapshot()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("graph snapshot verification failed; will retry")
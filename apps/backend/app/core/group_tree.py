@@ -0,0 +1,107 @@
+"""Closure table for the group hierarchy.
+
+``group_closure`` holds one row per (ancestor, descendant) pair of the group
+tree, including each group paired with itself at depth 0, so "everything
+under X" is a single indexed lookup instead of a recursive walk. The rows
+are maintained next to ``groups.parent_group_id`` by the group handlers (and
+rebuilt wholesale by CSV import); all changes to the tree take a transaction
+advisory lock, so two concurrent moves can't sneak a cycle past each other.
+"""
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+_LOCK = "SELECT pg_advisory_xact_lock(hashtext('group_closure'))"
+
+_INSERT = """
+INSERT INTO group_closure (ancestor_id, descendant_id, depth)
+SELECT CAST(:group_id AS uuid), CAST(:group_id AS uuid), 0
+UNION ALL
+SELECT ancestor_id, CAST(:group_id AS uuid), depth + 1 FROM group_closure WHERE descendant_id = :parent_id
+"""
+
+_IS_DESCENDANT = """
+SELECT 1 FROM group_closure WHERE ancestor_id = :group_id AND descendant_id = :parent_id
+"""
+
+# cut the subtree under each of group_ids loose from everything above it
+_DETACH = """
+DELETE FROM group_closure c
+USING group_closure sub
+WHERE sub.ancestor_id = ANY(CAST(:group_ids AS uuid[]))
+  AND c.descendant_id = sub.descendant_id
+  AND NOT EXISTS (
+      SELECT 1 FROM group_closure inside
+      WHERE inside.ancestor_id = sub.ancestor_id AND inside.descendant_id = c.ancestor_id
+  )
+"""
+
+_ATTACH = """
+INSERT INTO group_closure (ancestor_id, descendant_id, depth)
+SELECT up.ancestor_id, sub.descendant_id, up.depth + sub.depth + 1
+FROM group_closure up CROSS JOIN group_closure sub
+WHERE up.descendant_id = :parent_id AND sub.ancestor_id = :group_id
+"""
+
+_REBUILD = """
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM groups
+    UNION ALL
+    SELECT t.ancestor_id, g.id, t.depth + 1
+    FROM tree t JOIN groups g ON g.parent_group_id = t.descendant_id
+)
+INSERT INTO group_closure (ancestor_id, descendant_id, depth)
+SELECT ancestor_id, descendant_id, depth FROM tree
+"""
+
+_HAS_CYCLE = """
+WITH RECURSIVE up (id, parent_id) AS (
+    SELECT id, parent_group_id FROM groups WHERE parent_group_id IS NOT NULL
+    UNION ALL
+    SELECT up.id, g.parent_group_id FROM up JOIN groups g ON g.id = up.parent_id
+    WHERE g.parent_group_id IS NOT NULL
+) CYCLE id, parent_id SET is_cycle USING path
+SELECT 1 FROM up WHERE is_cycle OR parent_id = id LIMIT 1
+"""
+
+
+def _cycle():
+    return HTTPException(status_code=400, detail='A group cannot be its own ancestor')
+
+
+async def add_group(db: AsyncSession, group_id, parent_id) -> None:
+    """Closure rows for a new group (flushed, not yet committed)."""
+    await db.execute(text(_LOCK))
+    await db.execute(text(_INSERT), {'group_id': group_id, 'parent_id': parent_id})
+
+
+async def move_group(db: AsyncSession, group_id, parent_id) -> None:
+    """Re-hang ``group_id`` (and its subtree) under ``parent_id``; None makes it a root.
+
+    Raises 400 when ``parent_id`` is the group itself or one of its descendants.
+    """
+    await db.execute(text(_LOCK))
+    if parent_id is not None and (await db.execute(text(_IS_DESCENDANT), {'group_id': group_id, 'parent_id': parent_id})).first():
+        raise _cycle()
+    await db.execute(text(_DETACH), {'group_ids': [str(group_id)]})
+    if parent_id is not None:
+        await db.execute(text(_ATTACH), {'group_id': group_id, 'parent_id': parent_id})
+
+
+async def remove_groups(db: AsyncSession, group_ids) -> None:
+    """Before deleting groups: their children become roots, like ``ON DELETE SET NULL`` makes them.
+
+    The groups' own rows go with them (``ON DELETE CASCADE``).
+    """
+    await db.execute(text(_LOCK))
+    await db.execute(text(_DETACH), {'group_ids': [str(g) for g in group_ids]})
+
+
+async def rebuild(db: AsyncSession) -> None:
+    """Recompute the whole table from ``parent_group_id``; 400 if the parents form a cycle."""
+    await db.execute(text(_LOCK))
+    if (await db.execute(text(_HAS_CYCLE))).first():
+        raise _cycle()
+    await db.execute(text('DELETE FROM group_closure'))
+    await db.execute(text(_REBUILD))
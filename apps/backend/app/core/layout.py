@@ -0,0 +1,261 @@
+"""Server-side force-directed layout for graphs too big to settle in the browser.
+
+``ForceLayout`` is a Fruchterman-Reingold style simulation over NumPy arrays:
+
+* repulsion uses a particle-mesh approximation: node mass is spread onto a
+  square grid (cloud-in-cell), convolved with the ``k^2 / r`` force kernel by
+  FFT and interpolated back, so a step costs O(n + M^2 log M) instead of O(n^2);
+* links pull their endpoints together (``d^2 / k``);
+* group membership pulls each member towards its group's centroid, which keeps
+  groups visually clustered;
+* a weak gravity towards the centre of mass keeps disconnected components
+  from drifting apart.
+
+Nodes that already have a position start there, and the simulation then runs
+cooler so an existing layout is refined rather than reshuffled.
+
+Jobs run one at a time per deployment (``graph:layout:lock``) in a worker
+thread, a few iterations per hop so progress can be reported. Job state lives
+in a Redis hash, so any worker can answer a progress poll. Results go through
+the position write-behind buffer like dragged nodes, flushed (and so
+published as one position-only graph change) as soon as the job ends.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+import numpy as np
+from app.core.graph_snapshot import GraphSnapshot
+from app.core.positions import buffer_positions, flush_positions
+from app.core.redis import get_redis
+
+LOCK_KEY = 'graph:layout:lock'
+JOB_KEY = 'graph:layout:job:{}'
+JOB_TTL = 3600
+LOCK_TTL_MS = 15 * 60_000
+STEP_CHUNK = 10
+
+logger = logging.getLogger("app.layout")
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# background job tasks; held so they aren't garbage collected mid-run
+_tasks: set[asyncio.Task] = set()
+
+
+class ForceLayout:
+    LINK_DISTANCE = 30.0
+    GROUP_STRENGTH = 0.1
+    GRAVITY = 0.01
+
+    def __init__(self, pos, edges, members, n_groups: int, iterations: int, seed: int = 0):
+        """``pos``: (n, 2) floats, NaN where a node has no position yet;
+        ``edges``: (m, 2) node indices; ``members``: (p, 2) (node, group) indices."""
+        self.n = len(pos)
+        self.edges = np.asarray(edges, dtype=np.intp).reshape(-1, 2)
+        self.members = np.asarray(members, dtype=np.intp).reshape(-1, 2)
+        self.n_groups = n_groups
+        self.iterations = iterations
+        self.done = 0
+        self.k = self.LINK_DISTANCE
+        self.pos = self._seed(np.array(pos, dtype=np.float64).reshape(-1, 2), np.random.default_rng(seed))
+        placed = self.n and np.isfinite(np.asarray(pos, dtype=np.float64)).all(axis=1).mean()
+        spread = self.k * np.sqrt(max(self.n, 1))
+        # a mostly placed graph only needs refining; a fresh one needs room to untangle
+        self.t0 = self.k if placed > 0.5 else spread / 10
+        self.grid = int(np.clip(2 ** np.ceil(np.log2(2 * np.sqrt(max(self.n, 1)))), 16, 512))
+        self._kernel = self._kernel_fft(self.grid)
+
+    def _seed(self, pos, rng):
+        missing = ~np.isfinite(pos).all(axis=1)
+        if not missing.any():
+            return pos
+        placed = ~missing
+        # a new node starts next to its placed neighbours when it has any...
+        if placed.any() and len(self.edges):
+            a, b = self.edges[:, 0], self.edges[:, 1]
+            into = np.concatenate([a[missing[a] & placed[b]], b[missing[b] & placed[a]]])
+            src = np.concatenate([b[missing[a] & placed[b]], a[missing[b] & placed[a]]])
+            count = np.bincount(into, minlength=self.n)
+            has = count > 0
+            for d in range(2):
+                total = np.bincount(into, weights=pos[src, d], minlength=self.n)
+                pos[has, d] = total[has] / count[has]
+            missing &= ~has
+            pos[has] += rng.normal(scale=self.k / 3, size=(int(has.sum()), 2))
+        # ...otherwise somewhere in a disc around the placed ones (or the origin)
+        if missing.any():
+            centre = pos[placed].mean(axis=0) if placed.any() else np.zeros(2)
+            radius = self.k * np.sqrt(self.n)
+            r = radius * np.sqrt(rng.random(int(missing.sum())))
+            a = rng.random(len(r)) * 2 * np.pi
+            pos[missing] = centre + np.column_stack([r * np.cos(a), r * np.sin(a)])
+        return pos
+
+    @staticmethod
+    def _kernel_fft(m: int):
+        """FFTs of the repulsion kernel ``d / |d|^2`` on a (2m, 2m) grid, in cell units."""
+        off = np.fft.fftfreq(2 * m, 1 / (2 * m))
+        dx, dy = np.meshgrid(off, off, indexing='ij')
+        r2 = dx * dx + dy * dy + 0.25  # softened: neighbours in the same cell still push apart
+        kx, ky = dx / r2, dy / r2
+        kx[0, 0] = ky[0, 0] = 0.0
+        return np.fft.rfft2(kx), np.fft.rfft2(ky)
+
+    def _repulsion(self):
+        m = self.grid
+        lo = self.pos.min(axis=0)
+        cell = max(float((self.pos.max(axis=0) - lo).max()) / (m - 1), 1e-9)
+        g = (self.pos - lo) / cell
+        i0 = np.minimum(np.floor(g).astype(np.intp), m - 2)
+        f = g - i0
+        corners = []
+        for cx in (0, 1):
+            for cy in (0, 1):
+                w = (f[:, 0] if cx else 1 - f[:, 0]) * (f[:, 1] if cy else 1 - f[:, 1])
+                corners.append(((i0[:, 0] + cx) * 2 * m + i0[:, 1] + cy, w))
+        rho = np.zeros(4 * m * m)
+        for idx, w in corners:
+            rho += np.bincount(idx, weights=w, minlength=4 * m * m)
+        rho = np.fft.rfft2(rho.reshape(2 * m, 2 * m))
+        # kernel is in cell units: k^2 d/|d|^2 scales with 1/cell
+        scale = self.k * self.k / cell
+        force = np.zeros_like(self.pos)
+        for d, kernel in enumerate(self._kernel):
+            field = np.fft.irfft2(rho * kernel, s=(2 * m, 2 * m)).ravel()
+            for idx, w in corners:
+                force[:, d] += field[idx] * w
+        return force * scale
+
+    def _pull(self, force, a, b, strength):
+        """Spring between rows ``a`` of ``self.pos`` and points ``b`` (``d^2 / k``)."""
+        d = b - self.pos[a]
+        f = d * (np.hypot(d[:, 0], d[:, 1]) / self.k * strength)[:, None]
+        for axis in range(2):
+            force[:, axis] += np.bincount(a, weights=f[:, axis], minlength=self.n)
+        return f
+
+    def step(self, count: int = 1) -> None:
+        for _ in range(min(count, self.iterations - self.done)):
+            if self.n < 2:
+                self.done = self.iterations
+                return
+            force = self._repulsion()
+            if len(self.edges):
+                a, b = self.edges[:, 0], self.edges[:, 1]
+                f = self._pull(force, a, self.pos[b], 1.0)
+                for axis in range(2):
+                    force[:, axis] -= np.bincount(b, weights=f[:, axis], minlength=self.n)
+            if len(self.members):
+                node, group = self.members[:, 0], self.members[:, 1]
+                size = np.maximum(np.bincount(group, minlength=self.n_groups), 1)
+                centroid = np.column_stack([
+                    np.bincount(group, weights=self.pos[node, axis], minlength=self.n_groups) / size
+                    for axis in range(2)
+                ])
+                self._pull(force, node, centroid[group], self.GROUP_STRENGTH)
+            off = self.pos - self.pos.mean(axis=0)
+            force -= off * (np.hypot(off[:, 0], off[:, 1]) / self.k * self.GRAVITY)[:, None]
+            # move along the force, at most the current temperature (linear cooling)
+            t = self.t0 * (1 - self.done / self.iterations) + self.k / 100
+            length = np.maximum(np.hypot(force[:, 0], force[:, 1]), 1e-9)
+            self.pos += force * (np.minimum(length, t) / length)[:, None]
+            self.done += 1
+
+    @classmethod
+    def from_snapshot(cls, snap: GraphSnapshot, iterations: int):
+        """Arrays for the live nodes of ``snap``; returns ``(layout, node ids)``."""
+        slots = [i for i, nid in enumerate(snap.node_ids) if nid is not None]
+        index = {i: n for n, i in enumerate(slots)}
+        pos = [(snap.node_x[i], snap.node_y[i]) for i in slots]
+        pos = np.array([(np.nan, np.nan) if None in xy else xy for xy in pos], dtype=np.float64).reshape(-1, 2)
+        edges = [
+            (index[snap.edge_src[e]], index[snap.edge_dst[e]])
+            for e, eid in enumerate(snap.edge_ids)
+            if eid is not None
+        ]
+        members = [(index[i], g) for i in slots for g in snap.groups_of(i)]
+        layout = cls(pos, edges, members, len(snap.group_ids), iterations)
+        return layout, [snap.node_ids[i] for i in slots]
+
+
+async def _update_job(job_id: str, **fields) -> None:
+    redis = await get_redis()
+    key = JOB_KEY.format(job_id)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+        pipe.expire(key, JOB_TTL)
+        await pipe.execute()
+
+
+async def _run(job_id: str, layout: ForceLayout, ids: list[str]) -> None:
+    try:
+        while layout.done < layout.iterations:
+            await asyncio.to_thread(layout.step, STEP_CHUNK)
+            await _update_job(job_id, progress=round(layout.done / layout.iterations, 3), done=layout.done)
+        positions = {eid: (float(x), float(y)) for eid, (x, y) in zip(ids, layout.pos)}
+        await buffer_positions(positions)
+        # publish now rather than at the next tick (unless a flush is already running)
+        await flush_positions()
+        await _update_job(job_id, status='done', progress=1, finishedAt=time.time())
+    except asyncio.CancelledError:
+        await asyncio.shield(_update_job(job_id, status='failed', error='cancelled'))
+        raise
+    except Exception as exc:
+        logger.exception("layout job %s failed", job_id)
+        await _update_job(job_id, status='failed', error=str(exc) or type(exc).__name__)
+    finally:
+        redis = await get_redis()
+        await redis.eval(_RELEASE, 1, LOCK_KEY, job_id)
+
+
+async def start_job(snap: GraphSnapshot, iterations: int) -> tuple[str, bool]:
+    """Start a layout of ``snap``; returns ``(job id, started)``.
+
+    When a job is already running its id is returned with ``started=False``.
+    """
+    redis = await get_redis()
+    job_id = uuid.uuid4().hex
+    if not await redis.set(LOCK_KEY, job_id, nx=True, px=LOCK_TTL_MS):
+        running = await redis.get(LOCK_KEY)
+        if running:
+            return running, False
+        return await start_job(snap, iterations)
+    try:
+        layout, ids = ForceLayout.from_snapshot(snap, iterations)
+        await _update_job(
+            job_id, status='running', progress=0, done=0, iterations=iterations,
+            nodes=len(ids), version=snap.version, startedAt=time.time(),
+        )
+    except BaseException:
+        await redis.delete(LOCK_KEY)
+        raise
+    task = asyncio.create_task(_run(job_id, layout, ids))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job_id, True
+
+
+async def get_job(job_id: str) -> dict | None:
+    redis = await get_redis()
+    job = await redis.hgetall(JOB_KEY.format(job_id))
+    if not job:
+        return None
+    out = {'id': job_id, 'status': job['status'], 'error': job.get('error')}
+    for key in ('progress', 'startedAt', 'finishedAt'):
+        out[key] = float(job[key]) if key in job else None
+    for key in ('done', 'iterations', 'nodes', 'version'):
+        out[key] = int(job[key])
+    return out
+
+
+async def cancel_jobs() -> None:
+    for task in list(_tasks):
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
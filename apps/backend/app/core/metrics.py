@@ -0,0 +1,45 @@
+"""Prometheus metrics.
+
+uvicorn runs several worker processes (``start.sh``), so when
+``PROMETHEUS_MULTIPROC_DIR`` is set every worker writes its samples to files
+in that directory and ``/metrics`` aggregates all of them; without it (tests,
+a single dev server) the default in-process registry is served. The
+directory must be emptied before the workers start, which ``start.sh`` does.
+"""
+
+import os
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route template and status',
+    ['method', 'route', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled', ['method'], multiprocess_mode='livesum')
+POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a database connection from the pool',
+    buckets=(.0005, .001, .005, .01, .05, .1, .5, 1, 5, 30),
+)
+GRAPH_CACHE = Counter('graph_cache_requests_total', '/graph cache lookups by outcome', ['result'])
+GRAPH_REBUILD = Histogram('graph_cache_rebuild_seconds', 'Time to rebuild and serialize the /graph body')
+RATE_LIMITED = Counter('rate_limit_rejections_total', 'Requests rejected with 429', ['source'])
+TELEMETRY_EVENTS = Counter('telemetry_events_total', 'Telemetry events by outcome', ['outcome'])
+
+
+def render() -> tuple[bytes, str]:
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead() -> None:
+    """Drop this worker's live gauges from the aggregate once it exits."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,77 @@
+"""Raw ASGI middleware: access logging with Server-Timing, and rate limiting.
+
+Written against the ASGI interface directly rather than ``@app.middleware``,
+which runs every request through BaseHTTPMiddleware's extra task and
+response re-wrapping.
+"""
+
+import logging
+import os
+import time
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.metrics import IN_FLIGHT, REQUEST_LATENCY
+from app.core.query_budget import finish_query_stats, start_query_stats
+from app.core.rate_limit import rate_limit
+from app.core.timing import server_timing, start_timings, timed
+
+logger = logging.getLogger("app.access")
+
+
+class AccessLogMiddleware:
+    """Logs each request, records its latency metrics and query budget, and adds
+    a ``Server-Timing`` header."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        timings = start_timings()
+        queries = start_query_stats()
+        status = 500
+        method = scope['method']
+        in_flight = IN_FLIGHT.labels(method)
+        in_flight.inc()
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(timings, time.perf_counter() - start)))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            # label by route template, not raw path, to keep cardinality bounded
+            route = scope.get('route')
+            REQUEST_LATENCY.labels(method, route.path if route else 'unmatched', status).observe(elapsed)
+            logger.info("%s %s -> %s %.1fms", method, scope['path'], status, elapsed * 1000)
+            finish_query_stats(queries, method, scope['path'])
+
+
+class RateLimitMiddleware:
+    """Answers 429 for clients over their budget (see ``app.core.rate_limit``)."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope['type'] == 'http' and os.getenv('DISABLE_RATE_LIMIT') != '1'
+                and not scope['path'].startswith(('/docs', '/openapi'))):
+            try:
+                with timed('rl'):
+                    await rate_limit(Request(scope))
+            except HTTPException as e:
+                response = JSONResponse(status_code=e.status_code, content={'detail': e.detail}, headers=e.headers)
+                return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,105 @@
+"""Shortest paths over the in-memory snapshot's adjacency.
+
+Single paths come from a bidirectional BFS that always grows the smaller
+frontier, so on a social graph a 6-hop search touches a few thousand nodes
+rather than the whole graph. ``k`` shortest (loopless) paths use Yen's
+algorithm with the same BFS for each spur search. Every search honours a
+maximum depth and a deadline; running out of time returns whatever was found.
+"""
+
+import heapq
+import time
+
+DEADLINE_CHECK = 256
+
+
+class Timeout(Exception):
+    pass
+
+
+def _expand(snap, frontier, seen, banned_nodes, banned_edges, depth, deadline):
+    src, dst = snap.edge_src, snap.edge_dst
+    nxt = []
+    for n, u in enumerate(frontier):
+        if n % DEADLINE_CHECK == 0 and time.monotonic() > deadline:
+            raise Timeout
+        for e in snap.edges_of(u):
+            if e in banned_edges:
+                continue
+            v = dst[e] if src[e] == u else src[e]
+            if v in seen or v in banned_nodes:
+                continue
+            seen[v] = (u, e, depth)
+            nxt.append(v)
+    return nxt
+
+
+def _walk(parents, i):
+    """Nodes and edges from ``i`` back to its search root."""
+    nodes, edges = [i], []
+    while parents[i][0] is not None:
+        i, e = parents[i][0], parents[i][1]
+        nodes.append(i)
+        edges.append(e)
+    return nodes, edges
+
+
+def shortest_path(snap, a, b, max_depth, deadline, banned_nodes=frozenset(), banned_edges=frozenset()):
+    """``(nodes, edges)`` of a shortest ``a``-``b`` path of at most ``max_depth`` hops, or None."""
+    if a == b:
+        return [a], []
+    fwd, bwd = {a: (None, None, 0)}, {b: (None, None, 0)}
+    fwd_front, bwd_front = [a], [b]
+    fwd_depth = bwd_depth = 0
+    while fwd_front and bwd_front and fwd_depth + bwd_depth < max_depth:
+        if len(fwd_front) <= len(bwd_front):
+            fwd_depth += 1
+            fwd_front = new = _expand(snap, fwd_front, fwd, banned_nodes, banned_edges, fwd_depth, deadline)
+        else:
+            bwd_depth += 1
+            bwd_front = new = _expand(snap, bwd_front, bwd, banned_nodes, banned_edges, bwd_depth, deadline)
+        # all of this level is in; the best meeting point among it is a shortest path
+        meet = [v for v in new if v in fwd and v in bwd]
+        if meet:
+            v = min(meet, key=lambda v: fwd[v][2] + bwd[v][2])
+            head, head_edges = _walk(fwd, v)
+            tail, tail_edges = _walk(bwd, v)
+            return head[::-1] + tail[1:], head_edges[::-1] + tail_edges
+    return None
+
+
+def k_shortest_paths(snap, a, b, k, max_depth, budget):
+    """Up to ``k`` loopless shortest paths (Yen), shortest first.
+
+    Returns ``(paths, timed_out)``; each path is ``(nodes, edges)``.
+    """
+    deadline = time.monotonic() + budget
+    try:
+        first = shortest_path(snap, a, b, max_depth, deadline)
+    except Timeout:
+        return [], True
+    if first is None:
+        return [], False
+    paths = [first]
+    candidates = []
+    seen = {tuple(first[0])}
+    try:
+        while len(paths) < k:
+            nodes, edges = paths[-1]
+            for j in range(len(nodes) - 1):
+                root, root_edges = nodes[:j + 1], edges[:j]
+                # don't reuse the next hop of any accepted path sharing this root
+                banned_edges = {p_edges[j] for p_nodes, p_edges in paths if p_nodes[:j + 1] == root}
+                spur = shortest_path(snap, nodes[j], b, max_depth - j, deadline, set(root[:-1]), banned_edges)
+                if spur is None:
+                    continue
+                path = (root[:-1] + spur[0], root_edges + spur[1])
+                if tuple(path[0]) not in seen:
+                    seen.add(tuple(path[0]))
+                    heapq.heappush(candidates, (len(path[1]), len(seen), path))
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[2])
+    except Timeout:
+        return paths, True
+    return paths, False
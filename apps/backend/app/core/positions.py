@@ -0,0 +1,126 @@
+"""Write-behind buffer for node positions.
+
+``PUT /graph/positions`` fires many times per second while a node is dragged.
+Instead of rewriting entity rows on every call, positions land in the
+``graph:positions`` Redis hash (entity id -> [x, y]), which coalesces to the
+latest position per entity. A periodic flusher in every worker moves the hash
+aside, writes it with one set-based ``UPDATE ... FROM (VALUES ...)`` and logs
+what it wrote as one position-only graph change; the flush lock keeps workers
+from flushing at the same time, which also keeps those log entries in order.
+
+So however fast a node is dragged, the graph version (the ``/graph`` cache
+key) moves at most once per ``POSITION_FLUSH_INTERVAL``. Reads don't wait for
+the flush: every save also bumps ``graph:positions:generation``, and ``/graph``
+lays the unflushed positions over the cached body, with the generation in its
+ETag (see ``pending_positions``). Position-only changes don't move the
+structure version, so neighbourhood cursors and analytics survive them.
+"""
+
+import asyncio
+import logging
+import os
+import orjson
+from sqlalchemy import Float, column, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from app.core.graph_changes import append_change
+from app.core.redis import get_redis
+from app.db.session import AsyncSessionLocal
+from app.models.models import Entity
+
+BUFFER_KEY = 'graph:positions'
+FLUSHING_KEY = 'graph:positions:flushing'
+LOCK_KEY = 'graph:positions:lock'
+GENERATION_KEY = 'graph:positions:generation'
+FLUSH_INTERVAL = float(os.getenv('POSITION_FLUSH_INTERVAL', '2'))
+FLUSH_BATCH = 5000
+
+logger = logging.getLogger("app.positions")
+
+
+async def buffer_positions(positions: dict[str, tuple]) -> None:
+    if not positions:
+        return
+    redis = await get_redis()
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(BUFFER_KEY, mapping={eid: orjson.dumps(xy) for eid, xy in positions.items()})
+        pipe.incr(GENERATION_KEY)
+        await pipe.execute()
+
+
+async def _read_buffer(ids: list[str] | None) -> tuple[int, dict[str, tuple]]:
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as pipe:
+        # generation first: the positions read after it are at least that new
+        pipe.get(GENERATION_KEY)
+        if ids is None:
+            pipe.hgetall(FLUSHING_KEY)
+            pipe.hgetall(BUFFER_KEY)
+        else:
+            pipe.hmget(FLUSHING_KEY, ids)
+            pipe.hmget(BUFFER_KEY, ids)
+        generation, flushing, buffered = await pipe.execute()
+    if ids is not None:
+        flushing = {eid: xy for eid, xy in zip(ids, flushing) if xy is not None}
+        buffered = {eid: xy for eid, xy in zip(ids, buffered) if xy is not None}
+    flushing.update(buffered)
+    return int(generation or 0), {eid: tuple(orjson.loads(xy)) for eid, xy in flushing.items()}
+
+
+async def buffered_positions(ids: list[str] | None = None) -> dict[str, tuple]:
+    """Positions not yet flushed (of ``ids``, or all); the live buffer wins over an in-flight flush."""
+    return (await _read_buffer(ids))[1]
+
+
+async def pending_positions() -> tuple[int, dict[str, tuple]]:
+    """``(generation, positions)`` of everything not yet flushed, for overlaying on reads."""
+    return await _read_buffer(None)
+
+
+async def _write(rows: list[tuple]) -> None:
+    async with AsyncSessionLocal() as db:
+        for start in range(0, len(rows), FLUSH_BATCH):
+            v = values(column('id', UUID(as_uuid=False)), column('x', Float), column('y', Float), name='v')
+            v = v.data(rows[start:start + FLUSH_BATCH])
+            # positions aren't edits: leave updated_at alone instead of letting onupdate bump it
+            await db.execute(
+                update(Entity)
+                .where(Entity.id == v.c.id)
+                .values(pos_x=v.c.x, pos_y=v.c.y, updated_at=Entity.updated_at),
+                execution_options={'synchronize_session': False},
+            )
+        await db.commit()
+
+
+async def flush_positions() -> int:
+    """Write buffered positions to the database; returns the number of rows written."""
+    redis = await get_redis()
+    if not await redis.set(LOCK_KEY, '1', nx=True, px=int(max(FLUSH_INTERVAL, 1) * 10_000)):
+        return 0
+    try:
+        # a leftover FLUSHING hash means a previous flush died half way; finish that first
+        if not await redis.exists(FLUSHING_KEY):
+            # only the lock holder moves the buffer, so it can't vanish in between
+            if not await redis.exists(BUFFER_KEY):
+                return 0
+            await redis.rename(BUFFER_KEY, FLUSHING_KEY)
+        pending = await redis.hgetall(FLUSHING_KEY)
+        rows = [(eid, *orjson.loads(xy)) for eid, xy in pending.items()]
+        if rows:
+            await _write(rows)
+            # a failure here leaves FLUSHING_KEY behind: the next flush writes and logs it again
+            await append_change({'nodes': [{'id': eid, 'x': x, 'y': y} for eid, x, y in rows]})
+        await redis.delete(FLUSHING_KEY)
+        return len(rows)
+    finally:
+        await redis.delete(LOCK_KEY)
+
+
+async def run_flusher() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush_positions()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("position flush failed; will retry")
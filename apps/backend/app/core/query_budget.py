@@ -0,0 +1,82 @@
+"""Per-request SQL statement accounting.
+
+``AccessLogMiddleware`` opens a ``QueryStats`` per request and the engine
+instrumentation (``timing.instrument_engine``) records every statement into
+it. When the request ends, it warns if the request ran more than
+``QUERY_BUDGET`` statements or ran the same statement shape
+``QUERY_REPEAT_LIMIT`` times or more, which is the usual sign of a query in a
+loop (N+1). Tests use ``capture_query_stats`` to assert budgets per endpoint.
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', '25'))
+QUERY_REPEAT_LIMIT = int(os.getenv('QUERY_REPEAT_LIMIT', '5'))
+
+logger = logging.getLogger("app.queries")
+
+_PARAM = re.compile(r'\$\d+|%\(\w+\)s|\?')
+_PARAM_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+
+
+def statement_shape(statement: str) -> str:
+    """``statement`` on one line with placeholders, and lists of them (expanded IN), collapsed."""
+    return _PARAM_LIST.sub('?', _PARAM.sub('?', ' '.join(statement.split())))
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, limit: int = QUERY_REPEAT_LIMIT):
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= limit]
+
+
+_stats: ContextVar[QueryStats | None] = ContextVar('query_stats', default=None)
+# lists collecting finished requests' stats, see capture_query_stats
+_sinks: list[list[QueryStats]] = []
+
+
+def start_query_stats() -> QueryStats:
+    stats = QueryStats()
+    _stats.set(stats)
+    return stats
+
+
+def record_query(statement: str, seconds: float) -> None:
+    stats = _stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+
+def finish_query_stats(stats: QueryStats, method: str, path: str) -> None:
+    for sink in _sinks:
+        sink.append(stats)
+    if stats.count > QUERY_BUDGET:
+        logger.warning("%s %s ran %d queries (budget %d), %.1fms in the database",
+                       method, path, stats.count, QUERY_BUDGET, stats.seconds * 1000)
+    for shape, n in stats.repeated():
+        logger.warning("%s %s ran the same statement %d times (N+1?): %.200s", method, path, n, shape)
+
+
+@contextmanager
+def capture_query_stats():
+    """Collect the ``QueryStats`` of every request that finishes inside the block."""
+    seen: list[QueryStats] = []
+    _sinks.append(seen)
+    try:
+        yield seen
+    finally:
+        _sinks.remove(seen)
@@ -1,15 +1,96 @@
+"""Per-client token-bucket rate limiting.
+
+Each client gets a bucket of ``RATE_LIMIT`` tokens that refills continuously
+at ``RATE_LIMIT / WINDOW_SECONDS`` tokens per second, so there is no window
+boundary to burst across. A request spends its route's cost (``ROUTE_COSTS``,
+default 1). The bucket lives in a Redis hash updated by one Lua script, so a
+check is a single atomic round trip shared by all workers.
+
+Every worker also mirrors each client's bucket locally and never lets the
+local copy hold more tokens than Redis last reported. Since Redis sees at
+least the requests this worker saw, a client the local bucket can't cover is
+over the limit for sure and is rejected without asking Redis.
+"""
+
+import math
+import os
+import time
 from fastapi import Request, HTTPException
+from .metrics import RATE_LIMITED
 from .redis import get_redis
 
 RATE_LIMIT = 120
 WINDOW_SECONDS = 60
+KEY_PREFIX = 'rl:tb:'
+# path (without the API prefix) -> tokens per request
+ROUTE_COSTS = {
+    '/healthz': 0,
+    '/metrics': 0,
+    '/graph': 5,
+    '/graph/layout': 10,
+    '/csv/export': 10,
+    '/csv/import': 30,
+    '/edges/bulk': 10,
+    '/batch': 10,
+}
+LOCAL_MAX_CLIENTS = 10_000
+
+# Returns {allowed, tokens left, seconds until the request would fit}; numbers
+# go back as strings since Redis truncates Lua floats to integers.
+_TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed, wait = 0, (cost - tokens) / rate
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed, wait = 1, 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens), tostring(wait)}
+"""
+
+# client -> (tokens, monotonic time) as of the last check in this worker
+_local: dict[str, tuple[float, float]] = {}
+
+
+def route_cost(path: str) -> int:
+    prefix = os.getenv('API_PREFIX', '/api').rstrip('/')
+    if prefix and path.startswith(prefix + '/'):
+        path = path[len(prefix):]
+    return ROUTE_COSTS.get(path.rstrip('/') or '/', 1)
+
+
+def _too_many(wait: float):
+    return HTTPException(status_code=429, detail="Rate limit exceeded",
+                         headers={'Retry-After': str(max(1, math.ceil(wait)))})
+
 
 async def rate_limit(request: Request):
-    redis = await get_redis()
+    cost = route_cost(request.url.path)
+    if cost <= 0:
+        return
     ip = request.client.host if request.client else 'unknown'
-    key = f"rl:{ip}"
-    cnt = await redis.incr(key)
-    if cnt == 1:
-        await redis.expire(key, WINDOW_SECONDS)
-    if cnt > RATE_LIMIT:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+    rate = RATE_LIMIT / WINDOW_SECONDS
+    now = time.monotonic()
+    tokens, ts = _local.get(ip, (RATE_LIMIT, now))
+    tokens = min(RATE_LIMIT, tokens + (now - ts) * rate)
+    if tokens < cost:
+        _local[ip] = (tokens, now)
+        RATE_LIMITED.labels('local').inc()
+        raise _too_many((cost - tokens) / rate)
+    redis = await get_redis()
+    allowed, remote, wait = await redis.eval(_TAKE, 1, KEY_PREFIX + ip, RATE_LIMIT, rate, cost)
+    if len(_local) >= LOCAL_MAX_CLIENTS and ip not in _local:
+        _local.clear()  # crude, but it only costs the pre-check a few Redis round trips
+    _local[ip] = (min(tokens - cost if allowed else tokens, float(remote)), now)
+    if not allowed:
+        RATE_LIMITED.labels('redis').inc()
+        raise _too_many(float(wait))
@@ -2,16 +2,28 @@ import os
 import redis.asyncio as redis
 
 _redis_client = None
+_raw_redis_client = None
+
+def _redis_url():
+    return os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 
 async def get_redis():
     global _redis_client
     if _redis_client is None:
-        url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-        _redis_client = redis.from_url(url, encoding='utf-8', decode_responses=True)
+        _redis_client = redis.from_url(_redis_url(), encoding='utf-8', decode_responses=True)
     return _redis_client
 
+async def get_raw_redis():
+    # bytes in, bytes out: for values that are already serialized response bodies
+    global _raw_redis_client
+    if _raw_redis_client is None:
+        _raw_redis_client = redis.from_url(_redis_url())
+    return _raw_redis_client
+
 async def close_redis():
-    global _redis_client
-    if _redis_client:
-        await _redis_client.aclose()
-        _redis_client = None
+    global _redis_client, _raw_redis_client
+    # forget the clients first so a failed close never leaves a dead one behind
+    clients = [c for c in (_redis_client, _raw_redis_client) if c]
+    _redis_client = _raw_redis_client = None
+    for client in clients:
+        await client.aclose()
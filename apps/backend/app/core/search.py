@@ -0,0 +1,77 @@
+"""People search.
+
+Substring search matches name, email, phone and notes with ``ILIKE``, which
+the pg_trgm GIN indexes from migration 00697269940c serve, and ranks hits by
+trigram similarity. Databases without pg_trgm (the extension needs privileges
+some hosts don't grant) still get the same matches, ordered by name.
+
+Typeahead suggestions are name-prefix matches on ``lower(name) COLLATE "C"``,
+whose btree index serves both the prefix range and the order. Answers are
+cached in Redis for ``SUGGEST_TTL`` seconds, so hot prefixes (the first
+keystrokes everyone types) rarely reach the database.
+"""
+
+import logging
+import orjson
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.redis import get_raw_redis
+from app.core.timing import timed
+from app.models.models import Entity
+
+SEARCH_COLUMNS = (Entity.name, Entity.contact_email, Entity.contact_phone, Entity.notes)
+SUGGEST_TTL = 30
+SUGGEST_PREFIX = 'entities:suggest:'
+
+logger = logging.getLogger("app.search")
+
+_trgm: bool | None = None
+
+
+def _like_escape(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+async def has_trgm(db: AsyncSession) -> bool:
+    global _trgm
+    if _trgm is None:
+        _trgm = bool(await db.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")))
+        if not _trgm:
+            logger.warning("pg_trgm is not installed; search results won't be ranked by similarity")
+    return _trgm
+
+
+def matches(term: str):
+    pattern = f"%{_like_escape(term)}%"
+    return or_(*(col.ilike(pattern, escape='\\') for col in SEARCH_COLUMNS))
+
+
+def similarity(term: str):
+    """Best trigram similarity of ``term`` over the searched columns (GREATEST skips NULLs)."""
+    return func.greatest(*(func.similarity(col, term) for col in SEARCH_COLUMNS))
+
+
+def _name_key():
+    return func.lower(Entity.name).collate('C')
+
+
+async def suggest(db: AsyncSession, prefix: str, limit: int) -> bytes:
+    """JSON body listing up to ``limit`` people whose name starts with ``prefix``."""
+    prefix = prefix.lower()
+    key = f'{SUGGEST_PREFIX}{limit}:{prefix}'
+    redis = await get_raw_redis()
+    with timed('cache'):
+        body = await redis.get(key)
+    if body is not None:
+        return body
+    key_col = _name_key()
+    rows = (await db.execute(
+        select(Entity.id, Entity.name)
+        .where(key_col.like(f"{_like_escape(prefix)}%", escape='\\'))
+        .order_by(key_col, Entity.id)
+        .limit(limit)
+    )).all()
+    body = orjson.dumps([{'id': str(eid), 'name': name} for eid, name in rows])
+    with timed('cache'):
+        await redis.set(key, body, ex=SUGGEST_TTL)
+    return body
@@ -0,0 +1,93 @@
+"""Buffered telemetry ingestion.
+
+Accepted events go onto a bounded per-worker ``asyncio.Queue``; a background
+flusher drains it in batches of up to ``FLUSH_BATCH`` and appends each batch
+to the ``telemetry:events`` Redis stream in one pipelined round trip. When
+the queue can't take a whole request's events, the request is refused (429)
+instead of letting memory grow, and every event's fate is counted in
+``telemetry_events_total``.
+"""
+
+import asyncio
+import logging
+import os
+import orjson
+from app.core.metrics import TELEMETRY_EVENTS as EVENTS
+from app.core.redis import get_raw_redis
+
+QUEUE_SIZE = int(os.getenv('TELEMETRY_QUEUE_SIZE', '10000'))
+FLUSH_BATCH = 500
+FLUSH_INTERVAL = 1.0
+STREAM_KEY = 'telemetry:events'
+STREAM_MAXLEN = 100_000
+MAX_TYPE_LENGTH = 64
+
+logger = logging.getLogger("telemetry")
+
+_queue: asyncio.Queue | None = None
+
+
+def valid(event) -> bool:
+    if not isinstance(event, dict):
+        return False
+    kind = event.get('type')
+    ts = event.get('ts', 0)
+    return (isinstance(kind, str) and 0 < len(kind) <= MAX_TYPE_LENGTH
+            and isinstance(ts, (int, float)) and not isinstance(ts, bool))
+
+
+def offer(events: list[dict]) -> bool:
+    """Queue all of ``events`` or none of them; False means the queue is full."""
+    if _queue is None or _queue.maxsize - _queue.qsize() < len(events):
+        EVENTS.labels('rejected').inc(len(events))
+        return False
+    for event in events:
+        _queue.put_nowait(event)
+    EVENTS.labels('accepted').inc(len(events))
+    return True
+
+
+async def _write(batch: list[dict]) -> None:
+    try:
+        redis = await get_raw_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for event in batch:
+                pipe.xadd(STREAM_KEY, {'event': orjson.dumps(event)}, maxlen=STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+        EVENTS.labels('written').inc(len(batch))
+    except Exception:
+        EVENTS.labels('dropped').inc(len(batch))
+        logger.exception("dropped %d telemetry events", len(batch))
+
+
+def _drain(queue: asyncio.Queue, batch: list) -> list:
+    while len(batch) < FLUSH_BATCH and not queue.empty():
+        batch.append(queue.get_nowait())
+    return batch
+
+
+async def _run(queue: asyncio.Queue) -> None:
+    while True:
+        batch = [await queue.get()]
+        if queue.qsize() < FLUSH_BATCH - 1:
+            await asyncio.sleep(FLUSH_INTERVAL)  # let a batch build up
+        await _write(_drain(queue, batch))
+
+
+def start() -> asyncio.Task:
+    global _queue
+    _queue = asyncio.Queue(QUEUE_SIZE)
+    return asyncio.create_task(_run(_queue))
+
+
+async def stop(task: asyncio.Task) -> None:
+    """Stop the flusher and write whatever is still queued."""
+    global _queue
+    queue, _queue = _queue, None
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    while queue is not None and not queue.empty():
+        await _write(_drain(queue, []))
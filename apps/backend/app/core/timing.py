@@ -0,0 +1,59 @@
+"""Per-request timing breakdown, reported in the ``Server-Timing`` header.
+
+``AccessLogMiddleware`` starts a collector per request; code on the request
+path adds to it with ``timed(metric)``. Database time is collected by
+``instrument_engine`` from SQLAlchemy cursor events, which also feed the
+query budget (``app.core.query_budget``). Outside a request (the
+position flusher, scripts) timing is a no-op.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.core.query_budget import record_query
+
+_timings: ContextVar[dict | None] = ContextVar('server_timings', default=None)
+
+
+def start_timings() -> dict:
+    timings = {}
+    _timings.set(timings)
+    return timings
+
+
+def add_timing(metric: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings[metric] = timings.get(metric, 0.0) + seconds
+
+
+@contextmanager
+def timed(metric: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(metric, time.perf_counter() - start)
+
+
+def server_timing(timings: dict, total: float) -> bytes:
+    parts = [f'{metric};dur={seconds * 1000:.1f}' for metric, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts).encode('latin-1')
+
+
+def instrument_engine(engine) -> None:
+    """Count time spent in ``engine``'s cursor executions as ``db``, and each
+    statement against the request's query budget."""
+    sync_engine = getattr(engine, 'sync_engine', engine)
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        add_timing('db', elapsed)
+        record_query(statement, elapsed)
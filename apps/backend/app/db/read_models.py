@@ -0,0 +1,61 @@
+"""Read models for the hot read paths.
+
+The ORM models eager-load relationships (``Entity.main_group`` joined,
+``Entity.groups`` via a second SELECT, ``Group.parent`` joined) and register
+every object in the session's identity map. Read endpoints that only emit a
+few columns don't need any of that, so they select exactly those columns with
+Core ``select()`` and get plain ``Row`` tuples back (named, immutable, no
+per-object state). ``scripts/bench_read_models.py`` measures the difference.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import Entity, EntityGroup, Edge, Group
+
+# output field -> column for GET /entities
+ENTITY_FIELDS = {
+    'id': Entity.id,
+    'name': Entity.name,
+    'contact_email': Entity.contact_email,
+    'contact_phone': Entity.contact_phone,
+    'notes': Entity.notes,
+    'mainGroupId': Entity.main_group_id,
+    'isCurrentUser': Entity.is_current_user,
+    'x': Entity.pos_x,
+    'y': Entity.pos_y,
+}
+
+# GET /groups
+GROUP_FIELDS = {
+    'id': Group.id,
+    'name': Group.name,
+    'description': Group.description,
+    'color_hex': Group.color_hex,
+    'parent_group_id': Group.parent_group_id,
+}
+
+# graph snapshot rows, in the shapes GraphSnapshot.from_rows takes
+GRAPH_ENTITIES = select(
+    Entity.id, Entity.name, Entity.contact_email, Entity.contact_phone, Entity.notes,
+    Entity.main_group_id, Entity.is_current_user, Entity.pos_x, Entity.pos_y,
+)
+GRAPH_GROUPS = select(Group.id, Group.name, Group.color_hex, Group.parent_group_id)
+GRAPH_MEMBERSHIPS = select(EntityGroup.entity_id, EntityGroup.group_id)
+GRAPH_EDGES = select(Edge.id, Edge.a_entity_id, Edge.b_entity_id, Edge.label)
+
+
+def entity_rows(names: list[str]):
+    """``(name, id, *fields)`` rows for GET /entities; name and id lead for the keyset."""
+    return select(Entity.name, Entity.id, *(ENTITY_FIELDS[f] for f in names))
+
+
+async def group_rows(db: AsyncSession):
+    return (await db.execute(select(*GROUP_FIELDS.values()))).all()
+
+
+async def graph_rows(db: AsyncSession):
+    """``(entities, groups, memberships, edges)`` row lists for a graph snapshot."""
+    return [
+        (await db.execute(stmt)).all()
+        for stmt in (GRAPH_ENTITIES, GRAPH_GROUPS, GRAPH_MEMBERSHIPS, GRAPH_EDGES)
+    ]
@@ -1,7 +1,11 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from dotenv import load_dotenv
+from app.core.metrics import POOL_CHECKOUT_WAIT
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,5 +14,42 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Sync engine: migrations, scripts and test fixtures
 ENGINE = create_engine(DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=ENGINE, autoflush=False, autocommit=False)
+
+# Async engine (asyncpg) used by the API so queries never block the event loop
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))  # 0 = server default
+
+def async_database_url(url: str):
+    return make_url(url).set(drivername='postgresql+asyncpg')
+
+class _TimedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waits for a connection."""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+_server_settings = {'statement_timeout': str(DB_STATEMENT_TIMEOUT_MS)} if DB_STATEMENT_TIMEOUT_MS else {}
+ASYNC_ENGINE = create_async_engine(
+    async_database_url(DATABASE_URL),
+    pool_pre_ping=True,
+    poolclass=_TimedPool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    connect_args={'server_settings': _server_settings},
+)
+# expire_on_commit=False: handlers read attributes after commit, and a lazy
+# refresh there would need implicit IO, which AsyncSession doesn't allow
+AsyncSessionLocal = async_sessionmaker(bind=ASYNC_ENGINE, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
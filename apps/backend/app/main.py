@@ -1,6 +1,7 @@
+import asyncio
 import os
-from fastapi import FastAPI, Request
-import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 import logging
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.entities import router as entities_router
@@ -9,11 +10,47 @@ from app.api.edges import router as edges_router
 from app.api.graph import router as graph_router
 from app.api.csv_io import router as csv_router
 from app.api.telemetry import router as telemetry_router
-from app.core.rate_limit import rate_limit
+from app.api.batch import router as batch_router
+from app.core import analytics, layout, telemetry
+from app.core.metrics import mark_worker_dead, render as render_metrics
+from app.core.middleware import AccessLogMiddleware, RateLimitMiddleware
+from app.core.graph_snapshot import run_verifier
+from app.core.positions import flush_positions, run_flusher
+from app.core.redis import close_redis
+from app.core.timing import instrument_engine
+from app.db.session import ASYNC_ENGINE
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	flusher = asyncio.create_task(run_flusher())
+	verifier = asyncio.create_task(run_verifier())
+	telemetry_flusher = telemetry.start()
+	yield
+	for task in (flusher, verifier):
+		task.cancel()
+		try:
+			await task
+		except asyncio.CancelledError:
+			pass
+	try:
+		await layout.cancel_jobs()
+		await telemetry.stop(telemetry_flusher)
+		# don't leave buffered positions behind on shutdown
+		await flush_positions()
+	finally:
+		# connections are bound to this event loop; release them with it
+		await close_redis()
+		await ASYNC_ENGINE.dispose()
+		analytics.shutdown()
+		mark_worker_dead()
+
+app = FastAPI(lifespan=lifespan)
+instrument_engine(ASYNC_ENGINE)
 origins = os.getenv('CORS_ORIGINS','').split(',') if os.getenv('CORS_ORIGINS') else ['http://localhost:3000']
-app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=['*'], allow_headers=['*'])
+app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=['*'], allow_headers=['*'], expose_headers=['X-Next-Cursor', 'Server-Timing'])
+# added last = runs first: the access log times everything, rate limiting included
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(AccessLogMiddleware)
 API_PREFIX = os.getenv('API_PREFIX', '/api').rstrip('/')
 
 # Mount routers under a consistent API prefix
@@ -23,8 +60,7 @@ app.include_router(edges_router, prefix=API_PREFIX)
 app.include_router(graph_router, prefix=API_PREFIX)
 app.include_router(csv_router, prefix=API_PREFIX)
 app.include_router(telemetry_router, prefix=API_PREFIX)
-
-logger = logging.getLogger("app.access")
+app.include_router(batch_router, prefix=API_PREFIX)
 
 # Ensure simple format avoiding uvicorn's specialized access log parser
 if not logging.getLogger().handlers:
@@ -34,21 +70,7 @@ if not logging.getLogger().handlers:
 async def healthz():
 	return {'status':'ok'}
 
-@app.middleware("http")
-async def _middleware_chain(request: Request, call_next):
-	start = time.time()
-	# rate limit (skip if disabled)
-	if os.getenv('DISABLE_RATE_LIMIT') != '1' and not request.url.path.startswith(('/docs','/openapi')):
-		try:
-			await rate_limit(request)
-		except Exception as e:  # propagate HTTPException
-			from fastapi.responses import JSONResponse
-			if hasattr(e, 'status_code'):
-				duration = (time.time()-start)*1000
-				logger.info(f"{request.method} {request.url.path} -> {getattr(e,'status_code',0)} {duration:.1f}ms")
-				return JSONResponse(status_code=e.status_code, content={'detail': getattr(e, 'detail', 'error')})
-			raise
-	response = await call_next(request)
-	duration = (time.time()-start)*1000
-	logger.info("%s %s -> %s %.1fms", request.method, request.url.path, response.status_code, duration)
-	return response
+@app.get('/metrics')
+async def metrics():
+	body, content_type = render_metrics()
+	return Response(content=body, media_type=content_type)
@@ -7,13 +7,16 @@ via an expression index created in Alembic migration.
 
 import uuid
 from sqlalchemy import (
-    Column, String, Text, Boolean, Float, ForeignKey, UniqueConstraint, DateTime
+    Column, String, Text, Boolean, Float, Integer, ForeignKey, UniqueConstraint, DateTime, Index, Sequence
 )
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
 
+# commit stamps for the graph change log (graph_snapshot.commit_ordered)
+GRAPH_CHANGE_SEQ = Sequence("graph_change_seq", metadata=Base.metadata)
+
 
 class Group(Base):
     __tablename__ = "groups"
@@ -28,6 +31,17 @@ class Group(Base):
     parent = relationship("Group", remote_side=[id], backref="children", lazy="joined")
 
 
+class GroupClosure(Base):
+    """Transitive closure of the group tree (see ``app.core.group_tree``)."""
+    __tablename__ = "group_closure"
+    ancestor_id = Column(UUID(as_uuid=True), ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(UUID(as_uuid=True), ForeignKey("groups.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index("ix_group_closure_descendant", "descendant_id", "ancestor_id"),
+    )
+
+
 class Entity(Base):  # People
     __tablename__ = "entities"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -50,6 +64,12 @@ class Entity(Base):  # People
     lazy="selectin",
     passive_deletes=True,  # rely on DB-level ON DELETE CASCADE for association cleanup
     )
+    __table_args__ = (
+        Index("ix_entities_name_id", "name", "id"),  # keyset pagination order of GET /entities
+        Index("ix_entities_name_prefix", func.lower(name).collate("C")),  # /entities/suggest
+        Index("ix_entities_main_group_id", "main_group_id"),  # SET NULL / reassignment on group delete
+        # pg_trgm GIN indexes for search live in Alembic (they need the extension)
+    )
 
 
 class EntityGroup(Base):
@@ -59,6 +79,7 @@ class EntityGroup(Base):
     joined_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     __table_args__ = (
         UniqueConstraint("entity_id", "group_id", name="uq_entity_group"),
+        Index("ix_entity_groups_group_id", "group_id", "entity_id"),  # members of a group
     )
 
 
@@ -70,9 +91,15 @@ class Edge(Base):
     b_entity_id = Column(UUID(as_uuid=True), ForeignKey("entities.id", ondelete="CASCADE"), nullable=False)
     label = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    # Canonical uniqueness (LEAST/GREATEST) enforced via Alembic raw SQL index.
     __table_args__ = (
         UniqueConstraint("a_entity_id", "b_entity_id", name="uq_edge_pair"),  # app-level fast-path; DB index adds canonical
+        # undirected uniqueness: (b, a) counts as (a, b); the ON CONFLICT target of POST /edges/bulk
+        Index(
+            "uq_graph_edges_canonical",
+            func.least(a_entity_id, b_entity_id), func.greatest(a_entity_id, b_entity_id),
+            unique=True,
+        ),
+        Index("ix_graph_edges_b_entity_id", "b_entity_id"),  # ON DELETE CASCADE from entities (a side is uq_edge_pair)
     )
 
     a = relationship("Entity", foreign_keys=[a_entity_id])
@@ -0,0 +1,70 @@
+"""Concurrent-request throughput benchmark
+
+Fires a mix of DB-bound requests and /healthz probes at a running backend with
+a fixed number of in-flight requests, then reports throughput and latency per
+path. A blocking DB call stalls every request on the worker, so compare the
+/healthz latencies between runs.
+Usage (server running, venv activated):
+    python scripts/bench_concurrency.py --base-url http://localhost:8000/api --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+DEFAULT_PATHS = ['/entities', '/groups', '/healthz']
+
+
+def _pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(base_url: str, health_url: str, paths: list[str], concurrency: int, total: int):
+    latencies = {p: [] for p in paths}
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        while not queue.empty():
+            path = queue.get_nowait()
+            url = health_url if path == '/healthz' else base_url + path
+            start = time.perf_counter()
+            try:
+                r = await client.get(url)
+                if r.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies[path].append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    print(f"{total} requests, concurrency {concurrency}: {total / elapsed:.1f} req/s, {errors} errors")
+    for path, values in latencies.items():
+        if values:
+            print(f"  {path:<28} p50 {statistics.median(values):7.1f}ms  p99 {_pct(values, 0.99):7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://localhost:8000/api')
+    parser.add_argument('--health-url', default=None, help='defaults to <server root>/healthz')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--path', action='append', dest='paths', help='repeatable; defaults to a read mix plus /healthz')
+    args = parser.parse_args()
+    health_url = args.health_url or httpx.URL(args.base_url).copy_with(path='/healthz', query=None)
+    asyncio.run(run(args.base_url.rstrip('/'), str(health_url), args.paths or DEFAULT_PATHS, args.concurrency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
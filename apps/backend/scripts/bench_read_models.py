@@ -0,0 +1,97 @@
+"""Read-model benchmark: ORM hydration vs column rows
+
+Seeds N people (plus groups and memberships) inside a transaction that is
+rolled back at the end, so it is safe to point at a dev database, then loads
+them three ways and reports wall time and peak Python allocations:
+
+* orm      - ``select(Entity)`` objects, with the model's eager loads
+              (``main_group`` joined, ``groups`` selectin) and identity map
+* rows     - the GET /entities read model (``app.db.read_models.entity_rows``)
+* snapshot - the graph snapshot read model (``app.db.read_models.graph_rows``)
+
+Usage (venv activated, DATABASE_URL set):
+    python scripts/bench_read_models.py --rows 100000
+"""
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import ASYNC_ENGINE
+from app.db.read_models import ENTITY_FIELDS, entity_rows, graph_rows
+from app.models.models import Entity
+
+SEED = [
+    "INSERT INTO groups (id, name) SELECT gen_random_uuid(), 'bench group ' || g FROM generate_series(1, :groups) g",
+    """INSERT INTO entities (id, name, contact_email, notes, main_group_id)
+       SELECT gen_random_uuid(), 'bench person ' || i, 'bench' || i || '@example.com', 'notes ' || i,
+              (SELECT id FROM groups ORDER BY id OFFSET i % :groups LIMIT 1)
+       FROM generate_series(1, :rows) i""",
+    "INSERT INTO entity_groups (entity_id, group_id) SELECT id, main_group_id FROM entities WHERE main_group_id IS NOT NULL ON CONFLICT DO NOTHING",
+]
+
+
+async def _orm(db: AsyncSession):
+    return (await db.scalars(select(Entity))).all()
+
+
+async def _rows(db: AsyncSession):
+    return (await db.execute(entity_rows(list(ENTITY_FIELDS)))).all()
+
+
+async def _snapshot(db: AsyncSession):
+    return await graph_rows(db)
+
+
+async def _measure(db: AsyncSession, load, repeat: int):
+    best = float('inf')
+    for _ in range(repeat):
+        db.expunge_all()
+        gc.collect()
+        start = time.perf_counter()
+        await load(db)
+        best = min(best, time.perf_counter() - start)
+    db.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    result = await load(db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+async def run(rows: int, groups: int, repeat: int):
+    async with ASYNC_ENGINE.connect() as conn:
+        trans = await conn.begin()
+        try:
+            for stmt in SEED:
+                await conn.execute(text(stmt), {'rows': rows, 'groups': groups})
+            await conn.execute(text('ANALYZE groups, entities, entity_groups'))
+            db = AsyncSession(bind=conn, expire_on_commit=False)
+            total = (await conn.execute(text('SELECT count(*) FROM entities'))).scalar()
+            print(f"{total} entities (best of {repeat}; peak = Python allocations while loading)")
+            baseline = None
+            for name, load in [('orm', _orm), ('rows', _rows), ('snapshot', _snapshot)]:
+                seconds, peak = await _measure(db, load, repeat)
+                baseline = baseline or (seconds, peak)
+                print(f"  {name:<9} {seconds * 1000:8.1f}ms  {peak / 2**20:7.1f} MiB"
+                      f"  ({baseline[0] / seconds:4.1f}x time, {baseline[1] / peak:4.1f}x memory vs orm)")
+        finally:
+            await trans.rollback()
+    await ASYNC_ENGINE.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.groups, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
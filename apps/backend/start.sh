@@ -78,5 +78,11 @@ wait_for_redis
 # Run migrations with retry (handles race with other containers)
 retry 5 3 alembic upgrade head
 
+# Per-worker metric files for /metrics; stale files from a previous run would skew the totals
+: "${PROMETHEUS_MULTIPROC_DIR:=/tmp/prometheus-multiproc}"
+export PROMETHEUS_MULTIPROC_DIR
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 # Launch app
 exec uvicorn app.main:app --host "$UVICORN_HOST" --port "$UVICORN_PORT" --workers "$UVICORN_WORKERS" --log-level "$UVICORN_LOG_LEVEL" --proxy-headers
@@ -4,6 +4,9 @@ from sqlalchemy import text, inspect
 from app.models.base import Base
 from app.main import app
 from app.core.redis import close_redis
+from contextlib import contextmanager
+from app.core import graph_snapshot
+from app.core.query_budget import capture_query_stats
 from app.db.session import ENGINE
 
 def _ensure_schema():
@@ -12,7 +15,7 @@ def _ensure_schema():
     if not insp.has_table('entities') or not insp.has_table('groups'):
         Base.metadata.create_all(bind=ENGINE)
 
-TABLES = ['entity_groups','graph_edges','entities','groups']
+TABLES = ['group_closure','entity_groups','graph_edges','entities','groups']
 
 def _drop_and_create():
     # drop existing tables (ignore missing) then create fresh schema
@@ -34,6 +37,8 @@ def _prepare_schema():
 @pytest.fixture(autouse=True)
 def _clear_db():
     _truncate()
+    # tables were emptied behind the app's back; force a snapshot reload
+    graph_snapshot._snapshot = None
     yield
     _truncate()
 
@@ -52,3 +57,15 @@ def client(monkeypatch):
         new_loop = asyncio.new_event_loop()
         new_loop.run_until_complete(close_redis())
         new_loop.close()
+
+@pytest.fixture()
+def max_queries():
+    """``with max_queries(n): client...`` fails if the requests in the block run more than n SQL statements."""
+    @contextmanager
+    def check(limit):
+        with capture_query_stats() as seen:
+            yield seen
+        total = sum(stats.count for stats in seen)
+        shapes = [shape for stats in seen for shape in stats.shapes]
+        assert total <= limit, f"{total} queries (max {limit}):\n" + "\n".join(shapes)
+    return check
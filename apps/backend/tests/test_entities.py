@@ -1,3 +1,6 @@
+import os
+import redis
+
 def test_entity_create_membership_and_main_group(client):
     # create group
     g = client.post('/groups/', json={'name':'G1'}).json()
@@ -60,3 +63,132 @@ def test_rate_limit_enforced(client, monkeypatch):
             break
         hit += 1
     assert limited
+
+def test_list_entities_keyset_pages_and_fields(client):
+    for name in ['Cy', 'Al', 'Bo', 'Al']:
+        client.post('/entities/', json={'name': name, 'groups_in': [], 'connected_people': []})
+    seen, cursor = [], None
+    while True:
+        r = client.get('/entities', params={'limit': 3, 'fields': 'name', **({'cursor': cursor} if cursor else {})})
+        seen += r.json()
+        cursor = r.headers.get('x-next-cursor')
+        if not cursor:
+            break
+    assert seen == [{'name': 'Al'}, {'name': 'Al'}, {'name': 'Bo'}, {'name': 'Cy'}]
+    # without limit or cursor it's everything, unpaged
+    r = client.get('/entities', params={'fields': 'name'})
+    assert r.json() == seen and 'x-next-cursor' not in r.headers
+    assert client.get('/entities', params={'fields': 'name,bogus'}).status_code == 400
+    assert client.get('/entities', params={'cursor': 'nope'}).status_code == 400
+
+def test_search_and_suggest(client):
+    client.post('/entities/', json={'name': 'Alice Smith', 'contact_email': 'alice@example.com', 'groups_in': [], 'connected_people': []})
+    client.post('/entities/', json={'name': 'Bob', 'notes': 'met at 100%_club', 'groups_in': [], 'connected_people': []})
+    client.post('/entities/', json={'name': 'alfred', 'groups_in': [], 'connected_people': []})
+    assert [e['name'] for e in client.get('/entities', params={'search': 'EXAMPLE.com'}).json()] == ['Alice Smith']
+    assert [e['name'] for e in client.get('/entities', params={'search': '100%_'}).json()] == ['Bob']
+    assert client.get('/entities', params={'search': '0%x'}).json() == []
+    assert len(client.get('/entities', params={'search': 'al', 'limit': 1}).json()) == 1
+    assert client.get('/entities', params={'search': 'al', 'cursor': 'x'}).status_code == 400
+    names = [s['name'] for s in client.get('/entities/suggest', params={'q': 'AL'}).json()]
+    assert names == ['alfred', 'Alice Smith']
+    assert [s['name'] for s in client.get('/entities/suggest', params={'q': 'al', 'limit': 1}).json()] == ['alfred']
+
+def test_rate_limit_route_costs(client, monkeypatch):
+    monkeypatch.setenv('DISABLE_RATE_LIMIT','0')
+    from app.core import rate_limit
+    redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0')).delete(rate_limit.KEY_PREFIX + 'testclient')
+    rate_limit._local.clear()
+    graph_calls = 0
+    while (r := client.get('/graph')).status_code != 429:
+        graph_calls += 1
+    assert graph_calls <= rate_limit.RATE_LIMIT // rate_limit.ROUTE_COSTS['/graph']
+    assert int(r.headers['retry-after']) >= 1
+    assert client.get('/healthz').status_code == 200  # free
+
+def test_group_tree_recursive_members_and_cycles(client):
+    root = client.post('/groups/', json={'name':'Root'}).json()['id']
+    mid = client.post('/groups/', json={'name':'Mid', 'parent_group_id': root}).json()['id']
+    leaf = client.post('/groups/', json={'name':'Leaf', 'parent_group_id': mid}).json()['id']
+    other = client.post('/groups/', json={'name':'Other'}).json()['id']
+    for name, groups in [('A', [root]), ('B', [mid]), ('C', [leaf, mid]), ('D', [other])]:
+        client.post('/entities/', json={'name':name, 'groups_in':groups, 'connected_people':[]})
+    def members(gid, **params):
+        return [m['name'] for m in client.get(f'/groups/{gid}/members', params={'fields': 'name', **params}).json()]
+    assert members(root) == ['A']
+    assert members(root, recursive='true') == ['A', 'B', 'C']
+    assert members(mid, recursive='true', limit=1) == ['B']
+    # no cycles: a group can't move under itself or its own subtree
+    assert client.patch(f'/groups/{root}', json={'parent_group_id': leaf}).status_code == 400
+    assert client.patch(f'/groups/{mid}', json={'parent_group_id': mid}).status_code == 400
+    # moving a subtree moves its members with it
+    assert client.patch(f'/groups/{mid}', json={'parent_group_id': other}).status_code == 200
+    assert members(root, recursive='true') == ['A']
+    assert members(other, recursive='true') == ['B', 'C', 'D']
+    # deleting a group makes its children roots
+    client.delete(f'/groups/{mid}')
+    assert members(other, recursive='true') == ['D']
+    assert members(leaf, recursive='true') == ['C']
+    assert client.get(f'/groups/{mid}/members').status_code == 404
+
+def test_bulk_edges(client, max_queries):
+    ids = [client.post('/entities/', json={'name':n, 'groups_in':[], 'connected_people':[]}).json()['id'] for n in 'ABCD']
+    a, b, c, d = ids
+    client.post('/edges', json={'a_id': a, 'b_id': b})
+    pairs = [{'a_id': b, 'b_id': a}, {'a_id': c, 'b_id': a, 'label': 'x'}, {'a_id': a, 'b_id': c}, {'a_id': c, 'b_id': d}]
+    with max_queries(3):
+        r = client.post('/edges/bulk', json=pairs).json()
+    assert r['skipped'] == 1 and sorted(link['label'] or '' for link in r['created']) == ['', 'x']
+    assert len(client.get('/graph').json()['links']) == 3
+    assert client.post('/edges/bulk', json=[{'a_id': a, 'b_id': a}]).status_code == 400
+    assert client.post('/edges/bulk', json=[{'a_id': a, 'b_id': '00000000-0000-0000-0000-000000000000'}]).status_code == 400
+    assert client.request('DELETE', '/edges/bulk', json=[{'a_id': d, 'b_id': c}, {'a_id': b, 'b_id': d}]).json() == {'deleted': 1}
+    assert len(client.get('/graph').json()['links']) == 2
+
+
+def test_bulk_deletes_reassign_main_group(client, max_queries):
+    g1, g2, g3 = (client.post('/groups/', json={'name': n}).json()['id'] for n in ('G1', 'G2', 'G3'))
+    people = [client.post('/entities/', json={'name': f'P{i}', 'groups_in': [g1], 'connected_people': []}).json()['id'] for i in range(8)]
+    # later joins get later joined_at
+    for groups in ([g1, g3], [g1, g3, g2]):
+        for p in people:
+            client.patch(f'/entities/{p}', json={'groups_in': groups})
+    solo = client.post('/entities/', json={'name': 'solo', 'groups_in': [g1], 'connected_people': people[:2]}).json()['id']
+
+    def main_groups():
+        return {n['id']: n['mainGroupId'] for n in client.get('/graph').json()['nodes']}
+
+    # statement count doesn't grow with the number of members
+    with max_queries(6):
+        assert client.delete(f'/groups/{g1}').json() == {'deleted': True}
+    main = main_groups()
+    assert {main[p] for p in people} == {g3} and main[solo] is None  # next-earliest membership, or none
+    assert client.delete(f'/groups/{g1}').status_code == 404
+
+    with max_queries(6):
+        assert client.request('DELETE', '/groups/bulk', json=[g2, g3, g1]).json() == {'deleted': 2}
+    assert client.get('/groups/').json() == []
+    assert set(main_groups().values()) == {None}
+
+    with max_queries(3):
+        assert client.request('DELETE', '/entities/bulk', json=[solo, *people[:4]]).json() == {'deleted': 5}
+    graph = client.get('/graph').json()
+    assert len(graph['nodes']) == 4 and graph['links'] == []
+    assert client.delete(f'/entities/{solo}').status_code == 404
+
+
+def test_entity_fan_out_is_set_based(client, max_queries):
+    g1, g2 = (client.post('/groups/', json={'name': n}).json()['id'] for n in ('G1', 'G2'))
+    rows = client.post('/batch', json=[{'type': 'entity', 'op': 'create', 'data': {'name': f'N{i}'}} for i in range(60)]).json()
+    others = [r['id'] for r in rows['results']]
+    with max_queries(6):
+        hub = client.post('/entities/', json={'name': 'hub', 'groups_in': [g1, g2], 'connected_people': others[:40]}).json()['id']
+    assert len(client.get('/graph').json()['links']) == 40
+    # swap half the neighbours, drop the main group: same statement count
+    with max_queries(12):
+        r = client.patch(f'/entities/{hub}', json={'groups_in': [g2], 'connected_people': [hub, *others[20:]]})
+    assert r.json()['main_group_id'] == g2
+    graph = client.get('/graph').json()
+    assert {link['source'] if link['target'] == hub else link['target'] for link in graph['links']} == set(others[20:])
+    assert next(n for n in graph['nodes'] if n['id'] == hub)['mainGroupId'] == g2
+    assert client.patch(f'/entities/{hub}', json={'groups_in': ['00000000-0000-0000-0000-000000000000']}).status_code == 400
@@ -1,5 +1,16 @@
+import asyncio
 import io
+import os
+import time
+import uuid
 import zipfile
+import redis
+from sqlalchemy import text
+from app.api import csv_io
+from app.core import analytics, graph_snapshot, telemetry
+from app.core.graph_cache import LOCK_KEY
+from app.core.positions import flush_positions
+from app.db.session import ENGINE
 
 def _mk_basic(client):
     g = client.post('/groups/', json={'name':'G'}).json()
@@ -22,11 +33,50 @@ def test_positions_persist(client):
     node_a = next(n for n in graph['nodes'] if n['id']==a['id'])
     assert node_a['x'] == 10 and node_a['y'] == 20
 
+def test_position_saves_leave_the_structure_alone(client):
+    g,a,b = _mk_basic(client)
+    tag = client.get('/graph').headers['etag']
+    version = client.get('/graph/changes', params={'since': 0}).json()['version']
+    hood = client.get('/graph/neighborhood', params={'entity_id': a['id'], 'limit': 1}).json()
+    # drag saves are laid over reads right away but logged once, by the flush
+    for x in range(5):
+        client.put('/graph/positions', json=[{'id':a['id'],'x':x,'y':20},{'id':b['id'],'x':30,'y':40}])
+    graph = client.get('/graph')
+    assert next(n for n in graph.json()['nodes'] if n['id']==a['id'])['x'] == 4
+    assert graph.headers['etag'] != tag
+    assert client.get('/graph', headers={'If-None-Match': graph.headers['etag']}).status_code == 304
+    changes = client.get('/graph/changes', params={'since': version}).json()
+    assert (changes['version'], changes['changes']) == (version, [])
+    assert {'id': a['id'], 'x': 4, 'y': 20} in changes['positions']
+    assert client.portal.call(flush_positions) == 2
+    changes = client.get('/graph/changes', params={'since': version}).json()
+    assert changes['version'] == version + 1 and changes['positions'] == []
+    # neighbourhood cursors only care about structure
+    params = {'entity_id': a['id'], 'limit': 1, 'cursor': hood['nextCursor']}
+    assert client.get('/graph/neighborhood', params=params).status_code == 200
+    client.patch(f"/entities/{b['id']}", json={'notes': 'moved on'})
+    assert client.get('/graph/neighborhood', params=params).status_code == 409
+
+def test_positions_write_behind(client):
+    g,a,b = _mk_basic(client)
+    assert client.put('/graph/positions', json=[{'id':a['id'],'x':1.5,'y':2.5}]).json() == {'updated': 1}
+    # a freshly loaded snapshot overlays positions that haven't been flushed yet
+    graph_snapshot._snapshot = None
+    node_a = next(n for n in client.get('/graph').json()['nodes'] if n['id']==a['id'])
+    assert (node_a['x'], node_a['y']) == (1.5, 2.5)
+    assert client.portal.call(flush_positions) == 1
+    with ENGINE.connect() as conn:
+        row = conn.execute(text('SELECT pos_x, pos_y FROM entities WHERE id = :id'), {'id': a['id']}).one()
+    assert tuple(row) == (1.5, 2.5)
+
 def test_csv_round_trip(client):
     # seed some data
     g,a,b = _mk_basic(client)
-    exported = client.get('/csv/export').json()
-    zbytes = bytes.fromhex(exported['content'])
+    exported = client.get('/csv/export')
+    assert exported.headers['content-type'] == 'application/zip'
+    zbytes = exported.content
+    legacy = zipfile.ZipFile(io.BytesIO(bytes.fromhex(client.get('/csv/export', params={'format': 'json'}).json()['content'])))
+    assert legacy.read('people.csv') == zipfile.ZipFile(io.BytesIO(zbytes)).read('people.csv')
     # reset handled automatically by fixture between tests
     # unzip
     zf = zipfile.ZipFile(io.BytesIO(zbytes))
@@ -43,3 +93,288 @@ def test_csv_round_trip(client):
     assert r.status_code == 200
     graph2 = client.get('/graph').json()
     assert len(graph2['nodes']) >= 2
+
+def test_csv_import_resolves_parents_and_dedupes(client, monkeypatch):
+    monkeypatch.setattr(csv_io, 'CHUNK_SIZE', 7)  # force records and quoted fields across chunk boundaries
+    files = {
+        'groups_file': ('groups.csv', b'name,description,color_hex,parent_group_name\nRoot,,,\nChild,"a, b",#ff0000,Root\n', 'text/csv'),
+        'people_file': ('people.csv', 'name,contact_email,contact_phone,notes,main_group_name,groups\nAnn,ann@x.io,,"line one\nline two",Child,Child;Root\nBob,,,,,Root\nAnn again,ann@x.io,,,,Root\n'.encode(), 'text/csv'),
+        'connections_file': ('connections.csv', b'a_identifier,b_identifier,label\nann@x.io,Bob,first\nBob,Ann,dup\nBob,Bob,self\nBob,nobody,\n', 'text/csv'),
+    }
+    r = client.post('/csv/import', files=files)
+    assert r.json() == {'imported': True, 'groups': 2, 'people': 2, 'connections': 1}
+    graph = client.get('/graph').json()
+    groups = {grp['name']: grp for grp in graph['groups']}
+    assert groups['Child']['parentId'] == groups['Root']['id']
+    ann = next(n for n in graph['nodes'] if n['name'] == 'Ann')
+    assert ann['mainGroupId'] == groups['Child']['id']
+    assert sorted(ann['groupIds']) == sorted([groups['Child']['id'], groups['Root']['id']])
+    assert [link['label'] for link in graph['links']] == ['first']
+    with ENGINE.connect() as conn:
+        notes = conn.execute(text('SELECT notes FROM entities WHERE id = :id'), {'id': ann['id']}).scalar()
+    assert notes == 'line one\nline two'
+    assert len(client.get(f"/groups/{groups['Root']['id']}/members", params={'recursive': 'true'}).json()) == 2
+    cyclic = dict(files, groups_file=('groups.csv', b'name,description,color_hex,parent_group_name\nRoot,,,Child\n', 'text/csv'))
+    assert client.post('/csv/import', files=cyclic).status_code == 400
+
+def test_graph_neighborhood(client):
+    ids = [client.post('/entities/', json={'name': n, 'groups_in': [], 'connected_people': []}).json()['id'] for n in 'ABCDE']
+    a, b, c, d, e = ids
+    for x, y in [(a, b), (b, c), (c, d), (a, e), (b, e)]:
+        client.post('/edges', json={'a_id': x, 'b_id': y})
+    hood = client.get('/graph/neighborhood', params={'entity_id': a, 'depth': 2}).json()
+    assert [n['id'] for n in hood['nodes']] == [a, b, e, c]
+    assert len(hood['links']) == 4 and not hood['truncated'] and hood['nextCursor'] is None
+    # walk it a page at a time; every link shows up exactly once
+    pages, cursor = [], None
+    while True:
+        params = {'entity_id': a, 'depth': 2, 'limit': 1, **({'cursor': cursor} if cursor else {})}
+        page = client.get('/graph/neighborhood', params=params).json()
+        pages.append(page)
+        cursor = page['nextCursor']
+        if cursor is None:
+            break
+    assert [p['nodes'][0]['id'] for p in pages] == [a, b, e, c]
+    assert sorted(link['id'] for p in pages for link in p['links']) == sorted(link['id'] for link in hood['links'])
+    capped = client.get('/graph/neighborhood', params={'entity_id': a, 'depth': 3, 'fanout': 1}).json()
+    assert [n['id'] for n in capped['nodes']] == [a, b, c, d] and capped['truncated']
+    assert client.get('/graph/neighborhood', params={'entity_id': a, 'depth': 3, 'max_nodes': 2}).json()['truncated']
+
+def test_graph_layout_job(client):
+    g,a,b = _mk_basic(client)
+    client.put('/graph/positions', json=[{'id':a['id'],'x':0,'y':0}])
+    started = client.post('/graph/layout', params={'iterations': 20})
+    assert started.status_code == 202 and started.json()['nodes'] == 2
+    deadline = time.time() + 10
+    while (job := client.get(f"/graph/layout/{started.json()['id']}").json())['status'] == 'running':
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert job['status'] == 'done' and job['progress'] == 1 and job['done'] == 20
+    nodes = client.get('/graph').json()['nodes']
+    assert all(n['x'] is not None and n['y'] is not None for n in nodes)
+    assert client.get('/graph/layout/unknown').status_code == 404
+
+def test_graph_analytics(client, monkeypatch):
+    ids = [client.post('/entities/', json={'name': n, 'groups_in': [], 'connected_people': []}).json()['id'] for n in 'ABCDEF']
+    a, b, c, d, e, f = ids
+    for x, y in [(a, b), (a, c), (a, d), (d, e)]:
+        client.post('/edges', json={'a_id': x, 'b_id': y})
+    summary = client.get('/graph/analytics').json()
+    assert (summary['nodes'], summary['edges'], summary['components'], summary['largestComponent'], summary['isolated']) == (6, 4, 2, 5, 1)
+    degree = client.get('/graph/analytics/degree', params={'limit': 2}).json()['top']
+    assert [(n['name'], n['value']) for n in degree] == [('A', 3), ('D', 2)]
+    between = client.get('/graph/analytics/betweenness', params={'limit': 1}).json()['top'][0]
+    assert (between['id'], between['value']) == (a, 5)
+    assert client.get('/graph/analytics/pagerank', params={'limit': 1}).json()['top'][0]['id'] == a
+    comps = client.get('/graph/analytics/components', params={'members': 10}).json()
+    assert [(cc['size'], sorted(cc['members'])) for cc in comps['components']] == [(5, sorted([a, b, c, d, e])), (1, [f])]
+    # a new graph version is computed again, here in the process pool
+    monkeypatch.setattr(analytics, 'INLINE_EDGES', 0)
+    client.post('/edges', json={'a_id': e, 'b_id': f})
+    assert client.get('/graph/analytics').json()['components'] == 1
+
+def test_graph_path(client):
+    me = client.post('/entities/', json={'name': 'Me', 'is_current_user': True, 'groups_in': [], 'connected_people': []}).json()['id']
+    ids = [client.post('/entities/', json={'name': n, 'groups_in': [], 'connected_people': []}).json()['id'] for n in 'ABCDE']
+    a, b, c, d, e = ids
+    for x, y in [(me, a), (a, b), (b, c), (me, d), (d, c), (me, b)]:
+        client.post('/edges', json={'a_id': x, 'b_id': y})
+    one = client.get('/graph/path', params={'to': c}).json()
+    assert len(one['paths']) == 1 and not one['timedOut']
+    path = one['paths'][0]
+    assert [n['id'] for n in path['nodes']][::2] == [me, c] and len(path['links']) == 2
+    several = client.get('/graph/path', params={'from': me, 'to': c, 'k': 5}).json()['paths']
+    assert sorted([n['name'] for n in p['nodes']] for p in several) == [['Me', 'A', 'B', 'C'], ['Me', 'B', 'C'], ['Me', 'D', 'C']]
+    assert [len(p['links']) for p in several] == [2, 2, 3]
+    assert client.get('/graph/path', params={'to': c, 'k': 5, 'max_depth': 2}).json()['paths'][-1]['nodes'][-1]['id'] == c
+    assert len(client.get('/graph/path', params={'to': c, 'k': 5, 'max_depth': 2}).json()['paths']) == 2
+    assert client.get('/graph/path', params={'to': e}).json()['paths'] == []
+    assert client.get('/graph/path', params={'from': e, 'to': e}).json()['paths'][0]['links'] == []
+
+def test_batch(client, max_queries):
+    client.get('/graph')  # warm the snapshot
+    team, a, b, c = (str(uuid.uuid4()) for _ in range(4))
+    ops = [
+        {'op': 'create', 'type': 'group', 'id': team, 'data': {'name': 'Team'}},
+        *({'op': 'create', 'type': 'entity', 'id': eid, 'data': {'name': name}} for eid, name in [(a, 'A'), (b, 'B'), (c, 'C')]),
+        *({'op': 'create', 'type': 'membership', 'entity_id': eid, 'group_id': team} for eid in (a, b, c)),
+        {'op': 'create', 'type': 'edge', 'a_id': a, 'b_id': b},
+        {'op': 'create', 'type': 'edge', 'a_id': c, 'b_id': b, 'label': 'x'},
+        {'op': 'create', 'type': 'edge', 'a_id': b, 'b_id': a},
+        {'op': 'update', 'type': 'entity', 'id': c, 'data': {'notes': 'new'}},
+        {'op': 'delete', 'type': 'edge', 'a_id': b, 'b_id': c},
+    ]
+    before = client.get('/graph/changes', params={'since': 0}).json()['version']
+    with max_queries(25):
+        r = client.post('/batch', json=ops)
+    assert r.status_code == 200, r.text
+    results = r.json()['results']
+    assert len(results) == len(ops) and results[0] == {'id': team}
+    assert [res['created'] for res in results[7:10]] == [True, True, False] and results[7]['id'] == results[9]['id']
+    assert results[-1] == {'deleted': True}
+    assert client.get('/graph/changes', params={'since': 0}).json()['version'] == before + 1
+    graph = client.get('/graph').json()
+    nodes = {n['name']: n for n in graph['nodes']}
+    assert all(nodes[n]['mainGroupId'] == team and nodes[n]['groupIds'] == [team] for n in 'ABC')
+    assert nodes['C']['notes'] == 'new'
+    assert [(link['source'], link['target']) for link in graph['links']] == [tuple(sorted([a, b]))]
+    assert sorted(graph['groups'][0]['memberIds']) == sorted([a, b, c])
+    # deleting the group reassigns main groups; any failure rolls everything back
+    other = str(uuid.uuid4())
+    failing = [
+        {'op': 'create', 'type': 'group', 'id': other, 'data': {'name': 'Other'}},
+        {'op': 'update', 'type': 'entity', 'id': str(uuid.uuid4()), 'data': {'name': 'ghost'}},
+    ]
+    assert client.post('/batch', json=failing).status_code == 404
+    assert [g['name'] for g in client.get('/graph').json()['groups']] == ['Team']
+    ok = client.post('/batch', json=[
+        {'op': 'create', 'type': 'group', 'id': other, 'data': {'name': 'Other'}},
+        {'op': 'create', 'type': 'membership', 'entity_id': a, 'group_id': other},
+        {'op': 'delete', 'type': 'group', 'id': team},
+        {'op': 'delete', 'type': 'entity', 'id': c},
+    ]).json()['results']
+    assert ok[2:] == [{'deleted': True}, {'deleted': True}]
+    nodes = {n['name']: n for n in client.get('/graph').json()['nodes']}
+    assert set(nodes) == {'A', 'B'} and nodes['A']['mainGroupId'] == other and nodes['B']['mainGroupId'] is None
+    assert client.post('/batch', json=[{'op': 'merge', 'type': 'entity'}]).status_code == 400
+
+def test_batch_create_current_user(client):
+    me = str(uuid.uuid4())
+    r = client.post('/batch', json=[
+        {'op': 'create', 'type': 'entity', 'id': me, 'data': {'name': 'Me', 'is_current_user': True}},
+        {'op': 'create', 'type': 'entity', 'data': {'name': 'Other'}},
+    ])
+    assert r.status_code == 200, r.text
+    nodes = {n['name']: n for n in client.get('/graph').json()['nodes']}
+    assert nodes['Me']['id'] == me and nodes['Me']['isCurrentUser'] is True
+    assert nodes['Other']['isCurrentUser'] is False
+
+def test_graph_reflects_patched_edits(client):
+    g,a,b = _mk_basic(client)
+    client.get('/graph')  # warm the snapshot
+    edge_id = next(link['id'] for link in client.get('/graph').json()['links'])
+    client.patch(f"/edges/{edge_id}", json={'label':'friends'})
+    client.put('/graph/positions', json=[{'id':a['id'],'x':1,'y':2}])
+    g2 = client.post('/groups/', json={'name':'G2', 'parent_group_id': g['id']}).json()
+    client.delete(f"/groups/{g['id']}")
+    graph = client.get('/graph').json()
+    assert next(link for link in graph['links'] if link['id']==edge_id)['label'] == 'friends'
+    node_a = next(n for n in graph['nodes'] if n['id']==a['id'])
+    assert (node_a['x'], node_a['y']) == (1, 2)
+    assert node_a['groupIds'] == [] and node_a['mainGroupId'] is None
+    assert [grp['id'] for grp in graph['groups']] == [g2['id']]
+    assert graph['groups'][0]['parentId'] is None
+
+def test_change_log_follows_committed_rows(client, monkeypatch):
+    g,a,b = _mk_basic(client)
+    client.get('/graph')  # warm the snapshot
+    names = lambda: {n['id']: n for n in client.get('/graph').json()['nodes']}
+    # a writer that committed first but logs last can't log its stale value over the newer commit
+    with ENGINE.begin() as conn:
+        first = conn.execute(text("SELECT nextval('graph_change_seq')")).scalar()
+    client.patch(f"/entities/{a['id']}", json={'name': 'new'})
+    client.portal.call(graph_snapshot.record_change, {'nodes': [{'id': a['id'], 'name': 'old'}]}, first)
+    assert names()[a['id']]['name'] == 'new'
+    # a failed append logs a reset rather than losing the edit
+    append = graph_snapshot.append_change
+    async def flaky(change, seq=None):
+        if change is not None:
+            raise ConnectionError('redis went away')
+        return await append(change, seq)
+    monkeypatch.setattr(graph_snapshot, 'append_change', flaky)
+    client.patch(f"/entities/{b['id']}", json={'name': 'B2'})
+    monkeypatch.undo()
+    assert names()[b['id']]['name'] == 'B2'
+    # an edit that never reached the log at all is caught by the verifier
+    with ENGINE.begin() as conn:
+        conn.execute(text("UPDATE entities SET notes = 'direct' WHERE id = :id"), {'id': a['id']})
+    assert client.portal.call(graph_snapshot.verify_snapshot) is True
+    assert names()[a['id']]['notes'] == 'direct'
+    assert client.portal.call(graph_snapshot.verify_snapshot) is False
+
+def test_graph_serves_stale_while_rebuilding(client):
+    g,a,b = _mk_basic(client)
+    before = client.get('/graph').json()
+    r = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    r.set(LOCK_KEY, 'other-worker', px=5000)  # another worker is rebuilding
+    try:
+        client.post('/entities/', json={'name':'C','groups_in':[g['id']], 'connected_people':[]})
+        assert client.get('/graph').json() == before
+    finally:
+        r.delete(LOCK_KEY)
+    assert len(client.get('/graph').json()['nodes']) == 3
+
+def test_graph_etag_not_modified(client):
+    g,a,b = _mk_basic(client)
+    r = client.get('/graph')
+    tag = r.headers['etag']
+    r2 = client.get('/graph', headers={'If-None-Match': tag})
+    assert r2.status_code == 304 and r2.content == b''
+    client.patch(f"/entities/{a['id']}", json={'name':'A2'})
+    r3 = client.get('/graph', headers={'If-None-Match': tag})
+    assert r3.status_code == 200 and r3.headers['etag'] != tag
+    assert any(n['name']=='A2' for n in r3.json()['nodes'])
+    # Redis lost everything and the counter climbed back to the same number: not the same graph
+    r = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    version = int(r.get('graph:version'))
+    r.flushdb()
+    r.set('graph:version', version)
+    r4 = client.get('/graph', headers={'If-None-Match': r3.headers['etag']})
+    assert r4.status_code == 200 and r4.headers['etag'] != r3.headers['etag']
+
+def test_server_timing_header(client):
+    _mk_basic(client)
+    timing = client.get('/graph').headers['server-timing']
+    metrics = {part.split(';')[0] for part in timing.split(', ')}
+    assert {'cache', 'db', 'ser', 'total'} <= metrics
+
+def test_metrics_endpoint(client):
+    _mk_basic(client)
+    client.get('/graph')
+    client.get('/graph')
+    body = client.get('/metrics').text
+    assert 'http_request_duration_seconds_count{method="GET",route="/graph",status="200"}' in body
+    assert 'graph_cache_requests_total{result="hit_local"}' in body
+    assert 'db_pool_checkout_wait_seconds_count' in body
+
+def test_read_query_budgets(client, max_queries):
+    g,a,b = _mk_basic(client)
+    client.get('/graph')
+    with max_queries(0):
+        client.get('/graph')  # served from the worker's cached body
+    with max_queries(1):
+        client.get('/entities', params={'group_id': g['id'], 'fields': 'id,name'})
+    with max_queries(0):
+        client.get('/graph/neighborhood', params={'entity_id': a['id'], 'depth': 2})
+
+def test_telemetry_batch(client, monkeypatch):
+    r = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+    r.delete(telemetry.STREAM_KEY)
+    monkeypatch.setattr(telemetry, 'FLUSH_INTERVAL', 0)
+    events = [{'type': 'drawer_open', 'ts': 1, 'data': {'id': 'x'}}, {'type': 'zoom', 'ts': 2}, {'ts': 3}]
+    resp = client.post('/telemetry/batch', json=events)
+    assert resp.status_code == 202 and resp.json() == {'accepted': 2, 'invalid': 1}
+    for _ in range(100):
+        if r.xlen(telemetry.STREAM_KEY) == 2:
+            break
+        time.sleep(0.01)
+    assert r.xlen(telemetry.STREAM_KEY) == 2
+    # the legacy single-event endpoint still takes free-form events
+    assert client.post('/telemetry', json={'event': 'click'}).json() == {'accepted': True}
+    # backpressure: a batch the queue can't hold is refused whole
+    monkeypatch.setattr(telemetry, '_queue', asyncio.Queue(1))
+    assert client.post('/telemetry/batch', json=events).status_code == 429
+
+def test_graph_change_feed(client):
+    g,a,b = _mk_basic(client)
+    start = client.get('/graph/changes', params={'since': 0}).json()['version']
+    client.patch(f"/entities/{a['id']}", json={'name':'A2'})
+    client.delete(f"/entities/{b['id']}")
+    feed = client.get('/graph/changes', params={'since': start}).json()
+    assert not feed['full'] and feed['version'] == start + 2
+    assert feed['changes'][0]['nodes'][0]['name'] == 'A2'
+    assert feed['changes'][1]['removedNodes'] == [b['id']]
+    assert client.get('/graph/changes', params={'since': feed['version']}).json()['changes'] == []
+    # a version from the future (e.g. after a Redis reset) falls back to the full graph
+    full = client.get('/graph/changes', params={'since': feed['version'] + 100}).json()
+    assert full['full'] and [n['id'] for n in full['graph']['nodes']] == [a['id']]
@@ -1,14 +1,31 @@
 export interface TelemetryEvent { type:string; ts:number; data?:any }
 
-export async function sendEvent(e: TelemetryEvent) {
-  const base = process.env.NEXT_PUBLIC_API_BASE!;
-  try {
-    await fetch(`${base}/telemetry`, { method:'POST', body: JSON.stringify(e), headers:{'Content-Type':'application/json'} });
-  } catch {
+// Events are buffered and sent together to /telemetry/batch: one request per
+// FLUSH_MS (or per MAX_BATCH events) instead of one per event.
+const FLUSH_MS = 2000;
+const MAX_BATCH = 50;
+const pending: TelemetryEvent[] = [];
+let timer: ReturnType<typeof setTimeout> | undefined;
+
+export function flush() {
+  if (timer) { clearTimeout(timer); timer = undefined; }
+  if (!pending.length) return;
+  const url = `${process.env.NEXT_PUBLIC_API_BASE!}/telemetry/batch`;
+  const body = JSON.stringify(pending.splice(0));
+  // sendBeacon survives page unload; fetch keepalive is the fallback. text/plain
+  // keeps the beacon a simple CORS request (the API parses the body either way)
+  if (typeof navigator !== 'undefined' && navigator.sendBeacon?.(url, new Blob([body], { type: 'text/plain' }))) return;
+  fetch(url, { method:'POST', body, headers:{'Content-Type':'application/json'}, keepalive: true }).catch(() => {
     // swallow
-  }
+  });
 }
 
 export function event(type: string, data?: any) {
-  sendEvent({ type, ts: Date.now(), data });
+  pending.push({ type, ts: Date.now(), data });
+  if (pending.length >= MAX_BATCH) flush();
+  else if (!timer) timer = setTimeout(flush, FLUSH_MS);
+}
+
+if (typeof window !== 'undefined') {
+  window.addEventListener('pagehide', flush);
 }